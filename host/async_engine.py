@@ -0,0 +1,327 @@
+import asyncio
+import io
+import logging
+import threading
+import time
+import serial as ser
+import test
+import frames
+from test import (parse_responses, wire_time, SERIAL_TIMEOUT, FLASH_READ_TIMEOUT, FlashVerifyCommand, EchoCommand, DioCheckCommand, DioStartCommands, DioDefaultPhase,
+                  BramCheckCommand, BramStartCommands, BramControlCommand, bram_monitor, FlashIdCommand, MouseCheckCommand, XadcCommand, XadcBurstCommand, flash_read)
+
+# asyncio version of the test_obj.run_test loop. Every check is a coroutine with its own period and timeout, all of them
+# sharing one serial transport, and any number of boards can be driven from the same event loop. Nothing blocks: the
+# port is polled (or watched through the event loop where the platform allows it), Vivado runs from a thread that a
+# cancellation stops, and a stop is a plain task.cancel() that takes effect at the next await.
+#   python async_engine.py --boards 2 --cycles 5
+
+POLL_INTERVAL = 0.002 # how often the port is checked while a response is outstanding, when it can't be watched instead
+
+class async_port:
+    # Async wrapper around a serial.Serial (or board_sim) opened with timeout=0, carrying the same command batches as
+    # test.transact. Transactions are serialized, so checks running concurrently never interleave their bytes on the wire.
+    def __init__(self, port, poll_interval=POLL_INTERVAL):
+        self.port = port
+        self.poll_interval = poll_interval
+        self.lock = asyncio.Lock()
+        self.buffer = bytearray()
+        self.readable = asyncio.Event()
+        self.resync = False
+        self.binary = False # send batches as frames of the binary protocol, see frames.py
+        self.latency = None # an instrument.latency_stats to record the time taken by every command in
+        self.fileno = None
+        try:
+            # selector event loops can wake up on incoming data; the Windows proactor loop and board_sim can't
+            fileno = port.fileno()
+            asyncio.get_running_loop().add_reader(fileno, self.readable.set)
+            self.fileno = fileno
+        except (AttributeError, NotImplementedError, io.UnsupportedOperation, ValueError):
+            pass
+
+    def _drain(self):
+        waiting = self.port.in_waiting
+        if waiting: self.buffer += self.port.read(waiting)
+
+    async def _wait(self, timeout):
+        if self.fileno is None:
+            await asyncio.sleep(min(timeout, self.poll_interval))
+            return
+        self.readable.clear()
+        try:
+            await asyncio.wait_for(self.readable.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def read_exactly(self, size, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            self._drain()
+            remaining = deadline - loop.time()
+            if len(self.buffer) >= size or remaining <= 0: break
+            await self._wait(remaining)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    async def read_responses(self, sent, timeout):
+        # as test.read_responses
+        expected = sum(c.response_size for c in sent)
+        if self.latency is None:
+            return await self.read_exactly(expected, timeout)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        raw = bytearray()
+        last = time.perf_counter()
+        for c in sent:
+            if c.response_size == 0: continue
+            response = await self.read_exactly(c.response_size, max(0.0, deadline - loop.time()))
+            raw += response
+            if len(response) < c.response_size:
+                self.latency.timeout(c.name)
+                break
+            now = time.perf_counter()
+            self.latency.record(c.name, now - last, now - last - wire_time(self.port, c.response_size))
+            last = now
+        return bytes(raw)
+
+    async def _resync(self):
+        # A transaction was cut short, so the rest of its response may still be on its way. Wait for the line to go quiet
+        # and throw away whatever arrived, so it isn't taken for the response to the next batch.
+        while True:
+            self.buffer.clear()
+            await asyncio.sleep(SERIAL_TIMEOUT)
+            self._drain()
+            if not self.buffer: break
+        self.resync = False
+
+    async def transact(self, commands, timeout=SERIAL_TIMEOUT, binary=None):
+        # timeout is the allowance for the firmware to start answering, on top of the transfer time and the commands' own
+        # processing time. binary=False sends hex commands even once the binary protocol is negotiated.
+        binary = self.binary if binary is None else binary
+        async with self.lock:
+            if self.resync: await self._resync()
+            sent = frames.to_binary(commands) if binary else commands
+            request = b''.join(c.request for c in sent)
+            expected = sum(c.response_size for c in sent)
+            self.port.write(request)
+            try:
+                raw = await self.read_responses(sent, timeout + sum(c.busy for c in sent) + wire_time(self.port, len(request) + expected))
+            except asyncio.CancelledError:
+                self.resync = True
+                raise
+            if len(raw) < expected:
+                logging.error(f"Serial read timed out: received {len(raw)} of {expected} bytes")
+                self.resync = True
+            if binary:
+                return frames.parse_frame_responses(sent, raw)
+            return parse_responses(commands, raw)
+
+    def close(self):
+        if self.fileno is not None:
+            asyncio.get_running_loop().remove_reader(self.fileno)
+            self.fileno = None
+        self.port.close()
+
+class check:
+    def __init__(self, name, run, period, timeout):
+        self.name = name
+        self.run = run # coroutine function doing one round of the check
+        self.period = period
+        self.timeout = timeout
+
+class check_scheduler:
+    # Runs every check on its own period until cancelled. A round that overruns its timeout is cancelled and logged, and
+    # the check carries on with its next round. Rounds that fall behind are skipped rather than run back to back.
+    def __init__(self, name="", cycle_period=1.0, on_cycle=None):
+        self.name = name
+        self.cycle_period = cycle_period
+        self.on_cycle = on_cycle # called at the end of every cycle period, e.g. to close a telemetry record
+        self.checks = []
+    def add(self, name, run, period, timeout=None):
+        self.checks.append(check(name, run, period, period if timeout is None else timeout))
+    async def run_check(self, c):
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        while True:
+            try:
+                await asyncio.wait_for(c.run(), c.timeout)
+            except asyncio.TimeoutError:
+                logging.error(f"{self.name}{c.name} timed out after {c.timeout} seconds")
+            next_time = max(next_time + c.period, loop.time())
+            await asyncio.sleep(next_time - loop.time())
+    async def mark_cycles(self):
+        # keeps the "Cycle N starting" markers that the GUI log view splits its blocks on
+        cycle = 0
+        while True:
+            if cycle > 0 and self.on_cycle is not None: self.on_cycle()
+            cycle += 1
+            logging.info(f"{self.name}Cycle {cycle} starting")
+            await asyncio.sleep(self.cycle_period)
+    async def run(self):
+        await asyncio.gather(self.mark_cycles(), *(self.run_check(c) for c in self.checks))
+
+class async_test_engine:
+    # Runs a test_obj that has been through setup_test. As with run_test, init_sequence can be raised to skip the QSPI
+    # and bitstream programming steps.
+    def __init__(self, obj: test.test_obj, name="", periods={}, timeouts={}):
+        self.obj = obj
+        self.name = name
+        self.periods = periods # per check overrides of obj.cycle_period, by check name
+        self.timeouts = timeouts
+        self.port = None
+
+    async def program(self):
+        # The programming steps of test_obj, in a thread: the same path as the blocking engine, so the QSPI pattern file is
+        # generated, programmed and its seed saved under the JTAG lock, which engines of other boards on this loop share.
+        # A cancel sets the stop event, which kills Vivado, and waits for the step to return.
+        obj = self.obj
+        if obj.stop_event is None: obj.stop_event = threading.Event()
+        for step in (obj.write_qspi, obj.program_device)[obj.init_sequence:2]:
+            task = asyncio.ensure_future(asyncio.to_thread(step))
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                obj.stop_event.set()
+                await asyncio.gather(task, return_exceptions=True)
+                raise
+            obj.init_sequence += 1
+
+    async def connect(self):
+        obj = self.obj
+        logging.info(f"Connecting to board on port {obj.com_port}")
+        try:
+            self.port = async_port(obj.port_factory(port=obj.com_port, baudrate=115200, timeout=0))
+        except ser.SerialException:
+            logging.error(f"Failed to connect to {obj.com_port}")
+            return False
+        obj.port = self.port.port
+        self.port.latency = obj.latency
+        if obj.check_qspi:
+            passed, = await self.port.transact([FlashVerifyCommand(obj.qspi_seed)], FLASH_READ_TIMEOUT)
+            obj.qspi_checked(passed)
+            if obj.init_sequence == 0:
+                self.port.close()
+                self.port = None
+                await self.program()
+                return await self.connect()
+        if obj.binary_protocol:
+            version, = await self.port.transact([frames.hello_command()])
+            obj.protocol = "binary" if frames.negotiated(self.port.port, version) else "hex"
+            self.port.binary = obj.protocol == "binary"
+        obj.phase = DioDefaultPhase(obj.dio_divider)
+        logging.info(f"Starting DIO with settings: mode:{obj.dio_mode}, phase:{obj.phase}, divider:{obj.dio_divider}")
+        await self.port.transact(DioStartCommands(obj.dio_mode, obj.phase, obj.dio_divider))
+        logging.info(f"DIO counter output frequency is set to {100_000_000 / (2 * (obj.dio_divider + 1))} MHz")
+        logging.info(f"DIO readback phase count is set to {obj.phase} / {obj.dio_divider}")
+        if obj.enable_bram_test:
+            obj.bram_monitor = bram_monitor() if obj.bram_continuous else None
+            obj.bram_started = False
+            commands = [BramControlCommand(obj.bram_continuous, True)]
+            if obj.bram_continuous: commands += BramStartCommands(obj.bram_both_banks, obj.bram_max_address, obj.bram_repeats)
+            await self.port.transact(commands)
+        obj.init_sequence = 3
+        return True
+
+    def record(self, commands, results):
+        self.obj.record(commands, results)
+        if self.obj.telemetry is not None: self.obj.telemetry.add(commands, results)
+
+    def batch(self, make_commands, binary=None):
+        async def run():
+            commands = make_commands()
+            self.record(commands, await self.port.transact(commands, binary=binary))
+        return run
+
+    async def flash_check(self):
+        # collects the verification started last round and starts the next one, as cycle_commands does
+        obj = self.obj
+        commands = []
+        if obj.flash_read is not None: commands.append(obj.flash_read.poll_command())
+        next_flash_read = flash_read(obj.qspi_seed)
+        commands.append(next_flash_read.start_command())
+        self.record(commands, await self.port.transact(commands))
+        if obj.flash_read is None or obj.flash_read.done:
+            obj.flash_read = next_flash_read
+
+    def scheduler(self):
+        obj = self.obj
+        def bram_commands():
+            # as in cycle_commands, a one-shot test is checked before the next one is started
+            if obj.bram_continuous: return obj.bram_monitor.commands()
+            commands = [BramCheckCommand()] if obj.bram_started else []
+            obj.bram_started = True
+            return commands + BramStartCommands(obj.bram_both_banks, obj.bram_max_address, obj.bram_repeats)
+        checks = [
+            ("TestEcho",    obj.enable_uart_echo,    self.batch(lambda: [EchoCommand(obj.uart_echo_size, obj.echo_stats)])),
+            ("CheckDio",    obj.enable_dio_test,     self.batch(lambda: [DioCheckCommand()])),
+            ("CheckBram",   obj.enable_bram_test,    self.batch(bram_commands)),
+            ("FlashRead",   obj.enable_flash_verify, self.flash_check),
+            ("FlashReadId", obj.enable_flash_id,     self.batch(lambda: [FlashIdCommand()])),
+            ("CheckMouse",  obj.enable_mouse,        self.batch(lambda: [MouseCheckCommand()])),
+            ("ReadXadc",    obj.enable_xadc,         self.batch(lambda: [XadcCommand()])),
+            ("XadcBurst",   obj.enable_xadc_burst,   self.batch(lambda: [XadcBurstCommand(obj.xadc_burst_samples, obj.xadc_burst_decimation)], binary=False)),
+        ]
+        scheduler = check_scheduler(self.name, obj.cycle_period, obj.telemetry.end_cycle if obj.telemetry is not None else None)
+        for name, enabled, run in checks:
+            if enabled:
+                scheduler.add(name, run, self.periods.get(name, obj.cycle_period), self.timeouts.get(name))
+        return scheduler
+
+    async def run(self):
+        try:
+            await self.program()
+            if not await self.connect(): return
+            await self.scheduler().run()
+        finally:
+            if self.port is not None:
+                self.port.close()
+                self.port = None
+            self.obj.port = None
+            self.obj.stop_test() # with the port closed already, only logs the echo and latency totals of the run
+
+def pump_event_loop(root, loop, interval_ms=10):
+    # Runs the asyncio loop from inside a Tk mainloop: every interval_ms, whatever is ready on the loop gets to run and
+    # control goes straight back to Tk. Returns a function that stops the pump.
+    state = {"after": None}
+    def pump():
+        loop.call_soon(loop.stop)
+        loop.run_forever()
+        state["after"] = root.after(interval_ms, pump)
+    def stop():
+        if state["after"] is not None: root.after_cancel(state["after"])
+        state["after"] = None
+    pump()
+    return stop
+
+if __name__ == '__main__':
+    import argparse
+    from benchmark import make_settings, CHECKS
+    from board_sim import board_sim
+
+    parser = argparse.ArgumentParser(description="Run the async engine against simulated boards")
+    parser.add_argument("--boards", type=int, default=1)
+    parser.add_argument("--cycles", type=int, default=5, help="run time in cycle periods")
+    parser.add_argument("--cycle-period", type=float, default=1.0)
+    parser.add_argument("--usb-latency", type=float, default=0.016)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    async def main():
+        engines = []
+        for i in range(args.boards):
+            sim = board_sim(port=f"sim{i}", usb_latency=args.usb_latency)
+            obj = test.test_obj()
+            obj.setup_test(make_settings(set(CHECKS.values())))
+            obj.port_factory = sim.connect
+            obj.cycle_period = args.cycle_period
+            obj.init_sequence = 2 # skip the Vivado programming steps
+            sim.flash_seed = int(obj.qspi_seed)
+            engines.append(async_test_engine(obj, name=f"[sim{i}] "))
+        tasks = [asyncio.ensure_future(e.run()) for e in engines]
+        await asyncio.sleep(args.cycles * args.cycle_period)
+        for t in tasks: t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logging.info("Wrapped up")
+
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+import argparse
+import logging
+import time
+import numpy as np
+import test
+import frames
+from board_sim import board_sim
+
+# Drives test_obj.run_test against board_sim and reports how long each cycle and each check takes, and how many bytes they
+# put on the wire. Runs anywhere, no board needed:
+#   python benchmark.py --cycles 20
+#   python benchmark.py --scenario each --fault dio_error_bits=0x3
+#   python benchmark.py --protocol hex
+
+# checks run by run_test, by the name they are reported under, with the setting that enables them
+CHECKS = {
+    "ReadXadc":    "enable_xadc",
+    "StartBram":   "enable_bram_test",
+    "FlashReadId": "enable_flash_id",
+    "FlashRead":   "enable_flash_verify",
+    "TestEcho":    "enable_uart_echo",
+    "CheckDio":    "enable_dio_test",
+    "CheckMouse":  "enable_mouse",
+    "CheckBram":   "enable_bram_test",
+    "XadcBurst":   "enable_xadc_burst",
+}
+
+def make_settings(enabled, binary_protocol=True):
+    settings = {name: name in enabled for name in set(CHECKS.values())}
+    settings.update(binary_protocol=binary_protocol, com_port="sim")
+    return settings
+
+class check_stats:
+    def __init__(self):
+        self.seconds = []
+        self.tx = 0
+        self.rx = 0
+
+def timed_transact(stats):
+    # Same traffic as test.transact, but each command's response is read on its own so the time between the end of one
+    # response and the end of the next can be charged to that command. In the binary protocol that is each frame, named
+    # after the checks it carries.
+    def transact(port, commands, binary=False, latency=None):
+        sent = frames.to_binary(commands) if binary else commands
+        start = time.perf_counter()
+        port.write(b''.join(c.request for c in sent))
+        results = []
+        for c in sent:
+            raw = test.read_exactly(port, c.response_size, port.timeout + c.busy + test.wire_time(port, c.response_size)) if c.response_size > 0 else b''
+            now = time.perf_counter()
+            s = stats.setdefault(c.name, check_stats())
+            s.seconds.append(now - start)
+            s.tx += len(c.request)
+            s.rx += len(raw)
+            start = now
+            if binary:
+                results += frames.parse_frame_responses([c], raw)
+            else:
+                results += test.parse_responses([c], raw)
+        return results
+    return transact
+
+def run_benchmark(enabled, cycles, baudrate=115200, time_scale=1.0, usb_latency=0.016, cycle_period=0, faults={}, binary_protocol=True):
+    sim = board_sim(baudrate=baudrate, time_scale=time_scale, usb_latency=usb_latency)
+    sim.inject(**faults)
+
+    obj = test.test_obj()
+    obj.setup_test(make_settings(enabled, binary_protocol))
+    obj.port_factory = sim.connect
+    obj.cycle_period = 0 # the benchmark paces cycles itself, so only the checks are measured
+    sim.flash_seed = int(obj.qspi_seed) # as if write_qspi had programmed the board
+    obj.init_sequence = 2 # skip the Vivado programming steps
+    obj.run_test()
+
+    stats = {name: check_stats() for name in CHECKS}
+    originals = {"transact": test.transact}
+    test.transact = timed_transact(stats)
+    cycle_seconds = []
+    cycle_bytes = []
+    try:
+        for _ in range(cycles):
+            count = sim.bytes_written + sim.bytes_read
+            start = time.perf_counter()
+            targettime = start + cycle_period
+            obj.run_test()
+            cycle_seconds.append(time.perf_counter() - start)
+            time.sleep(max(0, targettime - time.perf_counter()))
+            cycle_bytes.append(sim.bytes_written + sim.bytes_read - count)
+    finally:
+        for name, f in originals.items():
+            setattr(test, name, f)
+        obj.stop_test()
+    return sim, np.array(cycle_seconds), np.array(cycle_bytes), stats
+
+def report(title, protocol, sim, cycle_seconds, cycle_bytes, stats):
+    ms = cycle_seconds * 1000
+    print(f"== {title}: {len(ms)} cycles at {sim.baudrate} baud, {protocol} protocol")
+    print(f"cycle latency: mean {ms.mean():.2f} ms, p50 {np.percentile(ms, 50):.2f} ms, p99 {np.percentile(ms, 99):.2f} ms, max {ms.max():.2f} ms")
+    print(f"bytes per cycle: {cycle_bytes.mean():.0f} ({sim.bytes_written} sent, {sim.bytes_read} received in total), RX overruns: {sim.overruns}")
+    print(f"{'check':<12} {'calls':>6} {'mean ms':>9} {'max ms':>9} {'tx B':>6} {'rx B':>6}")
+    for name, s in stats.items():
+        if not s.seconds: continue
+        calls = len(s.seconds)
+        print(f"{name:<12} {calls:>6} {np.mean(s.seconds) * 1000:>9.2f} {np.max(s.seconds) * 1000:>9.2f} {s.tx // calls:>6} {s.rx // calls:>6}")
+    print()
+
+def parse_fault(text):
+    name, value = text.split('=', 1)
+    if value in ("True", "False"): return name, value == "True"
+    return name, float(value) if '.' in value else int(value, 0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the host test stack against a simulated board")
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--time-scale", type=float, default=1.0, help="scale factor for all simulated delays")
+    parser.add_argument("--usb-latency", type=float, default=0.016, help="USB-UART latency timer in seconds, 16 ms is the FTDI driver default")
+    parser.add_argument("--cycle-period", type=float, default=0, help="pause between cycles, lets background checks such as the flash verification finish")
+    parser.add_argument("--scenario", choices=["all", "each"], default="all", help="all checks per cycle, or each check on its own")
+    parser.add_argument("--protocol", choices=["binary", "hex"], default="binary", help="binary falls back to hex if the board doesn't speak it")
+    parser.add_argument("--fault", action="append", default=[], help="inject a board_sim fault, e.g. flash_errors=3")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the test log")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s")
+    faults = dict(parse_fault(f) for f in args.fault)
+
+    scenarios = {"all checks": set(CHECKS.values())}
+    if args.scenario == "each":
+        scenarios = {name: {enable} for name, enable in CHECKS.items() if name != "StartBram"}
+    for title, enabled in scenarios.items():
+        report(title, args.protocol, *run_benchmark(enabled, args.cycles, args.baud, args.time_scale, args.usb_latency, args.cycle_period,
+                                                    faults, args.protocol == "binary"))
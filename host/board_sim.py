@@ -0,0 +1,537 @@
+import math
+import struct
+import time
+import random
+from collections import deque, Counter
+import numpy as np
+import serial as ser
+from lfsr import lfsr_next, lfsr_jump, load_pattern
+import frames
+from flash_dump import DUMP_CHUNK_SIZE, FLASH_ERASED
+from test import (DIO_SETTINGS_ADDR, DIO_STATUS_ADDR, PS2_POS_ADDR, BRAM_SEED_ADDR, BRAM_ADDR_MAX_ADDR, BRAM_STATUS_ADDR,
+                  DIO_COUNTER_MAX_ADDR, DIO_OUTPUT_PHASE_ADDR, BRAM_ADDR_BITS, DIO_MODE_OFF, DIO_MODE_EMISSIONS, QSPI_PATTERN_WORDS,
+                  XADC_SEQUENCE_PERIOD, XADC_BURST_MAX, BRAM_CONTROL_ADDR, BRAM_PASS_COUNT_ADDR, BRAM_FAIL_COUNT_ADDR,
+                  BRAM_ERROR_COUNT_ADDR, BRAM_FIRST_FAIL_ADDR, BRAM_CONTINUOUS, BRAM_CLEAR_COUNTERS, BRAM_FIRST_FAIL_VALID)
+
+# In-process stand-in for the Basys 3 running main.c, exposing the parts of the serial.Serial interface that test.py uses.
+# Timing is modelled in real time: every byte costs 10 bit times on the wire in each direction, commands take a configurable
+# processing time on the MicroBlaze, and the UART Lite's 16-byte FIFOs are modelled so that a host sending while the firmware
+# is busy sees the same receive overruns the real board would produce.
+
+STATUS_ADDR = 0
+XADC_DATA_ADDR = 8
+
+UART_FIFO_DEPTH = 16
+USB_PACKET_SIZE = 62 # payload of a full-speed FTDI bulk packet
+FLASH_ID = 0x1620c2
+FLASH_VALIDATE_WORDS = 128 * 1024 // 4 # VALIDATE_FLASH_SIZE in flash.h
+FLASH_VALIDATE_ROWS = 128 * 1024 // 128 # rows of VALIDATE_ROW_SIZE bytes, one per ValidateStep
+SYS_CLK_HZ = 100_000_000
+STATUS_BRAM_SEED_TREADY = 0x20
+DIO_LOOP_LATENCY = 3 # clocks from the output phase count to the internal reference at the sampling flops: output register, two sync flops
+
+# firmware time spent per command after its last byte is received, in seconds
+PROCESSING_TIME = {
+    'w': 5e-6,
+    'r': 5e-6,
+    'e': 0,
+    'q': 0.25, # ValidateAgainstLfsr over 128 KiB, also the total time of the steps of a background 'v' validation
+    'v': 20e-6,
+    'p': 5e-6,
+    'f': 50e-6,
+    'x': 1e-3, # waiting for the XADC end of sequence
+    'd': 0.25 / FLASH_VALIDATE_ROWS, # per chunk, the same QSPI read as a validation step
+}
+
+FAULTS = {
+    "disconnect":          False, # reads and writes raise SerialException, as on a USB unplug
+    "hang":                False, # firmware stops answering
+    "drop_rate":           0.0,   # probability of losing each byte sent by the board
+    "corrupt_rate":        0.0,   # probability of flipping one bit in each byte sent by the board
+    "dio_error_bits":      0,     # OR'ed into the DIO error bits on every status read
+    "dio_stopped":         False,
+    "dio_delay":           0.0,   # clocks the loopback through the pins lags the internal reference, see _dio_phase_errors
+    "mouse_stale":         False,
+    "mouse_not_connected": False,
+    "mouse_error":         False,
+    "bram_fail":           False,
+    "bram_weak_address":   None,  # address that reads back wrong: tests whose range reaches it fail
+    "bram_upset_rate":     0.0,   # probability of one word reading back wrong in each pass, at a random address
+    "flash_errors":        0,     # number of mismatching words reported by 'q', each with one bit flipped in a dump
+    "flash_id":            None,  # override for the ID returned by 'f'
+}
+
+# nominal XADC readings as 16-bit register values (12-bit result in the top bits)
+XADC_NOMINAL = {
+    "temp":   int((45.0 + 273.15) * 4096 / 503.975),
+    "vccint": int(1.0 / 3.0 * 4096),
+    "vccaux": int(1.8 / 3.0 * 4096),
+    "vbram":  int(1.0 / 3.0 * 4096),
+}
+
+class board_sim:
+    def __init__(self, port="sim", baudrate=115200, timeout=None, time_scale=1.0, usb_latency=0.0, seed=None, **kwargs):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.time_scale = time_scale
+        self.byte_time = 10 / baudrate * time_scale
+        self.usb_latency = usb_latency * time_scale # USB-UART latency timer: a partial packet is held back this long
+        self.processing = dict(PROCESSING_TIME)
+        self.faults = dict(FAULTS)
+        self.rng = random.Random(seed)
+        self.is_open = True
+
+        # board state
+        self.flash_seed = None # seed of the pattern currently programmed into the QSPI flash, None when erased
+        self.dio_divider = None
+        self.dio_phase = None
+        self.dio_mode = None
+        self.dio_errors = 0
+        self.mouse_x = 320
+        self.mouse_y = 240
+        self.mouse_period = 0.02 # time between PS/2 events while the mouse moves
+        self.mouse_last_read = 0
+        self.bram_addr_max = (1 << 31) | (((1 << (31 - BRAM_ADDR_BITS)) - 1) << BRAM_ADDR_BITS) | 0x1fff
+        self.bram_seed = 0
+        self.bram_done_at = None # None while waiting for a seed, infinity while running continuously
+        self.bram_started_at = 0
+        self.bram_passes_seen = 0 # passes of the running test taken into the counters
+        self.bram_run_failed = False
+        self.bram_continuous = False
+        self.bram_counters = {BRAM_PASS_COUNT_ADDR: 0, BRAM_FAIL_COUNT_ADDR: 0, BRAM_ERROR_COUNT_ADDR: 0, BRAM_FIRST_FAIL_ADDR: 0}
+        self.validation_seed = None
+        self.validation_rows_left = 0
+        self.validation_result = None # None until the first 'v'
+
+        # statistics
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.overruns = 0
+        self.commands = Counter()
+
+        # timing: all times are time.monotonic() values
+        self._host_tx_free = 0 # host to board line idle
+        self._board_tx_free = 0 # board to host line idle
+        self._fw_time = 0 # firmware ready for its next receive
+        self._rx_fifo = deque() # times at which the firmware pulls each byte still held in the RX FIFO
+        self._tx_fifo = deque(maxlen=UART_FIFO_DEPTH) # start times of the last bytes shifted out
+        self._out = deque() # [arrival time, byte] not yet read by the host
+        self._packet = [] # entries of _out still waiting for their USB packet to fill up or time out
+
+        self._firmware = self._process_commands()
+        next(self._firmware)
+
+    def inject(self, **faults):
+        for name, value in faults.items():
+            if name not in self.faults:
+                raise KeyError(f"Unknown fault {name}")
+            self.faults[name] = value
+
+    def clear_faults(self):
+        self.faults = dict(FAULTS)
+
+    # serial.Serial interface
+
+    def write(self, data):
+        self._check_link()
+        data = bytes(data)
+        t = max(time.monotonic(), self._host_tx_free)
+        for b in data:
+            t += self.byte_time
+            self._receive_byte(t, b)
+        self._host_tx_free = t
+        self.bytes_written += len(data)
+        return len(data)
+
+    def read(self, size=1):
+        self._check_link()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        data = bytearray()
+        while len(data) < size:
+            now = time.monotonic()
+            while self._out and self._out[0][0] <= now and len(data) < size:
+                data.append(self._out.popleft()[1])
+            if len(data) >= size:
+                break
+            if deadline is not None and now >= deadline:
+                break
+            if not self._out and deadline is None:
+                break # nothing more will ever arrive; a real port would block forever
+            wake = self._out[0][0] if self._out else deadline
+            if deadline is not None: wake = min(wake, deadline)
+            time.sleep(max(0, wake - now))
+        self.bytes_read += len(data)
+        return bytes(data)
+
+    @property
+    def in_waiting(self):
+        now = time.monotonic()
+        return sum(1 for t, _ in self._out if t <= now)
+
+    def reset_input_buffer(self):
+        now = time.monotonic()
+        while self._out and self._out[0][0] <= now:
+            self._out.popleft()
+
+    def flush(self):
+        time.sleep(max(0, self._host_tx_free - time.monotonic()))
+
+    def open(self):
+        # reconnecting to the same board; its state carries over, as the board keeps running while the port is closed
+        if self.faults["disconnect"]:
+            raise ser.SerialException(f"Simulated disconnect of {self.port}, can't open it")
+        self.is_open = True
+
+    def connect(self, port=None, baudrate=None, timeout=None):
+        # a test_obj.port_factory that (re)opens this board
+        self.open()
+        self.timeout = timeout
+        return self
+
+    def close(self):
+        self.is_open = False
+
+    def _check_link(self):
+        if not self.is_open:
+            raise ser.PortNotOpenError()
+        if self.faults["disconnect"]:
+            raise ser.SerialException(f"Simulated disconnect of {self.port}")
+
+    # UART Lite model
+
+    def _receive_byte(self, arrival, b):
+        while self._rx_fifo and self._rx_fifo[0] <= arrival:
+            self._rx_fifo.popleft()
+        if len(self._rx_fifo) >= UART_FIFO_DEPTH:
+            self.overruns += 1 # the byte is lost, exactly as on the board
+            return
+        if self.faults["hang"]:
+            self._rx_fifo.append(float('inf')) # never pulled from the FIFO
+            return
+        self._idle_until(arrival)
+        self._fw_time = max(arrival, self._fw_time)
+        self._rx_fifo.append(self._fw_time)
+        self._firmware.send(b)
+
+    def _send(self, data):
+        for b in data:
+            if len(self._tx_fifo) == UART_FIFO_DEPTH:
+                self._fw_time = max(self._fw_time, self._tx_fifo[0]) # send() spins until a FIFO slot frees up
+            start = max(self._fw_time, self._board_tx_free)
+            self._tx_fifo.append(start)
+            self._board_tx_free = start + self.byte_time
+            if self.rng.random() < self.faults["drop_rate"]:
+                continue
+            if self.rng.random() < self.faults["corrupt_rate"]:
+                b ^= 1 << self.rng.randrange(8)
+            self._deliver(self._board_tx_free, b)
+
+    def _deliver(self, t, b):
+        entry = [t, b]
+        if self.usb_latency > 0:
+            if self._packet and t <= self._packet[0][0] and len(self._packet) < USB_PACKET_SIZE:
+                entry[0] = self._packet[0][0]
+                self._packet.append(entry)
+                if len(self._packet) == USB_PACKET_SIZE: # a full packet goes out as soon as its last byte is in
+                    for e in self._packet: e[0] = t
+                    self._packet = []
+            else:
+                entry[0] = t + self.usb_latency
+                self._packet = [entry]
+        self._out.append(entry)
+
+    def _busy(self, seconds):
+        self._fw_time += seconds * self.time_scale
+
+    def _idle_until(self, t):
+        # While its RX FIFO is empty the firmware runs background validation steps. A step that is under way when a byte
+        # arrives runs to completion before the byte is read.
+        if self.validation_rows_left == 0 or t <= self._fw_time:
+            return
+        step = self.processing['q'] * self.time_scale / FLASH_VALIDATE_ROWS
+        rows = min(self.validation_rows_left, math.ceil((t - self._fw_time) / step))
+        self.validation_rows_left -= rows
+        self._fw_time += rows * step
+        if self.validation_rows_left == 0:
+            self.validation_result = self._validate_flash(self.validation_seed)
+
+    # firmware model, following ProcessCommands in main.c
+
+    def _receive(self, n):
+        buffer = bytearray()
+        while len(buffer) < n:
+            buffer.append((yield))
+        return bytes(buffer)
+
+    def _process_commands(self):
+        while True:
+            command = chr((yield from self._receive(1))[0])
+            self.commands[command] += 1
+            if command == 'w':
+                addr = hextoint((yield from self._receive(2)))
+                data = hextoint((yield from self._receive(8)))
+                self._busy(self.processing['w'])
+                self._write_register(addr, data)
+            elif command == 'r':
+                addr = hextoint((yield from self._receive(2)))
+                self._busy(self.processing['r'])
+                self._send(inttohex(self._read_register(addr), 8))
+            elif command == 'e':
+                count = hextoint((yield from self._receive(2)))
+                for _ in range(count):
+                    self._send((yield from self._receive(1)))
+            elif command == 'q':
+                seed = hextoint((yield from self._receive(8)))
+                self._busy(self.processing['q'])
+                passed, error_count, first, last = self._validate_flash(seed)
+                self._send(inttohex(0 if passed else 1, 1) + inttohex(error_count, 8) + inttohex(first, 8) + inttohex(last, 8))
+            elif command == 'v':
+                seed = hextoint((yield from self._receive(8)))
+                self._busy(self.processing['v'])
+                if self.validation_rows_left == 0:
+                    self.validation_seed = seed
+                    self.validation_rows_left = FLASH_VALIDATE_ROWS
+            elif command == 'p':
+                self._busy(self.processing['p'])
+                state, error_count, first, last = self._poll_validation()
+                self._send(inttohex(state, 1) + inttohex(error_count, 8) + inttohex(first, 8) + inttohex(last, 8))
+            elif command == 'f':
+                self._busy(self.processing['f'])
+                flash_id = self.faults["flash_id"]
+                self._send(inttohex(FLASH_ID if flash_id is None else flash_id, 6))
+            elif command == 'x':
+                self._busy(self.processing['x'])
+                self._send(b''.join(inttohex(v, 4) for v in self._read_xadc()))
+            elif command == 'b':
+                count = min(hextoint((yield from self._receive(4))), XADC_BURST_MAX)
+                decimation = max(hextoint((yield from self._receive(2))), 1)
+                # each sample goes out through the firmware's ring (XADC_BURST_RING in xadc.h) as soon as it is taken: the
+                # samples keep the sequencer's timing, whatever send() stalls on
+                data = b''.join(struct.pack('<4H', *self._read_xadc()) for _ in range(count))
+                sampled = self._fw_time
+                for i in range(0, len(data), 8):
+                    sampled += decimation * XADC_SEQUENCE_PERIOD * self.time_scale
+                    self._fw_time = sampled
+                    self._send(data[i:i + 8])
+                self._send(struct.pack('<H', frames.crc16(data)))
+            elif command == 'd':
+                addr = hextoint((yield from self._receive(6)))
+                length = hextoint((yield from self._receive(6)))
+                while length > 0:
+                    n = min(length, DUMP_CHUNK_SIZE)
+                    self._busy(self.processing['d'])
+                    data = self._flash_bytes(addr, n)
+                    self._send(data + struct.pack('<H', frames.crc16(data)))
+                    addr += n
+                    length -= n
+            elif command == chr(frames.SYNC):
+                yield from self._process_frame()
+            # anything else only toggles the UART error LED
+
+    def _process_frame(self):
+        # follows ProcessFrame in main.c; register accesses take the time of the hex commands, without their hex conversion
+        length, cmd = (yield from self._receive(2))
+        if cmd == frames.FRAME_ECHO:
+            self.commands[f"frame {cmd:#04x}"] += 1
+            self._send(bytes([frames.SYNC, length, frames.FRAME_ECHO | frames.FRAME_REPLY]))
+            payload = bytearray()
+            for _ in range(length): # streamed back as it arrives
+                payload += yield from self._receive(1)
+                self._send(payload[-1:])
+            yield from self._receive(2)
+            self._send(frames.encode_frame(frames.FRAME_ECHO | frames.FRAME_REPLY, bytes(payload))[-2:])
+            return
+        payload = yield from self._receive(length)
+        trailer = yield from self._receive(2)
+        self.commands[f"frame {cmd:#04x}"] += 1
+        reply = b''
+        if frames.crc16(bytes([length, cmd]) + payload) != struct.unpack('<H', trailer)[0]:
+            reply, cmd = bytes([frames.NAK_CRC]), frames.FRAME_NAK
+        elif cmd == frames.FRAME_HELLO:
+            reply = bytes([frames.PROTOCOL_VERSION, frames.MAX_PAYLOAD])
+        elif cmd == frames.FRAME_READ and length <= frames.MAX_BURST_READS:
+            self._busy(self.processing['r'] * length)
+            reply = struct.pack(f'<{length}I', *(self._read_register(addr) for addr in payload))
+        elif cmd == frames.FRAME_WRITE and length % 5 == 0:
+            self._busy(self.processing['w'] * length // 5)
+            for i in range(0, length, 5):
+                self._write_register(payload[i], struct.unpack_from('<I', payload, i + 1)[0])
+        elif cmd == frames.FRAME_FLASH_ID:
+            self._busy(self.processing['f'])
+            flash_id = self.faults["flash_id"]
+            reply = struct.pack('<I', FLASH_ID if flash_id is None else flash_id)
+        elif cmd == frames.FRAME_XADC:
+            self._busy(self.processing['x'])
+            reply = struct.pack('<4H', *self._read_xadc())
+        elif cmd == frames.FRAME_FLASH_START and length == 4:
+            self._busy(self.processing['v'])
+            if self.validation_rows_left == 0:
+                self.validation_seed = struct.unpack('<I', payload)[0]
+                self.validation_rows_left = FLASH_VALIDATE_ROWS
+        elif cmd == frames.FRAME_FLASH_POLL:
+            self._busy(self.processing['p'])
+            reply = struct.pack('<BIII', *self._poll_validation())
+        elif cmd == frames.FRAME_FLASH_VERIFY and length == 4:
+            self._busy(self.processing['q'])
+            passed, error_count, first, last = self._validate_flash(struct.unpack('<I', payload)[0])
+            reply = struct.pack('<BIII', 0 if passed else 1, error_count, first, last)
+        elif cmd in (frames.FRAME_READ, frames.FRAME_WRITE, frames.FRAME_FLASH_START, frames.FRAME_FLASH_VERIFY):
+            reply, cmd = bytes([frames.NAK_LENGTH]), frames.FRAME_NAK
+        else:
+            reply, cmd = bytes([frames.NAK_COMMAND]), frames.FRAME_NAK
+        self._send(frames.encode_frame(cmd if cmd == frames.FRAME_NAK else cmd | frames.FRAME_REPLY, reply))
+
+    def _poll_validation(self):
+        if self.validation_rows_left > 0:
+            return 2, 0, 0, 0 # progress so far is not modelled
+        if self.validation_result is None:
+            return 3, 0, 0, 0
+        passed, error_count, first, last = self.validation_result
+        return 0 if passed else 1, error_count, first, last
+
+    def _validate_flash(self, seed):
+        if self.flash_seed is None:
+            return False, FLASH_VALIDATE_WORDS, FLASH_ERASED, FLASH_ERASED
+        first = lfsr_next(self.flash_seed)
+        last = lfsr_jump(self.flash_seed, FLASH_VALIDATE_WORDS)
+        if seed != self.flash_seed:
+            return False, FLASH_VALIDATE_WORDS, first, last
+        error_count = min(self.faults["flash_errors"], FLASH_VALIDATE_WORDS)
+        return error_count == 0, error_count, first, last
+
+    def _flash_bytes(self, addr, n):
+        # the pattern of flash_seed from address 0, erased past its end, with the flash_errors fault applied
+        first = addr // 4
+        words = np.full(-(-(addr % 4 + n) // 4), FLASH_ERASED, dtype='<u4')
+        if self.flash_seed is not None:
+            pattern = load_pattern(self.flash_seed, QSPI_PATTERN_WORDS)
+            inside = max(0, min(len(words), len(pattern) - first))
+            words[:inside] = pattern[first:first + inside]
+            errors = random.Random(self.flash_seed) # the same words every time
+            for index in errors.sample(range(FLASH_VALIDATE_WORDS), min(self.faults["flash_errors"], FLASH_VALIDATE_WORDS)):
+                bit = errors.randrange(32)
+                if first <= index < first + len(words): words[index - first] ^= 1 << bit
+        return words.tobytes()[addr % 4:addr % 4 + n]
+
+    def _read_xadc(self):
+        noise = lambda: self.rng.randint(-2, 2)
+        return [((v + noise()) & 0xfff) << 4 for v in XADC_NOMINAL.values()]
+
+    def _write_register(self, addr, data):
+        if addr == DIO_COUNTER_MAX_ADDR:
+            self.dio_divider = data
+        elif addr == DIO_OUTPUT_PHASE_ADDR:
+            self.dio_phase = data
+        elif addr == DIO_SETTINGS_ADDR:
+            self.dio_mode = data & 0x3
+        elif addr == BRAM_ADDR_MAX_ADDR:
+            if self.bram_done_at is None: self.bram_addr_max = data
+        elif addr == BRAM_SEED_ADDR:
+            if self.bram_done_at is None:
+                self.bram_seed = data
+                self.bram_started_at = self._fw_time
+                self.bram_passes_seen = 0
+                self.bram_run_failed = False
+                self.bram_done_at = math.inf if self.bram_continuous else self._fw_time + self._bram_duration()
+        elif addr == BRAM_CONTROL_ADDR:
+            self._bram_advance()
+            self.bram_continuous = bool(data & BRAM_CONTINUOUS)
+            if self.bram_done_at is not None:
+                # a running test goes on for good, or ends with the pass under way, or after its loops if that is later
+                end = self.bram_started_at + (self.bram_passes_seen + 1) * self._bram_pass_time()
+                self.bram_done_at = math.inf if self.bram_continuous else max(end, min(self.bram_done_at, self.bram_started_at + self._bram_duration()))
+            if data & BRAM_CLEAR_COUNTERS:
+                self.bram_counters = dict.fromkeys(self.bram_counters, 0)
+
+    def _read_register(self, addr):
+        if addr == STATUS_ADDR:
+            return 0x1ff & ~(STATUS_BRAM_SEED_TREADY if self.bram_done_at is not None else 0) # every other stream ready/valid
+        if addr == DIO_STATUS_ADDR:
+            running = None not in (self.dio_divider, self.dio_phase, self.dio_mode) and self.dio_mode != DIO_MODE_OFF
+            running = running and not self.faults["dio_stopped"]
+            status = (0 if running else 0x10000) | self.dio_errors | (self.faults["dio_error_bits"] & 0xffff)
+            if running: status |= self._dio_phase_errors()
+            if self.dio_phase is not None and self.dio_divider is not None and self.dio_phase >= self.dio_divider:
+                status |= 0x20000
+            self.dio_errors = 0 # clear-on-read
+            return status
+        if addr == PS2_POS_ADDR:
+            return self._read_mouse()
+        if addr == BRAM_STATUS_ADDR:
+            self._bram_advance()
+            done = self.bram_done_at is not None and self._fw_time >= self.bram_done_at
+            status = (self.bram_seed & ~0x3) | (0x2 if done else 0) | (0 if self.bram_run_failed else 0x1)
+            if done: self.bram_done_at = None # reading the status returns the test to WAIT_FOR_SEED
+            return status & 0xffffffff
+        if addr in self.bram_counters:
+            self._bram_advance()
+            return self.bram_counters[addr]
+        return 0
+
+    def _dio_phase_errors(self):
+        # dio_test.sv samples its inputs at count divider and changes its outputs at count phase, and compares what comes
+        # back through the pins with an internal copy of the outputs taken through as many flops. The copy reaches the
+        # sampling flops DIO_LOOP_LATENCY clocks after the phase count; the pins, a whole number of clocks later that
+        # depends on their delay. A sample taken in between reads the old value on every line the mode loops back.
+        if self.dio_mode == DIO_MODE_EMISSIONS or self.dio_phase >= self.dio_divider: return 0
+        since_change = (self.dio_divider - self.dio_phase - DIO_LOOP_LATENCY) % (self.dio_divider + 1)
+        return 0xffff if since_change < math.floor(self.faults["dio_delay"]) else 0
+
+    def _read_mouse(self):
+        new_data = not self.faults["mouse_stale"] and self._fw_time - self.mouse_last_read >= self.mouse_period * self.time_scale
+        self.mouse_last_read = self._fw_time
+        if new_data:
+            self.mouse_x = (self.mouse_x + self.rng.randint(-3, 3)) & 0xfff
+            self.mouse_y = (self.mouse_y + self.rng.randint(-3, 3)) & 0xfff
+        return (new_data << 26) | (self.faults["mouse_not_connected"] << 25) | (self.faults["mouse_error"] << 24) | (self.mouse_x << 12) | self.mouse_y
+
+    def _bram_pass_time(self):
+        addr_max = self.bram_addr_max & ((1 << BRAM_ADDR_BITS) - 1)
+        return 2 * (addr_max + 3) / SYS_CLK_HZ * self.time_scale # write then read pass, plus read latency
+
+    def _bram_duration(self):
+        loops = (self.bram_addr_max >> BRAM_ADDR_BITS) & ((1 << (31 - BRAM_ADDR_BITS)) - 1)
+        return (loops + 1) * self._bram_pass_time()
+
+    def _bram_advance(self):
+        # takes the passes finished since the last look into the counters, as bram_test.sv counts them at the end of
+        # every pass
+        if self.bram_done_at is None: return
+        elapsed = min(self._fw_time, self.bram_done_at) - self.bram_started_at
+        finished = int(elapsed / self._bram_pass_time() + 1e-9)
+        addr_max = self.bram_addr_max & ((1 << BRAM_ADDR_BITS) - 1)
+        weak = self.faults["bram_weak_address"]
+        counters = self.bram_counters
+        if not self.faults["bram_fail"] and (weak is None or addr_max < weak) and not self.faults["bram_upset_rate"]:
+            counters[BRAM_PASS_COUNT_ADDR] = (counters[BRAM_PASS_COUNT_ADDR] + max(finished - self.bram_passes_seen, 0)) & 0xffffffff
+            self.bram_passes_seen = max(self.bram_passes_seen, finished)
+            return
+        for _ in range(self.bram_passes_seen, finished):
+            if self.faults["bram_fail"]: address = 0
+            elif weak is not None and addr_max >= weak: address = weak
+            elif self.faults["bram_upset_rate"] and self.rng.random() < self.faults["bram_upset_rate"]: address = self.rng.randint(0, addr_max)
+            else: address = None
+            if address is None:
+                counters[BRAM_PASS_COUNT_ADDR] = (counters[BRAM_PASS_COUNT_ADDR] + 1) & 0xffffffff
+                continue
+            self.bram_run_failed = True
+            if not counters[BRAM_FIRST_FAIL_ADDR] & BRAM_FIRST_FAIL_VALID:
+                passes = counters[BRAM_PASS_COUNT_ADDR] + counters[BRAM_FAIL_COUNT_ADDR]
+                counters[BRAM_FIRST_FAIL_ADDR] = BRAM_FIRST_FAIL_VALID | (1 << 29) | ((passes & 0xffff) << BRAM_ADDR_BITS) | address
+            counters[BRAM_FAIL_COUNT_ADDR] = (counters[BRAM_FAIL_COUNT_ADDR] + 1) & 0xffffffff
+            counters[BRAM_ERROR_COUNT_ADDR] = (counters[BRAM_ERROR_COUNT_ADDR] + 1) & 0xffffffff
+        self.bram_passes_seen = max(self.bram_passes_seen, finished)
+
+def hextoint(a):
+    # same conversion as hextoint in main.c, including its handling of unexpected characters
+    i = 0
+    for c in a:
+        i <<= 4
+        if ord('0') <= c <= ord('9'): i += c - ord('0')
+        elif ord('a') <= c <= ord('f'): i += c - ord('a') + 10
+        elif c == ord('F'): i += 15
+    return i
+
+def inttohex(i, n):
+    return f"{i & ((1 << (4 * n)) - 1):0{n}x}".encode('utf-8')
@@ -0,0 +1,297 @@
+import json
+import logging
+import struct
+import time
+import serial as ser
+
+# Records everything said over a board's serial port to a capture file, and plays a capture back to test_obj in place of
+# the board, so a failure seen on the bench (a stale mouse, a DIO bit error, a flash mismatch) can be run through the
+# parsing and decision logic again, profiled and kept as a regression case.
+#
+# A capture starts with MAGIC, a version byte and a JSON header of the run: its settings and the seed the test's random
+# numbers (echo data, BRAM and QSPI seeds) were drawn with. Records follow, each a RECORD header (nanoseconds since the
+# start, kind, length) and its data; a file cut short by a crash is good up to its last whole record.
+#
+# Replay goes by the order of operations rather than the clock: the bytes read after a write are served to the reads that
+# follow the same write in the replay, however they are split, and a read that finds nothing left before the next write
+# times out as the port would. The writes of the replay are compared with the recorded ones, so a change in what the host
+# decides to send shows up as a mismatch.
+#   python test.py --sim --cycles 20 --capture sim.cap --set dio_mode=2     records a run
+#   python capture.py sim.cap                                              replays it as fast as it can
+#   python capture.py sim.cap --realtime --profile
+
+CAPTURE_VERSION = 1
+MAGIC = b"BASYS3CP"
+RECORD = struct.Struct("<QBI") # nanoseconds since the start, kind, length of the data
+
+# record kinds
+OPEN = 0 # data: JSON of the port's arguments
+CLOSE = 1
+WRITE = 2
+READ = 3
+RESET = 4 # reset_input_buffer
+ERROR = 5 # data: message of the SerialException raised by open, read or write
+
+KIND_NAMES = {OPEN: "open", CLOSE: "close", WRITE: "write", READ: "read", RESET: "reset", ERROR: "error"}
+
+class capture_writer:
+    def __init__(self, path, meta=None):
+        self.path = path
+        self.file = open(path, "wb")
+        header = json.dumps(dict(meta or {}, start=time.time())).encode()
+        self.file.write(MAGIC + bytes([CAPTURE_VERSION]) + struct.pack("<I", len(header)) + header)
+        self.start = time.monotonic_ns()
+        self.records = 0
+
+    def record(self, kind, data=b""):
+        self.file.write(RECORD.pack(time.monotonic_ns() - self.start, kind, len(data)) + data)
+        self.records += 1
+        if kind != READ: self.file.flush() # once per batch, with its write
+
+    def port_factory(self, factory):
+        # a test_obj.port_factory that opens ports with factory and records everything done with them
+        def connect(**kwargs):
+            try:
+                port = factory(**kwargs)
+            except (ser.SerialException, OSError) as e:
+                self.record(ERROR, str(e).encode())
+                raise
+            self.record(OPEN, json.dumps(kwargs).encode())
+            return recording_port(port, self)
+        return connect
+
+    def close(self):
+        self.file.close()
+
+class recording_port:
+    # passes everything on to port, recording the bytes each way and the errors
+    def __init__(self, port, writer):
+        self.wrapped = port
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def write(self, data):
+        try:
+            n = self.wrapped.write(data)
+        except (ser.SerialException, OSError) as e:
+            self.writer.record(ERROR, str(e).encode())
+            raise
+        self.writer.record(WRITE, bytes(data))
+        return n
+
+    def read(self, size=1):
+        try:
+            data = self.wrapped.read(size)
+        except (ser.SerialException, OSError) as e:
+            self.writer.record(ERROR, str(e).encode())
+            raise
+        if data: self.writer.record(READ, data)
+        return data
+
+    def reset_input_buffer(self):
+        self.wrapped.reset_input_buffer()
+        self.writer.record(RESET)
+
+    def close(self):
+        self.wrapped.close()
+        self.writer.record(CLOSE)
+
+def load_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{f.name} is not a capture")
+    version = f.read(1)[0]
+    if version != CAPTURE_VERSION:
+        raise ValueError(f"{f.name} is capture version {version}, expected {CAPTURE_VERSION}")
+    size, = struct.unpack("<I", f.read(4))
+    return json.loads(f.read(size))
+
+def read_records(f):
+    # (nanoseconds, kind, data) of every whole record from the file position on
+    while True:
+        head = f.read(RECORD.size)
+        if len(head) < RECORD.size: return
+        t, kind, size = RECORD.unpack(head)
+        data = f.read(size)
+        if len(data) < size: return
+        yield t, kind, data
+
+class replay_port:
+    # Stands in for the board of a capture, as board_sim does for a simulated one: connect is the port_factory. With
+    # realtime, bytes are held back until as long after the first open as they arrived in the capture, divided by speed.
+    def __init__(self, path, realtime=False, speed=1.0):
+        self.file = open(path, "rb")
+        self.meta = load_header(self.file)
+        self.records = read_records(self.file)
+        self.next = next(self.records, None)
+        self.after = next(self.records, None) # the record after next
+        self.realtime = realtime
+        self.speed = speed
+        self.port = self.meta.get("port", path)
+        self.baudrate = 115200
+        self.timeout = None
+        self.is_open = False
+        self.buffer = bytearray() # bytes recorded as read and not yet read in the replay
+        self.started = None # (monotonic time of the first open, its time in the capture)
+        self.writes = 0
+        self.mismatches = 0
+
+    @property
+    def finished(self):
+        # nothing left but the close at the end of the test
+        return self.next is None or (self.next[1] == CLOSE and self.after is None)
+
+    def _take(self):
+        record = self.next
+        self.next = self.after
+        self.after = next(self.records, None)
+        return record
+
+    def _skip_to(self, kinds):
+        # moves on to the next record of one of kinds, keeping the bytes read on the way as unread input; returns its
+        # kind, None at the end of the capture
+        while self.next is not None and self.next[1] not in kinds:
+            t, kind, data = self._take()
+            if kind == READ: self.buffer += data
+        return self.next[1] if self.next is not None else None
+
+    def _pace(self, t):
+        if not self.realtime or self.started is None: return
+        delay = self.started[0] + (t - self.started[1]) / 1e9 / self.speed - time.monotonic()
+        if delay > 0: time.sleep(delay)
+
+    def _raise_error(self):
+        if self.next is not None and self.next[1] == ERROR:
+            raise ser.SerialException(self._take()[2].decode())
+
+    def connect(self, port=None, baudrate=None, timeout=None):
+        if self._skip_to((OPEN, ERROR)) is None:
+            raise ser.SerialException(f"End of the capture of {self.port}")
+        t, kind, data = self._take()
+        self._pace(t)
+        if kind == ERROR:
+            raise ser.SerialException(data.decode())
+        if self.started is None: self.started = (time.monotonic(), t)
+        self.buffer.clear()
+        self.timeout = timeout
+        self.is_open = True
+        return self
+
+    def write(self, data):
+        if not self.is_open: raise ser.PortNotOpenError()
+        data = bytes(data)
+        kind = self._skip_to((WRITE, ERROR, OPEN)) # an open belongs to the next session, it stays
+        self._raise_error()
+        record = self._take() if kind == WRITE else None
+        self.writes += 1
+        if record is None or record[2] != data:
+            self.mismatches += 1
+            if self.mismatches <= 10:
+                expected = record[2] if record is not None else b""
+                logging.warning(f"Replay write {self.writes} differs from the capture: sent {data[:32]!r}, captured {expected[:32]!r}")
+        return len(data)
+
+    def read(self, size=1):
+        if not self.is_open: raise ser.PortNotOpenError()
+        data = bytearray()
+        while len(data) < size:
+            if not self.buffer:
+                self._raise_error()
+                if self.next is None or self.next[1] != READ: break
+                t, _, chunk = self._take()
+                self._pace(t)
+                self.buffer += chunk
+            n = min(size - len(data), len(self.buffer))
+            data += self.buffer[:n]
+            del self.buffer[:n]
+        if len(data) < size and self.timeout:
+            time.sleep(self.timeout) # the capture has nothing more before the next write: the read times out
+        return bytes(data)
+
+    @property
+    def in_waiting(self):
+        return len(self.buffer)
+
+    def reset_input_buffer(self):
+        if self.next is not None and self.next[1] == RESET: self._take()
+        self.buffer.clear()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.next is not None and self.next[1] == CLOSE: self._take()
+        self.is_open = False
+
+def summary(path):
+    with open(path, "rb") as f:
+        meta = load_header(f)
+        counts = {name: 0 for name in KIND_NAMES.values()}
+        sizes = {name: 0 for name in KIND_NAMES.values()}
+        last = 0
+        errors = []
+        for t, kind, data in read_records(f):
+            counts[KIND_NAMES[kind]] += 1
+            sizes[KIND_NAMES[kind]] += len(data)
+            last = t
+            if kind == ERROR: errors.append((t / 1e9, data.decode()))
+    return meta, counts, sizes, last / 1e9, errors
+
+if __name__ == '__main__':
+    import argparse
+    import cProfile
+    import pstats
+    import test
+
+    parser = argparse.ArgumentParser(description="Replay a capture of a test run against test_obj")
+    parser.add_argument("capture")
+    parser.add_argument("--realtime", action="store_true", help="serve the responses with the capture's timing instead of as fast as possible")
+    parser.add_argument("--speed", type=float, default=1.0, help="with --realtime, how many times faster than recorded")
+    parser.add_argument("--info", action="store_true", help="only describe the capture")
+    parser.add_argument("--profile", action="store_true", help="profile the replay and print the functions that took longest")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log everything the test logs")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    if args.info:
+        meta, counts, sizes, seconds, errors = summary(args.capture)
+        print(f"{args.capture}: port {meta.get('port')}, {seconds:.1f} s, recorded {time.ctime(meta['start'])}")
+        for name in KIND_NAMES.values():
+            print(f"  {name:<6} {counts[name]:>8} records {sizes[name]:>10} bytes")
+        for t, message in errors:
+            print(f"  error at {t:.3f} s: {message}")
+        raise SystemExit(0)
+
+    port = replay_port(args.capture, args.realtime, args.speed)
+    meta = port.meta
+    obj = test.test_obj()
+    obj.setup_test(dict(meta["settings"], com_port=port.port))
+    obj.qspi_seed = meta["qspi_seed"]
+    test.rng.seed(meta["rng_seed"]) # the same echo data and BRAM seeds as the capture
+    obj.port_factory = port.connect
+    obj.cycle_period = 0
+    obj.init_sequence = 2
+
+    def replay():
+        while not port.finished and not obj.stopped:
+            # programming goes through Vivado, not the serial port, so it isn't in the capture: the board is taken to be
+            # programmed whenever the test goes back to do it
+            if obj.init_sequence < 2: obj.init_sequence = 2
+            obj.run_test()
+        obj.stop_test()
+
+    start = time.perf_counter()
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(replay)
+    else:
+        replay()
+    seconds = time.perf_counter() - start
+
+    failed = [name for name, (_, f) in obj.tally.items() if f]
+    print(f"Replayed {obj.iteration} cycles in {seconds:.2f} s, " + ", ".join(f"{name} {p}/{f}" for name, (p, f) in sorted(obj.tally.items())) + " (passed/failed)")
+    print(f"{port.writes} writes, {port.mismatches} differ from the capture")
+    if args.profile:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    raise SystemExit(0 if port.mismatches == 0 else 1)
@@ -1,28 +1,59 @@
+import logging
 import threading
+import time
+
+STOP_TIMEOUT = 2.0 # longest a quitting app waits for the loop to wind down, after that the daemon thread is abandoned
 
 # Simple threading wrapper to manage starting up and shutting down a loop safely
+#   a stop sets stop_event, which the loop checks between tasks; tasks that block for long should wait on it (see wait)
+#   rather than sleep, so that a stop takes effect within tens of milliseconds instead of at the end of the cycle
 class daemon_handler:
     def __init__(self):
-        self.end_loop = False
+        self.stop_event = threading.Event()
         self.thread = None
+        self.stop_requested = None
+        self.stop_latency = None # seconds from the last stop request until after_task had finished
+    @property
+    def end_loop(self):
+        return self.stop_event.is_set()
+    def wait(self, seconds):
+        # time.sleep that ends early on a stop request; returns True then
+        return self.stop_event.wait(seconds)
     def daemon_task(self, task, after_task):
         cycle = 0
-        while not self.end_loop:
-            cycle += 1
-            task(cycle)
-        after_task()
+        try:
+            while not self.stop_event.is_set():
+                cycle += 1
+                task(cycle)
+        finally:
+            # also after a task raised, so that whatever setup opened gets closed
+            after_task()
+            if self.stop_requested is not None:
+                self.stop_latency = time.perf_counter() - self.stop_requested
+                logging.info(f"Stopped {self.stop_latency * 1000:.0f} ms after the stop request")
     def enlist_daemon(self, setup, task, after_task):
         if not self.thread is None and self.thread.is_alive(): return
-        self.end_loop = False
+        self.stop_event.clear()
+        self.stop_requested = None
+        self.stop_latency = None
         setup() # run callback to do any necessary setup functions after the checks to see if we can start - helps ensure we only call setup once
         self.thread = threading.Thread(target=lambda: self.daemon_task(task, after_task), args=())
         # setting daemon true instead of using default threading allows quitting the external python context to still clean this thread up
         self.thread.daemon = True
         self.thread.start()
-    def stop_daemon(self):
-        if self.thread is None: return
-        self.end_loop = True
-        # can't spinlock here to wait for loop end or it blocks logging
+    def stop_daemon(self, timeout=None):
+        # Asks the loop to stop. Without a timeout it returns right away: the GUI's mainloop has to keep running to show
+        # the log records of the wind down. With one, it waits that long for after_task to finish, and returns whether it did.
+        if self.thread is None: return True
+        if not self.stop_event.is_set():
+            self.stop_requested = time.perf_counter()
+            self.stop_event.set()
+        if timeout is None: return not self.thread.is_alive()
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            logging.warning(f"Test loop still running {timeout} seconds after the stop request")
+            return False
+        return True
 
 if __name__ == '__main__':
     import tkinter as tk
@@ -33,15 +64,15 @@ if __name__ == '__main__':
     class daemon_example(daemon_handler):
         def enlist_daemon(self):
             return super().enlist_daemon(self.setup_task, self.loop_task, self.after_task)
-        def stop_daemon(self):
-            return super().stop_daemon()
+        def stop_daemon(self, timeout=None):
+            return super().stop_daemon(timeout)
         def setup_task(self):
             logging.info("Starting my task")
         def loop_task(self, cycle):
             logging.info(f"Cycle {cycle} starting")
-            time.sleep(0.5)
+            if self.wait(0.5): return
             logging.info("This is an info message")
-            time.sleep(0.5)
+            if self.wait(0.5): return
             # logging.warning("This is a warning message")
             # time.sleep(0.5)
             # logging.error("This is an error message")
@@ -0,0 +1,165 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import multiprocessing.managers
+import os
+import sys
+import tempfile
+import time
+import test
+from vivado_session import vivado_session
+from telemetry import telemetry_recorder
+from results_index import record_run
+
+# Runs the test on every attached Basys 3 at once, one process per board. Programming goes through a single JTAG server,
+# so the Vivado steps of all boards are serialized on one lock; everything after that runs in parallel. Each board logs to
+# its own farm_<port>.log and the results of all boards are summed up at the end, and added to the results index.
+#   python farm.py --cycles 60
+#   python farm.py --sim 4 --sim-program-time 2
+# With --session, all boards are programmed through one persistent Vivado process, served to the workers by a manager.
+
+class vivado_manager(multiprocessing.managers.BaseManager):
+    pass
+vivado_manager.register("vivado_session", vivado_session)
+
+# simulated boards record their seeds here, apart from the real boards in test.QSPI_STATE_FILE
+SIM_QSPI_STATE_FILE = os.path.join(tempfile.gettempdir(), "basys3_qspi_state_sim.json")
+
+jtag_lock = None
+vivado = None
+
+def init_worker(lock, session):
+    global jtag_lock, vivado
+    jtag_lock = lock
+    vivado = session
+
+def init_board_logging(device):
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    handler = logging.FileHandler(f"farm_{os.path.basename(device)}.log")
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+    logger.handlers = [handler] # the board's log only, not the console of the parent process
+
+def run_board(board, values, cycles, cycle_period, sim_program_time=None):
+    init_board_logging(board.device)
+    settings = dict(values, com_port=board.device)
+    obj = test.test_obj()
+    obj.setup_test(settings)
+    obj.jtag_target = board.jtag_target
+    obj.jtag_lock = jtag_lock
+    obj.vivado = vivado
+    obj.cycle_period = cycle_period
+    obj.telemetry = telemetry_recorder(f"farm_{os.path.basename(board.device)}", meta=dict(values, com_port=board.device,
+                                       serial_number=board.serial_number, qspi_seed=int(obj.qspi_seed)))
+    if sim_program_time is not None:
+        from board_sim import board_sim
+        sim = board_sim(port=board.device, usb_latency=0.016)
+        sim.flash_seed = int(obj.qspi_seed)
+        obj.port_factory = sim.connect
+        test.QSPI_STATE_FILE = SIM_QSPI_STATE_FILE
+        if vivado is None:
+            # stands in for the Vivado calls, holding the JTAG lock for as long as programming would
+            test.write_qspi_binfile = test.program_device = lambda *args: time.sleep(sim_program_time) or True
+
+    result = {"port": board.device, "serial_number": board.serial_number, "cycles": 0, "connected": False}
+    start = time.perf_counter()
+    try:
+        while obj.init_sequence < 3:
+            step = obj.init_sequence
+            obj.run_test()
+            if obj.init_sequence == step: break # couldn't connect
+        result["programmed"] = time.perf_counter() - start
+        result["connected"] = obj.init_sequence >= 3
+        if result["connected"] and not obj.run_cycles(cycles):
+            result["error"] = "link lost"
+    except Exception as e:
+        logging.exception(f"Test of {board.device} aborted")
+        result["error"] = repr(e)
+    finally:
+        obj.stop_test()
+        obj.telemetry.close()
+    result["seconds"] = time.perf_counter() - start
+    result["cycles"] = obj.iteration
+    result["tally"] = obj.tally
+    record_run(obj, values, f"farm_{os.path.basename(board.device)}", serial_number=board.serial_number,
+               connected=result["connected"], error=result.get("error"))
+    return result
+
+def run_farm(boards, values, cycles, cycle_period, sim_program_time=None, vivado_command=None):
+    lock = multiprocessing.Lock()
+    results = []
+    with vivado_manager() as manager:
+        session = manager.vivado_session(vivado_command) if vivado_command is not None else None
+        try:
+            with multiprocessing.Pool(len(boards), initializer=init_worker, initargs=(lock, session)) as pool:
+                jobs = [(board, values, cycles, cycle_period, sim_program_time) for board in boards]
+                for result in pool.starmap(run_board, jobs):
+                    results.append(result)
+        finally:
+            if session is not None: session.close()
+    return results
+
+def summarize(results):
+    checks = sorted({name for r in results for name in r["tally"]})
+    width = max([len(r["port"]) for r in results] + [8])
+    print(f"{'board':<{width}} {'serial':<14} {'cycles':>6} {'seconds':>8}  " + " ".join(f"{name:>13}" for name in checks))
+    totals = {name: [0, 0] for name in checks}
+    for r in results:
+        cells = []
+        for name in checks:
+            passed, failed = r["tally"].get(name, [0, 0])
+            totals[name][0] += passed
+            totals[name][1] += failed
+            cells.append(f"{passed:>6}/{failed:<6}")
+        status = "" if r["connected"] else "  not connected"
+        if "error" in r: status = f"  {r['error']}"
+        print(f"{r['port']:<{width}} {str(r['serial_number']):<14} {r['cycles']:>6} {r['seconds']:>8.1f}  " + " ".join(cells) + status)
+    print(f"{'total':<{width}} {'':<14} {sum(r['cycles'] for r in results):>6} {'':>8}  " + " ".join(f"{p:>6}/{f:<6}" for p, f in totals.values()))
+    print("(passed/failed per check)")
+    failed = [r["port"] for r in results if not r["connected"] or "error" in r or any(f for _, f in r["tally"].values())]
+    print("FAIL: " + ", ".join(failed) if failed else "PASS: all boards")
+    return not failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Test every attached Basys 3 in parallel")
+    parser.add_argument("ports", nargs="*", help="serial ports to test, all attached boards by default")
+    parser.add_argument("--cycles", type=int, default=60)
+    parser.add_argument("--cycle-period", type=float, default=1.0)
+    parser.add_argument("--disable", action="append", default=[], help="check to turn off, e.g. enable_mouse")
+    parser.add_argument("--reuse-qspi", action="store_true", help="skip the QSPI write on boards whose flash still holds their last seed")
+    parser.add_argument("--report", help="also write the results to this JSON file")
+    parser.add_argument("--sim", type=int, default=0, help="test this many simulated boards instead")
+    parser.add_argument("--sim-program-time", type=float, default=1.0, help="seconds each simulated board holds the JTAG lock")
+    parser.add_argument("--session", action="store_true", help="program through one persistent Vivado session")
+    parser.add_argument("--vivado-stub", action="store_true", help="use vivado_stub.py as the session's Vivado")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    values = dict(test.DEFAULT_SETTINGS)
+    for name in args.disable: values[name] = False
+    values["reuse_qspi"] = args.reuse_qspi
+    sim_program_time = None
+    if args.sim:
+        boards = [test.board_port(f"sim{i}", f"SIM{i:09d}") for i in range(args.sim)]
+        sim_program_time = args.sim_program_time
+    else:
+        boards = test.get_portlist()
+        if args.ports: boards = [b for b in boards if b.device in args.ports] + \
+            [test.board_port(p, None) for p in args.ports if p not in [b.device for b in boards]]
+    if not boards:
+        print("No boards found")
+        raise SystemExit(1)
+
+    vivado_command = None
+    if args.vivado_stub: vivado_command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "vivado_stub.py")]
+    elif args.session: vivado_command = ["vivado"]
+
+    start = time.perf_counter()
+    results = run_farm(boards, values, args.cycles, args.cycle_period, sim_program_time, vivado_command)
+    print(f"Tested {len(boards)} boards in {time.perf_counter() - start:.1f} seconds")
+    passed = summarize(results)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=2)
+    raise SystemExit(0 if passed else 1)
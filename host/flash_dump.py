@@ -0,0 +1,225 @@
+import logging
+import time
+from collections import deque
+import numpy as np
+import test
+from frames import crc16
+from lfsr import load_pattern
+
+# Reads the QSPI flash back over the UART ('d' command, DumpFlash in main.c) and compares it with the LFSR pattern it was
+# programmed with, to see where and in which bits a failing flash differs, where 'q' only counts mismatching words.
+# The dump is processed as it arrives by a chain of generators, one chunk at a time, against the cached pattern file
+# mapped into memory, so nothing close to the size of the flash is ever held by the host.
+#   python flash_dump.py COM4                        range of the last QSPI write to the board's flash, with its seed
+#   python flash_dump.py COM4 --seed 0x1234abcd --start 0x1000 --length 0x2000 --save errors.npz
+#   python flash_dump.py --sim --fault flash_errors=5
+
+DUMP_CHUNK_SIZE = 128 # DUMP_CHUNK_SIZE in flash.h, each chunk comes with its own CRC-16
+DUMP_SEGMENT_SIZE = 32 * DUMP_CHUNK_SIZE # bytes asked for by one 'd', so a slip on the line only spoils one segment
+DUMP_CHUNK_READ_TIME = 0.005 # worst case QSPI read of one chunk, on top of its time on the wire
+FLASH_PAGE_SIZE = 256
+FLASH_ERASED = 0xffffffff
+PATTERN_BYTES = test.QSPI_PATTERN_WORDS * 4 # written by write_qspi_binfile from address 0, erased beyond
+
+def DumpCommand(addr, length):
+    return b'd' + test.hexint(addr, 6) + test.hexint(length, 6)
+
+def segments(addr, length, size=DUMP_SEGMENT_SIZE):
+    while length > 0:
+        n = min(size, length)
+        yield addr, n
+        addr += n
+        length -= n
+
+def chunks_of(addr, length):
+    return [(a, min(DUMP_CHUNK_SIZE, addr + length - a)) for a in range(addr, addr + length, DUMP_CHUNK_SIZE)]
+
+def read_chunks(port, ranges, window=2, failed=None):
+    # Streams the ranges, window 'd' commands at a time, yielding (address, data) for every chunk that arrives with a
+    # good CRC. The addresses and lengths of the chunks that didn't are appended to failed, to be read again.
+    if failed is None: failed = []
+    ranges = iter(ranges)
+    pending = deque()
+    bad_crcs = 0 # in a row
+    def resync(queued):
+        # the chunks still on their way can't be told apart any more: wait for them and throw them away
+        for p in pending: failed.extend(p)
+        pending.clear()
+        time.sleep(test.SERIAL_TIMEOUT + test.wire_time(port, queued * (DUMP_CHUNK_SIZE + 2)))
+        port.reset_input_buffer()
+    while True:
+        while len(pending) < window:
+            r = next(ranges, None)
+            if r is None: break
+            port.write(DumpCommand(*r))
+            pending.append(deque(chunks_of(*r)))
+        if not pending: return
+        addr, n = pending[0].popleft()
+        if not pending[0]: pending.popleft()
+        queued = sum(len(p) for p in pending)
+        raw = test.read_exactly(port, n + 2, test.SERIAL_TIMEOUT + DUMP_CHUNK_READ_TIME + test.wire_time(port, n + 2))
+        if len(raw) < n + 2:
+            logging.error(f"Flash dump stalled at {addr:#08x}, received {len(raw)} of {n + 2} bytes, resynchronizing")
+            failed.append((addr, n))
+            resync(queued)
+            continue
+        if crc16(raw[:n]) != int.from_bytes(raw[n:], 'little'):
+            failed.append((addr, n))
+            bad_crcs += 1
+            if bad_crcs >= 2:
+                # more likely a byte lost or gained, which shifts every chunk after it, than two corrupted chunks
+                logging.error(f"Flash dump out of step at {addr:#08x}, resynchronizing")
+                bad_crcs = 0
+                resync(queued)
+            continue
+        bad_crcs = 0
+        yield addr, raw[:n]
+
+def expected_words(pattern, addr, count):
+    # what the flash should hold at addr: the pattern, and erased words past its end
+    first = addr // 4
+    words = np.full(count, FLASH_ERASED, dtype=np.uint32)
+    inside = max(0, min(count, len(pattern) - first))
+    words[:inside] = pattern[first:first + inside]
+    return words
+
+def compare_chunks(chunks, pattern):
+    # yields (address, read, expected) word arrays for every chunk
+    for addr, data in chunks:
+        read = np.frombuffer(data, dtype='<u4').astype(np.uint32)
+        yield addr, read, expected_words(pattern, addr, len(read))
+
+def lane_bits(words):
+    # one row per word, one column per bit lane: column i is bit i of the 32-bit word
+    return np.unpackbits(words.astype('<u4').view(np.uint8).reshape(-1, 4), axis=1, bitorder='little')
+
+class flash_error_map:
+    # Where the flash differs from its pattern, by page, and which bits: for each of the 32 bit lanes of a word, how
+    # often a bit that should be 0 read as 1 (rise) and the other way around (fall). A lane that only ever falls or rises
+    # points at a stuck data line, errors that cluster in pages at the flash array.
+    def __init__(self, start, length, page_size=FLASH_PAGE_SIZE, max_listed=32):
+        self.start = start
+        self.length = length
+        self.page_size = page_size
+        pages = -(-length // page_size)
+        self.page_word_errors = np.zeros(pages, dtype=np.int64)
+        self.page_bit_errors = np.zeros(pages, dtype=np.int64)
+        self.lane_rise = np.zeros(32, dtype=np.int64)
+        self.lane_fall = np.zeros(32, dtype=np.int64)
+        self.words = 0
+        self.word_errors = 0
+        self.bit_errors = 0
+        self.erased_words = 0 # mismatching words that read as erased
+        self.unreadable = [] # (address, length) of chunks that never arrived intact
+        self.max_listed = max_listed
+        self.first_errors = [] # (address, expected, read) of the first mismatching words
+
+    def add(self, addr, read, expected):
+        diff = read ^ expected
+        bad = np.flatnonzero(diff)
+        self.words += len(read)
+        if len(bad) == 0: return
+        bits = lane_bits(diff[bad])
+        self.lane_rise += (bits & lane_bits(read[bad])).sum(axis=0, dtype=np.int64)
+        self.lane_fall += (bits & lane_bits(expected[bad])).sum(axis=0, dtype=np.int64)
+        pages = (addr - self.start + 4 * bad) // self.page_size
+        self.page_word_errors += np.bincount(pages, minlength=len(self.page_word_errors))
+        self.page_bit_errors += np.bincount(pages, weights=bits.sum(axis=1), minlength=len(self.page_bit_errors)).astype(np.int64)
+        self.word_errors += len(bad)
+        self.bit_errors += int(bits.sum())
+        self.erased_words += int(np.count_nonzero(read[bad] == FLASH_ERASED))
+        for i in bad[:self.max_listed - len(self.first_errors)]:
+            self.first_errors.append((addr + 4 * int(i), int(expected[i]), int(read[i])))
+
+    @property
+    def bit_error_rate(self):
+        return self.bit_errors / (32 * self.words) if self.words else float('nan')
+
+    def report(self):
+        print(f"{self.words * 4} of {self.length} bytes compared from {self.start:#08x}, {len(self.unreadable)} chunks unreadable")
+        print(f"{self.word_errors} words and {self.bit_errors} bits wrong (BER {self.bit_error_rate:.2e}), {self.erased_words} of the words read as erased")
+        if not self.word_errors: return
+        pages = np.flatnonzero(self.page_word_errors)
+        print(f"{len(pages)} of {len(self.page_word_errors)} pages of {self.page_size} bytes have errors, worst:")
+        for p in pages[np.argsort(self.page_word_errors[pages])[::-1][:8]]:
+            print(f"  {self.start + p * self.page_size:#08x}  {self.page_word_errors[p]:>5} words  {self.page_bit_errors[p]:>6} bits")
+        print("bit lane  " + " ".join(f"{i:>4}" for i in range(31, -1, -1)))
+        print("rise 0>1  " + " ".join(f"{v:>4}" for v in self.lane_rise[::-1]))
+        print("fall 1>0  " + " ".join(f"{v:>4}" for v in self.lane_fall[::-1]))
+        print("first mismatches (address: expected read):")
+        for addr, expected, read in self.first_errors[:8]:
+            print(f"  {addr:#08x}: {expected:08x} {read:08x}")
+
+    def save(self, path):
+        np.savez_compressed(path, start=self.start, length=self.length, page_size=self.page_size,
+                            page_word_errors=self.page_word_errors, page_bit_errors=self.page_bit_errors,
+                            lane_rise=self.lane_rise, lane_fall=self.lane_fall,
+                            unreadable=np.array(self.unreadable, dtype=np.int64).reshape(-1, 2),
+                            first_errors=np.array(self.first_errors, dtype=np.int64).reshape(-1, 3))
+
+def DumpFlash(port, seed, start=0, length=PATTERN_BYTES, retries=3, progress_interval=5.0):
+    # Compares the flash from start to start + length with the pattern of seed, returns a flash_error_map. Chunks that
+    # fail their CRC on the way are read again, up to retries times.
+    if start % 4 or length % 4:
+        raise ValueError("The flash dump range must be word aligned")
+    pattern = load_pattern(seed, test.QSPI_PATTERN_WORDS)
+    errors = flash_error_map(start, length)
+    ranges = list(segments(start, length))
+    began = last_progress = time.perf_counter()
+    for attempt in range(retries + 1):
+        failed = []
+        for addr, read, expected in compare_chunks(read_chunks(port, ranges, failed=failed), pattern):
+            errors.add(addr, read, expected)
+            if time.perf_counter() - last_progress >= progress_interval:
+                last_progress = time.perf_counter()
+                logging.info(f"Flash dump at {addr:#08x}, {errors.word_errors} words wrong so far")
+        if not failed: break
+        logging.info(f"{len(failed)} flash dump chunks failed their CRC or didn't arrive{', reading them again' if attempt < retries else ''}")
+        ranges = failed
+    errors.unreadable = failed
+    seconds = time.perf_counter() - began
+    logging.info(f"Flash dump of {length} bytes took {seconds:.1f} s ({errors.words * 4 / seconds:.0f} B/s)")
+    return errors
+
+if __name__ == '__main__':
+    import argparse
+    from benchmark import parse_fault
+
+    parser = argparse.ArgumentParser(description="Read back a board's QSPI flash and map where it differs from its LFSR pattern")
+    parser.add_argument("port", nargs="?", help="serial port of the board")
+    parser.add_argument("--seed", type=lambda s: int(s, 0), help="seed the flash was written with, by default the last one recorded for the board")
+    parser.add_argument("--board-id", help="board to look the seed up for, the port by default")
+    parser.add_argument("--start", type=lambda s: int(s, 0), default=0)
+    parser.add_argument("--length", type=lambda s: int(s, 0), default=PATTERN_BYTES)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--save", help="write the error maps to this .npz file")
+    parser.add_argument("--sim", action="store_true", help="run against board_sim instead of a board")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="with --sim, scale factor for all simulated delays")
+    parser.add_argument("--fault", action="append", default=[], help="inject a board_sim fault, e.g. flash_errors=5")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    seed = args.seed
+    if args.sim:
+        from board_sim import board_sim
+        port = board_sim(usb_latency=0.016, time_scale=args.time_scale, timeout=test.SERIAL_TIMEOUT)
+        port.inject(**dict(parse_fault(f) for f in args.fault))
+        if seed is None: seed = np.random.randint(0, 2**32)
+        port.flash_seed = seed
+    elif args.port:
+        if seed is None:
+            stored = test.load_qspi_state().get(args.board_id or args.port)
+            if stored is None: parser.error(f"no QSPI seed recorded for {args.board_id or args.port}, give --seed")
+            seed = stored["seed"]
+        port = test.ser.Serial(port=args.port, baudrate=115200, timeout=test.SERIAL_TIMEOUT)
+    else:
+        parser.error("give the serial port of the board, or --sim")
+
+    logging.info(f"Dumping {args.length} bytes of flash from {args.start:#08x}, comparing with seed {seed:#010x}")
+    try:
+        errors = DumpFlash(port, seed, args.start, args.length, args.retries)
+    finally:
+        port.close()
+    errors.report()
+    if args.save: errors.save(args.save)
+    raise SystemExit(0 if errors.word_errors == 0 and not errors.unreadable else 1)
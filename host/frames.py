@@ -0,0 +1,189 @@
+import binascii
+import logging
+import struct
+from test import command, hexint
+
+# Binary framed protocol, spoken by the firmware next to the hex one (see ProcessFrame in main.c). Every frame, in either
+# direction, is
+#   SYNC, length, command, payload[length], crc16 (little-endian)
+# where the CRC-16/CCITT-FALSE covers length, command and payload. The board answers every frame with exactly one frame:
+# the command with FRAME_REPLY set, or FRAME_NAK with an error code. Values travel as little-endian binary, and register
+# reads and writes take a list of addresses, so a whole cycle's register traffic fits in one frame each way.
+#
+# The engines keep building hex commands; to_binary turns a batch of them into frames, and each binary command renders its
+# reply back into the hex response of the commands it stands for, so their parsers, tallies and telemetry stay the same.
+
+SYNC = 0xa5
+PROTOCOL_VERSION = 1
+MAX_PAYLOAD = 255
+FRAME_OVERHEAD = 5
+
+FRAME_HELLO = 0x01        # => version[8], max_payload[8]
+FRAME_READ = 0x02         # address[8] x N => data[32] x N
+FRAME_WRITE = 0x03        # {address[8], data[32]} x N
+FRAME_ECHO = 0x04         # data x N => data x N
+FRAME_FLASH_ID = 0x05     # => device_id[32]
+FRAME_XADC = 0x06         # => xadc_raw[16] x 4
+FRAME_FLASH_START = 0x07  # seed[32], background quad read as 'v'
+FRAME_FLASH_POLL = 0x08   # => state[8], error_count[32], first[32], last[32], as 'p'
+FRAME_FLASH_VERIFY = 0x09 # seed[32] => as FRAME_FLASH_POLL, blocking quad read as 'q'
+FRAME_REPLY = 0x80
+FRAME_NAK = 0xff          # => error[8]
+
+NAK_CRC = 1
+NAK_COMMAND = 2
+NAK_LENGTH = 3
+
+MAX_BURST_READS = MAX_PAYLOAD // 4
+MAX_BURST_WRITES = MAX_PAYLOAD // 5
+
+def crc16(data):
+    return binascii.crc_hqx(data, 0xffff)
+
+def encode_frame(cmd, payload=b''):
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Frame payload of {len(payload)} bytes is over {MAX_PAYLOAD}")
+    body = bytes([len(payload), cmd]) + payload
+    return bytes([SYNC]) + body + struct.pack('<H', crc16(body))
+
+class frame:
+    def __init__(self, cmd, payload):
+        self.cmd = cmd
+        self.payload = payload
+
+def decode_frames(data):
+    # Decodes every complete frame in data. Returns the frames and the number of bytes used up; bytes after that are the
+    # start of a frame still coming in. Bytes that don't start a frame with a good CRC are skipped, and counted in errors.
+    data = bytes(data)
+    frames = []
+    errors = 0
+    view = memoryview(data)
+    i = 0
+    while True:
+        start = data.find(SYNC, i)
+        if start < 0:
+            errors += len(data) - i
+            return frames, len(data), errors
+        errors += start - i
+        if start + 3 > len(data):
+            return frames, start, errors
+        end = start + 3 + data[start + 1] + 2
+        if end > len(data):
+            return frames, start, errors
+        body = view[start + 1:end - 2]
+        if crc16(body) != data[end - 2] | (data[end - 1] << 8):
+            errors += 1
+            i = start + 1 # resync on the next SYNC byte
+            continue
+        frames.append(frame(data[start + 2], bytes(view[start + 3:end - 2])))
+        i = end
+
+class binary_command(command):
+    # One frame standing for one or more hex commands (parts)
+    def __init__(self, parts, cmd, payload, reply_size, render):
+        super().__init__("+".join(p.name for p in parts), encode_frame(cmd, payload), FRAME_OVERHEAD + reply_size, busy=sum(p.busy for p in parts))
+        self.parts = parts
+        self.cmd = cmd
+        self.render = render # reply payload => one hex response per part
+    def parse_reply(self, reply):
+        # sets the response of every part and returns their results
+        if reply is not None and reply.cmd == FRAME_NAK:
+            logging.error(f"{self.name} refused by the board with error {reply.payload[:1].hex()}")
+        elif reply is not None and len(reply.payload) != self.response_size - FRAME_OVERHEAD:
+            logging.error(f"Reply to {self.name} has {len(reply.payload)} bytes, expected {self.response_size - FRAME_OVERHEAD}")
+            reply = None
+        if reply is None or reply.cmd == FRAME_NAK:
+            return [False if p.parse is not None else None for p in self.parts]
+        self.response = reply.payload
+        results = []
+        for part, response in zip(self.parts, self.render(reply.payload)):
+            part.response = response
+            results.append(part.parse(response) if part.parse is not None else None)
+        return results
+
+def parse_frame_responses(commands, raw):
+    # the binary counterpart of test.parse_responses: decodes the replies to a batch of binary commands and returns the
+    # results of the hex commands they stand for, in order
+    frames, _, errors = decode_frames(raw)
+    if errors:
+        logging.error(f"Skipped {errors} bytes of corrupt reply frames")
+    # Replies pair up with commands in order, as long as each one answers the command it is paired with (its reply or a
+    # NAK). Once one doesn't, a reply was lost or corrupt and the rest can't be told apart, so none of them counts: a reply
+    # of the same size on the wrong command would otherwise parse cleanly into a false result.
+    results = []
+    paired = True
+    for i, c in enumerate(commands):
+        reply = frames[i] if paired and i < len(frames) else None
+        if reply is not None and reply.cmd not in (c.cmd | FRAME_REPLY, FRAME_NAK):
+            logging.error(f"Reply {reply.cmd:#04x} doesn't answer {c.name}, the replies from there on are out of step")
+            paired = False
+            reply = None
+        elif reply is None:
+            logging.error(f"No response to {c.name}")
+        results += c.parse_reply(reply)
+    return results
+
+def hello_command():
+    def parse(raw):
+        frames, _, _ = decode_frames(raw)
+        if not frames or frames[0].cmd != FRAME_HELLO | FRAME_REPLY or len(frames[0].payload) < 1:
+            return None
+        return frames[0].payload[0]
+    return command("Hello", encode_frame(FRAME_HELLO), FRAME_OVERHEAD + 2, parse)
+
+def negotiated(port, version):
+    # result of a hello_command. Firmware without the binary protocol doesn't answer; each byte of the request only toggles
+    # its UART error LED, as none of them is a hex command letter.
+    if not version:
+        port.reset_input_buffer()
+        logging.info("Board doesn't speak the binary protocol, using the hex protocol")
+        return False
+    logging.info(f"Board speaks binary protocol version {version}, using it")
+    return True
+
+def to_binary(commands):
+    # Converts a batch of hex commands, keeping their order. Runs of register reads and runs of register writes become
+    # one burst frame each.
+    binary = []
+    i = 0
+    while i < len(commands):
+        c = commands[i]
+        op = chr(c.request[0])
+        if op in 'rw':
+            limit = MAX_BURST_READS if op == 'r' else MAX_BURST_WRITES
+            j = i
+            while j < len(commands) and chr(commands[j].request[0]) == op and j - i < limit: j += 1
+            binary.append(burst(commands[i:j]))
+            i = j
+            continue
+        binary.append(single(c))
+        i += 1
+    return binary
+
+def burst(parts):
+    addresses = [int(p.request[1:3], 16) for p in parts]
+    if chr(parts[0].request[0]) == 'r':
+        render = lambda payload: [hexint(v, 8) for v in struct.unpack(f'<{len(parts)}I', payload)]
+        return binary_command(parts, FRAME_READ, bytes(addresses), 4 * len(parts), render)
+    payload = b''.join(struct.pack('<BI', a, int(p.request[3:11], 16)) for a, p in zip(addresses, parts))
+    return binary_command(parts, FRAME_WRITE, payload, 0, lambda payload: [None] * len(parts))
+
+def render_flash_result(payload):
+    state, error_count, first, last = struct.unpack('<BIII', payload)
+    return [hexint(state, 1) + hexint(error_count, 8) + hexint(first, 8) + hexint(last, 8)]
+
+def single(c):
+    op = chr(c.request[0])
+    if op == 'e':
+        return binary_command([c], FRAME_ECHO, c.request[3:], c.response_size, lambda payload: [payload])
+    if op == 'f':
+        return binary_command([c], FRAME_FLASH_ID, b'', 4, lambda payload: [hexint(struct.unpack('<I', payload)[0], 6)])
+    if op == 'x':
+        return binary_command([c], FRAME_XADC, b'', 8, lambda payload: [b''.join(hexint(v, 4) for v in struct.unpack('<4H', payload))])
+    if op == 'v':
+        return binary_command([c], FRAME_FLASH_START, struct.pack('<I', int(c.request[1:9], 16)), 0, lambda payload: [None])
+    if op == 'p':
+        return binary_command([c], FRAME_FLASH_POLL, b'', 13, render_flash_result)
+    if op == 'q':
+        return binary_command([c], FRAME_FLASH_VERIFY, struct.pack('<I', int(c.request[1:9], 16)), 13, render_flash_result)
+    raise ValueError(f"No binary form for command {c.name} ({c.request[:1]})")
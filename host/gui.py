@@ -6,17 +6,36 @@ if __name__ == '__main__':
     from time import sleep
     import sys
     import os
-    from daemon import daemon_handler
+    import sqlite3
+    import asyncio
+    import queue
+    from collections import deque
+    from daemon import daemon_handler, STOP_TIMEOUT
     from test import test_obj
+    from async_engine import async_test_engine, pump_event_loop
+    from vivado_session import vivado_session
+    from telemetry import telemetry_recorder
+    from trends import trend_plot
+    from results_index import results_index, record_run
 
     def init_logging(include_console=False, text_handler=None):
         logging.basicConfig(level=logging.INFO)
         log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
         logger = logging.getLogger()
 
-        i = 0
-        while os.path.exists(f"run_{i}.log"): i += 1
-        file_handler = logging.FileHandler(f"run_{i}.log")
+        try:
+            index = results_index()
+            try:
+                run_name = index.new_log_name("run")
+            finally:
+                index.close()
+        except (sqlite3.Error, OSError) as e:
+            # the app still starts without the index, numbering its log as it did before there was one
+            logging.error(f"Couldn't take the run number from the results index: {e}")
+            i = 0
+            while os.path.exists(f"run_{i}.log"): i += 1
+            run_name = f"run_{i}"
+        file_handler = logging.FileHandler(f"{run_name}.log")
         file_handler.setFormatter(log_formatter)
         logger.addHandler(file_handler)
 
@@ -28,24 +47,47 @@ if __name__ == '__main__':
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
         logger = logging.getLogger()
         logger.addHandler(text_handler)
+        return run_name
 
     # TextHandler for logging that connects the logger to a tkinter text widget.
     #   only maintains the last several "blocks", sections of text defined by a detectable pattern in the logged strings
+    #   records can come from any thread: emit only queues them, and the Tk mainloop drains the queue every interval_ms,
+    #   writing everything that came in since the last drain to the widget in one update
     class TextHandler(logging.Handler):
-        def __init__(self, text_widget):
+        def __init__(self, text_widget, max_blocks=2, max_block_records=1000, interval_ms=100):
             super().__init__()
             self.text_widget = text_widget
-            self.start_of_block = "1.0"
+            self.interval_ms = interval_ms
+            self.records = queue.SimpleQueue()
+            self.blocks = deque([deque(maxlen=max_block_records)], maxlen=max_blocks)
+            self.max_block_records = max_block_records
+            self.text_widget.after(self.interval_ms, self.pump)
         def emit(self, record):
-            msg = self.format(record)
-            self.text_widget.configure(state='normal') # allow writing to the block
-            # if the controlling thread sends a block marker, clear everything before the previous and append latest
-            if self.mark_block(msg):
-                r = int(self.start_of_block.split('.')[0]) - 1
-                if r > 0: self.text_widget.delete(1.0, f"{r}.0")
-                self.start_of_block = self.text_widget.index(END)
-            self.text_widget.insert(END, msg + '\n')
-            self.text_widget.configure(state='disabled') # disable user from writing to the block
+            self.records.put(self.format(record))
+        def pump(self):
+            new = []
+            redraw = False
+            while True:
+                try:
+                    msg = self.records.get_nowait()
+                except queue.Empty:
+                    break
+                # a block marker starts a new block, pushing the oldest one out
+                if self.mark_block(msg):
+                    redraw |= len(self.blocks) == self.blocks.maxlen
+                    self.blocks.append(deque(maxlen=self.max_block_records))
+                redraw |= len(self.blocks[-1]) == self.max_block_records
+                self.blocks[-1].append(msg)
+                new.append(msg)
+            if new:
+                self.text_widget.configure(state='normal') # allow writing to the block
+                if redraw:
+                    self.text_widget.delete(1.0, END)
+                    self.text_widget.insert(END, ''.join(msg + '\n' for block in self.blocks for msg in block))
+                else:
+                    self.text_widget.insert(END, ''.join(msg + '\n' for msg in new))
+                self.text_widget.configure(state='disabled') # disable user from writing to the block
+            self.text_widget.after(self.interval_ms, self.pump)
         def mark_block(self, msg):
             if msg.split(' ')[0] == "Cycle":
                 return True
@@ -59,6 +101,7 @@ if __name__ == '__main__':
     
     settings = {
         "enable_xadc":          BooleanVar(root, True),
+        "enable_xadc_burst":    BooleanVar(root, False),
         "enable_flash_id":      BooleanVar(root, True),
         "enable_flash_verify":  BooleanVar(root, True),
         "enable_uart_echo":     BooleanVar(root, True),
@@ -69,28 +112,90 @@ if __name__ == '__main__':
         "dio_mode":             IntVar(root, 1),
         "bram_both_banks":      BooleanVar(root, True),
         "bram_max_address":     IntVar(root, 0x1fff),
-        "bram_passes":          IntVar(root, 8000),
+        "bram_passes":          IntVar(root, 2000),
+        "bram_continuous":      BooleanVar(root, False),
+        "uart_echo_size":       IntVar(root, 100),
+        "xadc_burst_samples":   IntVar(root, 256),
+        "xadc_burst_decimation": IntVar(root, 1),
+        "async_engine":         BooleanVar(root, False),
+        "vivado_session":       BooleanVar(root, False),
+        "reuse_qspi":           BooleanVar(root, False),
+        "binary_protocol":      BooleanVar(root, True),
         "com_port":             sys.argv[1]
     }
 
+    # started on the first run that uses it and kept open until the app quits, so re-flashing between runs skips
+    # Vivado's startup and the hardware server connection
+    vivado = vivado_session()
+
+    def start_telemetry(obj, settings):
+        # every Start of the app gets its own part files next to the run's log name
+        meta = {name: value.get() for name, value in settings.items() if hasattr(value, "get")}
+        meta.update(com_port=settings["com_port"], qspi_seed=int(obj.qspi_seed))
+        obj.telemetry = telemetry_recorder(run_name, meta=meta)
+        obj.telemetry.listeners.append(trends.add_record)
+
+    def record_result(obj, settings):
+        # once the telemetry is closed, so the index knows the parts it wrote
+        record_run(obj, {name: value.get() for name, value in settings.items() if hasattr(value, "get")}, run_name)
+
     class test_daemon(daemon_handler):
         def enlist_daemon(self, settings):
             self.settings = settings
             self.test_obj = test_obj()
+            self.test_obj.stop_event = self.stop_event
+            if settings["vivado_session"].get(): self.test_obj.vivado = vivado
             return super().enlist_daemon(self.setup_task, self.loop_task, self.after_task)
-        def stop_daemon(self):
-            return super().stop_daemon()
+        def stop_daemon(self, timeout=None):
+            return super().stop_daemon(timeout)
         def setup_task(self):
             self.test_obj.setup_test(self.settings)
+            start_telemetry(self.test_obj, self.settings)
             logging.info("Starting my task")
         def loop_task(self, cycle):
             logging.info(f"Cycle {cycle} starting")
             self.test_obj.run_test()
         def after_task(self):
             self.test_obj.stop_test()
+            self.test_obj.telemetry.close()
+            record_result(self.test_obj, self.settings)
             logging.info("Wrapped up")
 
+    # Runs the test on an asyncio loop that is stepped from the Tk mainloop, so no thread is needed and Stop cancels the
+    # test at its next await instead of at the end of the cycle
+    class async_test:
+        def __init__(self, root):
+            self.root = root
+            self.loop = asyncio.new_event_loop()
+            self.task = None
+            self.stop_pump = None
+        def enlist(self, settings):
+            if not self.task is None and not self.task.done(): return
+            obj = test_obj()
+            obj.setup_test(settings)
+            if settings["vivado_session"].get(): obj.vivado = vivado
+            start_telemetry(obj, settings)
+            logging.info("Starting my task")
+            self.task = self.loop.create_task(self.run(obj, settings))
+            if self.stop_pump is None: self.stop_pump = pump_event_loop(self.root, self.loop)
+        async def run(self, obj, settings):
+            try:
+                await async_test_engine(obj).run()
+            finally:
+                obj.telemetry.close()
+                record_result(obj, settings)
+                logging.info("Wrapped up")
+        def stop(self):
+            if not self.task is None: self.task.cancel()
+        def close(self):
+            self.stop()
+            if not self.task is None:
+                self.loop.run_until_complete(asyncio.gather(self.task, return_exceptions=True))
+            if not self.stop_pump is None: self.stop_pump()
+            self.loop.close()
+
     test = test_daemon()
+    async_runner = async_test(root)
 
     frm             = ttk.Frame(root, padding=10)
     mode_frm        = ttk.Frame(frm, padding=10)
@@ -105,7 +210,12 @@ if __name__ == '__main__':
     control_frm.grid(column=0, row=3)
     log_frame.grid(column=1, row=0, rowspan=3)
 
+    # kept across runs, so a soak that was restarted still shows as one trend
+    trends = trend_plot(frm, padding=10)
+    trends.grid(column=2, row=0, rowspan=4, sticky='n')
+
     ttk.Checkbutton(settings_frm, text="enable_xadc", variable=settings["enable_xadc"]).grid(sticky='nw')
+    ttk.Checkbutton(settings_frm, text="enable_xadc_burst", variable=settings["enable_xadc_burst"]).grid(sticky='nw')
     ttk.Checkbutton(settings_frm, text="enable_flash_id", variable=settings["enable_flash_id"]).grid(sticky='nw')
     ttk.Checkbutton(settings_frm, text="enable_flash_verify", variable=settings["enable_flash_verify"]).grid(sticky='nw')
     ttk.Checkbutton(settings_frm, text="enable_uart_echo", variable=settings["enable_uart_echo"]).grid(sticky='nw')
@@ -113,6 +223,11 @@ if __name__ == '__main__':
     ttk.Checkbutton(settings_frm, text="enable_mouse", variable=settings["enable_mouse"]).grid(sticky='nw')
     ttk.Checkbutton(settings_frm, text="enable_bram_test", variable=settings["enable_bram_test"]).grid(sticky='nw')
     ttk.Checkbutton(settings_frm, text="bram_both_banks", variable=settings["bram_both_banks"]).grid(stick='nw')
+    ttk.Checkbutton(settings_frm, text="bram_continuous", variable=settings["bram_continuous"]).grid(sticky='nw')
+    ttk.Checkbutton(settings_frm, text="async_engine", variable=settings["async_engine"]).grid(sticky='nw')
+    ttk.Checkbutton(settings_frm, text="vivado_session", variable=settings["vivado_session"]).grid(sticky='nw')
+    ttk.Checkbutton(settings_frm, text="reuse_qspi", variable=settings["reuse_qspi"]).grid(sticky='nw')
+    ttk.Checkbutton(settings_frm, text="binary_protocol", variable=settings["binary_protocol"]).grid(sticky='nw')
 
     Label(dio_numeric_frm, text="DIO frequency divider").grid(sticky='nw')
     Entry(dio_numeric_frm, textvariable=settings["dio_divider"]).grid(sticky='nw')
@@ -120,6 +235,15 @@ if __name__ == '__main__':
     Label(dio_numeric_frm, text="BRAM write/read passes per loop").grid(sticky='nw')
     Entry(dio_numeric_frm, text="bram_passes", textvariable=settings["bram_passes"]).grid(sticky='nw')
 
+    Label(dio_numeric_frm, text="UART echo bytes per cycle (1-255)").grid(sticky='nw')
+    Entry(dio_numeric_frm, textvariable=settings["uart_echo_size"]).grid(sticky='nw')
+
+    Label(dio_numeric_frm, text="XADC burst samples (1-1024)").grid(sticky='nw')
+    Entry(dio_numeric_frm, textvariable=settings["xadc_burst_samples"]).grid(sticky='nw')
+
+    Label(dio_numeric_frm, text="XADC burst decimation (1-255)").grid(sticky='nw')
+    Entry(dio_numeric_frm, textvariable=settings["xadc_burst_decimation"]).grid(sticky='nw')
+
     dio_radio = [
         ttk.Radiobutton(mode_frm, text='DIO_MODE_OFF',                      value=0, variable=settings["dio_mode"]),
         ttk.Radiobutton(mode_frm, text='DIO_MODE_IMMUNITY_TOP_TO_BOTTOM',   value=1, variable=settings["dio_mode"]),
@@ -131,16 +255,31 @@ if __name__ == '__main__':
     text_box = Text(log_frame, height=20, width=80)
     text_box.pack()
 
-    init_logging(False, TextHandler(text_box))
+    run_name = init_logging(False, TextHandler(text_box))
 
-    def quit_app(test: test_daemon):
+    def start_test():
+        if settings["async_engine"].get():
+            if not test.thread is None and test.thread.is_alive(): return
+            async_runner.enlist(settings)
+        else:
+            if not async_runner.task is None and not async_runner.task.done(): return
+            test.enlist_daemon(settings)
+
+    def stop_test():
         test.stop_daemon()
+        async_runner.stop()
+
+    def quit_app(test: test_daemon):
+        # the loop gets to close the serial port and the telemetry files before the process goes
+        test.stop_daemon(timeout=STOP_TIMEOUT)
+        async_runner.close()
+        vivado.close()
         logging.info(f"Quitting test app")
         root.destroy()
 
     # Create a button widget
-    ttk.Button(control_frm, text="Start", command=lambda: test.enlist_daemon(settings)).grid(column=0, row=0)
-    ttk.Button(control_frm, text="Stop", command=lambda: test.stop_daemon()).grid(column=1, row=0)
+    ttk.Button(control_frm, text="Start", command=start_test).grid(column=0, row=0)
+    ttk.Button(control_frm, text="Stop", command=stop_test).grid(column=1, row=0)
     ttk.Button(control_frm, text="Quit", command=lambda: quit_app(test)).grid(column=2, row=0)
 
     # Start the main event loop
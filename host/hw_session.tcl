@@ -0,0 +1,73 @@
+# Programming steps shared by program_device.tcl, program_qspi.tcl and the persistent session in vivado_session.py.
+# Every proc can be called again in the same Vivado process: the hardware server and target are only opened when they
+# aren't already.
+set hw_scriptdir [file dirname [file normalize [info script]]]
+set fpga_part {xc7a35t_0}
+set qspi_part {mx25l3273f-spi-x1_x2_x4}
+
+# serial picks the JTAG cable by serial number when several boards are attached, the first one is used when it's empty
+proc open_target {{serial ""}} {
+    if {[catch {current_hw_server}]} {
+        open_hw_manager
+        connect_hw_server -allow_non_jtag
+    }
+    set target [lindex [get_hw_targets -quiet *$serial*] 0]
+    if {$target eq ""} {
+        # a board plugged in since the server was connected
+        refresh_hw_server
+        set target [lindex [get_hw_targets *$serial*] 0]
+    }
+    if {[catch {current_hw_target} current] || $current ne $target || ![get_property IS_OPENED $target]} {
+        catch {close_hw_target}
+        open_hw_target $target
+    }
+    puts "INFO: Opened hardware target $target"
+}
+
+proc program_bitstream {} {
+    set device [lindex [get_hw_devices $::fpga_part] 0]
+    current_hw_device $device
+    refresh_hw_device -update_hw_probes false $device
+    set_property PROBES.FILE $::hw_scriptdir/design_1_wrapper.ltx $device
+    set_property FULL_PROBES.FILE {} $device
+    set_property PROGRAM.FILE $::hw_scriptdir/top_out.bit $device
+    program_hw_devices $device
+    refresh_hw_device $device
+}
+
+proc program_cfgmem {binfile} {
+    set hw_device [lindex [get_hw_devices $::fpga_part] 0]
+
+    current_hw_device $hw_device
+    refresh_hw_device -update_hw_probes false ${hw_device}
+    if {[get_property PROGRAM.HW_CFGMEM ${hw_device}] eq ""} {
+        create_hw_cfgmem -hw_device ${hw_device} -mem_dev [lindex [get_cfgmem_parts $::qspi_part] 0]
+    }
+    set_property PROGRAM.BLANK_CHECK  0 [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    set_property PROGRAM.ERASE        1 [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    set_property PROGRAM.CFG_PROGRAM  1 [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    set_property PROGRAM.VERIFY       1 [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    set_property PROGRAM.CHECKSUM     0 [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    refresh_hw_device ${hw_device}
+
+    puts "INFO: Detected $::fpga_part board and added $::qspi_part config memory"
+
+    set_property PROGRAM.ADDRESS_RANGE {use_file} [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    set_property PROGRAM.FILES [list $binfile] [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    set_property PROGRAM.PRM_FILE {} [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    set_property PROGRAM.UNUSED_PIN_TERMINATION {pull-none} [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    set_property PROGRAM.BLANK_CHECK    0 [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    set_property PROGRAM.ERASE          1 [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    set_property PROGRAM.CFG_PROGRAM    1 [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    set_property PROGRAM.VERIFY         1 [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    set_property PROGRAM.CHECKSUM       0 [get_property PROGRAM.HW_CFGMEM ${hw_device}]
+
+    puts "INFO: Configured QSPI programming"
+
+    startgroup 
+    create_hw_bitstream -hw_device ${hw_device} [get_property PROGRAM.HW_CFGMEM_BITFILE ${hw_device}]; program_hw_devices ${hw_device}; refresh_hw_device ${hw_device};
+    program_hw_cfgmem -hw_cfgmem [ get_property PROGRAM.HW_CFGMEM ${hw_device}]
+    endgroup
+
+    puts "QSPI programming complete"
+}
@@ -0,0 +1,108 @@
+import bisect
+import logging
+
+# Latency of every command and cycle, kept in fixed-bucket histograms so it costs a bisect and an increment per sample and
+# can stay on for every run. transact reads a batch's responses one command at a time and charges each command with the
+# time from the previous response (or the end of the write) to its own last byte. What that leaves once the response's
+# own time on the wire is taken off, the wait, is the firmware's processing plus the USB latency. Per cycle, the time
+# outside transact is the host's.
+#   python instrument.py --cycles 50     runs cycles against board_sim and prints the table
+
+BUCKETS_PER_DECADE = 20 # about 12% wide
+MIN_LATENCY = 1e-5
+DECADES = 7 # up to 100 seconds
+EDGES = [MIN_LATENCY * 10 ** (i / BUCKETS_PER_DECADE) for i in range(DECADES * BUCKETS_PER_DECADE + 1)]
+
+class latency_histogram:
+    def __init__(self):
+        self.counts = [0] * (len(EDGES) + 1) # counts[i] are samples below EDGES[i], the last one those above all edges
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_right(EDGES, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max: self.max = seconds
+
+    def percentile(self, q):
+        # upper edge of the bucket holding the q-th percentile, never more than the largest sample
+        if self.count == 0: return float('nan')
+        target = q / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n:
+                return min(EDGES[i] if i < len(EDGES) else self.max, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else float('nan')
+
+class latency_stats:
+    # histograms by name, of commands (or frames, in the binary protocol) and of the parts of a cycle
+    def __init__(self):
+        self.latency = {}
+        self.wait = {}
+        self.timeouts = {} # reads that ended without the whole response, by command name
+
+    def record(self, name, seconds, wait=None):
+        h = self.latency.get(name)
+        if h is None: h = self.latency[name] = latency_histogram()
+        h.record(seconds)
+        if wait is None: return
+        h = self.wait.get(name)
+        if h is None: h = self.wait[name] = latency_histogram()
+        h.record(max(wait, 0.0))
+
+    def timeout(self, name):
+        self.timeouts[name] = self.timeouts.get(name, 0) + 1
+
+    def summary(self):
+        summary = {}
+        for name, h in self.latency.items():
+            wait = self.wait.get(name)
+            summary[name] = {
+                "count":    h.count,
+                "p50":      h.percentile(50),
+                "p99":      h.percentile(99),
+                "max":      h.max,
+                "mean":     h.mean,
+                "wait_p50": wait.percentile(50) if wait is not None else None,
+                "wait_p99": wait.percentile(99) if wait is not None else None,
+                "timeouts": self.timeouts.get(name, 0),
+            }
+        return summary
+
+    def log(self, title="Latency"):
+        ms = lambda s: f"{s * 1000:9.2f}" if s is not None else f"{'':9}"
+        summary = self.summary()
+        width = max([len(name) for name in summary] + [8])
+        logging.info(f"{title} in ms: {'':<{max(0, width - len(title) - 7)}} {'count':>7} {'p50':>9} {'p99':>9} {'max':>9} {'wait p50':>9} {'wait p99':>9} {'timeouts':>8}")
+        for name, s in summary.items():
+            logging.info(f"  {name:<{width}} {s['count']:>7} {ms(s['p50'])} {ms(s['p99'])} {ms(s['max'])} {ms(s['wait_p50'])} {ms(s['wait_p99'])} {s['timeouts']:>8}")
+
+if __name__ == '__main__':
+    import argparse
+    import test
+    from board_sim import board_sim
+    from benchmark import CHECKS, make_settings
+
+    parser = argparse.ArgumentParser(description="Measure the latency of every check against board_sim")
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--protocol", choices=["binary", "hex"], default="binary")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+
+    sim = board_sim(usb_latency=0.016)
+    obj = test.test_obj()
+    obj.setup_test(make_settings(set(CHECKS.values()), args.protocol == "binary"))
+    obj.port_factory = sim.connect
+    obj.cycle_period = 0
+    sim.flash_seed = obj.qspi_seed
+    obj.init_sequence = 2
+    for _ in range(args.cycles + 1): obj.run_test()
+    logging.getLogger().setLevel(logging.INFO)
+    obj.stop_test() # logs the table
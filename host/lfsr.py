@@ -0,0 +1,141 @@
+import os
+import numpy as np
+
+# 32-bit Fibonacci LFSR shared with the firmware (LfsrNext in flash.c) and the BRAM test (bram_test.sv): taps 31, 21, 1, 0, shifting left
+def lfsr_next(lfsr):
+    pickbit = lambda x, i: (x >> i) & 0x1
+    return ((lfsr << 1) | (pickbit(lfsr, 31) ^ pickbit(lfsr, 21) ^ pickbit(lfsr, 1) ^ pickbit(lfsr, 0))) & 0xffffffff
+
+def lfsr_step(states):
+    # one LFSR step applied to every element of a uint32 array at once
+    return (states << np.uint32(1)) | (((states >> np.uint32(31)) ^ (states >> np.uint32(21)) ^ (states >> np.uint32(1)) ^ states) & np.uint32(1))
+
+# GF(2) matrices are stored as 32 uint32 columns: column j is the image of the state with only bit j set
+def step_matrix():
+    return np.array([lfsr_next(1 << j) for j in range(32)], dtype=np.uint32)
+
+def matrix_apply(matrix, states):
+    states = np.asarray(states, dtype=np.uint32)
+    result = np.zeros_like(states)
+    for j in range(32):
+        result ^= matrix[j] * ((states >> np.uint32(j)) & np.uint32(1))
+    return result
+
+def matrix_multiply(a, b):
+    # columns of a*b are a applied to the columns of b
+    return matrix_apply(a, b)
+
+def matrix_power(matrix, n):
+    result = np.array([1 << j for j in range(32)], dtype=np.uint32)
+    while n > 0:
+        if n & 1: result = matrix_multiply(matrix, result)
+        matrix = matrix_multiply(matrix, matrix)
+        n >>= 1
+    return result
+
+def lfsr_jump(seed, n):
+    # state after n steps from seed, in O(log n) matrix products
+    return int(matrix_apply(matrix_power(step_matrix(), n), np.uint32(seed)))
+
+def lfsr_sequence(seed, count, block=256):
+    # Returns the first count words following seed, i.e. [lfsr_next(seed), lfsr_next(lfsr_next(seed)), ...].
+    # The sequence is cut into lanes of block words. The start state of every lane is found by repeatedly doubling the lane
+    # count with jump-ahead matrices, then all lanes are stepped together so only block vectorized steps are needed.
+    lanes = max(1, -(-count // block))
+    starts = np.array([seed], dtype=np.uint32)
+    jump = matrix_power(step_matrix(), block)
+    while len(starts) < lanes:
+        starts = np.concatenate((starts, matrix_apply(jump, starts)))
+        jump = matrix_multiply(jump, jump)
+    states = starts[:lanes]
+    words = np.empty((block, lanes), dtype=np.uint32)
+    for i in range(block):
+        states = lfsr_step(states)
+        words[i] = states
+    return words.T.reshape(-1)[:count]
+
+def lfsr_bytes(seed, count):
+    # file/flash layout: little-endian words, matching what the MicroBlaze reads back in ValidateAgainstLfsr
+    return lfsr_sequence(seed, count).astype('<u4').tobytes()
+
+# On-disk cache of generated patterns, keyed by seed and length. Least recently used files are evicted once the cache grows
+# past max_bytes.
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "lfsr_cache")
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def cache_path(seed, count, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{int(seed):08x}_{count}.bin")
+
+def evict_cache(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES, keep=None):
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith(".bin"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes: break
+        if path == keep: continue
+        os.remove(path)
+        total -= size
+
+def cached_pattern(seed, count, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    # returns the path of a cache file holding lfsr_bytes(seed, count), generating it on a miss
+    path = cache_path(seed, count, cache_dir)
+    if os.path.exists(path) and os.path.getsize(path) == count * 4:
+        os.utime(path) # mark as recently used
+        return path
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(lfsr_bytes(seed, count))
+    os.replace(tmp_path, path) # atomic, so a concurrent reader never sees a partial file
+    evict_cache(cache_dir, max_bytes, keep=path)
+    return path
+
+def load_pattern(seed, count, cache_dir=CACHE_DIR):
+    # read-only view of a cached pattern, paged in from disk on demand
+    return np.memmap(cached_pattern(seed, count, cache_dir), dtype='<u4', mode='r')
+
+if __name__ == '__main__':
+    # Benchmark: the original per-word loop against the vectorized engine, cold and cached
+    import io
+    import shutil
+    import tempfile
+    import time
+
+    size = 1024 * 128
+    seed = np.random.randint(0, 2**32, dtype=np.uint32)
+
+    def reference_loop(seed, size):
+        lfsr = seed
+        binfile = io.BytesIO()
+        for _ in range(size):
+            lfsr = lfsr_next(lfsr)
+            binfile.write(np.uint32.tobytes(lfsr))
+        return binfile.getvalue()
+
+    def timed(f, *args):
+        start = time.perf_counter()
+        result = f(*args)
+        return result, time.perf_counter() - start
+
+    cache_dir = tempfile.mkdtemp()
+    try:
+        reference, t_reference = timed(reference_loop, seed, size)
+        vectorized, t_vectorized = timed(lfsr_bytes, seed, size)
+        path, t_cold = timed(cached_pattern, seed, size, cache_dir)
+        path, t_warm = timed(cached_pattern, seed, size, cache_dir)
+        with open(path, "rb") as f:
+            cached = f.read()
+    finally:
+        shutil.rmtree(cache_dir)
+
+    assert vectorized == reference, "vectorized LFSR does not match lfsr_next"
+    assert cached == reference, "cached LFSR does not match lfsr_next"
+    assert lfsr_jump(seed, size) == int.from_bytes(reference[-4:], 'little'), "jump-ahead does not match lfsr_next"
+    print(f"seed={hex(seed)}, {size} words")
+    print(f"lfsr_next loop:   {t_reference * 1000:9.2f} ms")
+    print(f"vectorized:       {t_vectorized * 1000:9.2f} ms ({t_reference / t_vectorized:.0f}x)")
+    print(f"cache miss:       {t_cold * 1000:9.2f} ms")
+    print(f"cache hit:        {t_warm * 1000:9.2f} ms ({t_reference / t_warm:.0f}x)")
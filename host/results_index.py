@@ -0,0 +1,276 @@
+import contextlib
+import glob
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+import numpy as np
+import telemetry
+
+# Index of the results of every test run, an SQLite database next to the scripts, so a question over the whole lab's
+# history ("which boards failed flash verify in DIO_MODE_EMISSIONS at divider 3") is one indexed query instead of a grep
+# through every run_{i}.log. A run is added when it ends, with its settings, board, seeds and the passed and failed counts
+# of every check, by the names of the commands (TestEcho, CheckDio, FlashRead...). Runs that only left their telemetry
+# behind (the process died, or they ran before the index) are added by ingest, which remembers how far it read each
+# telemetry part and only reads the records written since.
+#   python results_index.py ingest
+#   python results_index.py runs --set dio_mode=3 --set dio_divider=3 --failed FlashRead
+#   python results_index.py boards --failed FlashRead --since 2026-10-01
+#   python results_index.py sql "SELECT board_id, count(*) FROM runs GROUP BY board_id"
+
+RESULTS_DB = os.path.join(os.path.dirname(__file__), "results.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id            INTEGER PRIMARY KEY,
+    log           TEXT,    -- name of the run's log and telemetry, e.g. run_3
+    started       REAL,    -- seconds since the epoch
+    ended         REAL,
+    port          TEXT,
+    board_id      TEXT,    -- the JTAG cable's serial number, the port without one
+    serial_number TEXT,
+    qspi_seed     INTEGER,
+    rng_seed      INTEGER, -- of test.rng, when the run seeded it
+    cycles        INTEGER,
+    reconnects    INTEGER,
+    connected     INTEGER,
+    error         TEXT,
+    settings      TEXT     -- JSON of all settings, the numeric ones are also in the settings table
+);
+CREATE TABLE IF NOT EXISTS settings (run_id INTEGER, name TEXT, value INTEGER, PRIMARY KEY (run_id, name));
+CREATE TABLE IF NOT EXISTS checks (run_id INTEGER, name TEXT, passed INTEGER, failed INTEGER, PRIMARY KEY (run_id, name));
+CREATE TABLE IF NOT EXISTS parts (path TEXT PRIMARY KEY, run_id INTEGER, records INTEGER, mtime INTEGER); -- telemetry read
+CREATE TABLE IF NOT EXISTS names (prefix TEXT PRIMARY KEY, next INTEGER); -- next log number, see new_log_name
+CREATE INDEX IF NOT EXISTS settings_by_value ON settings (name, value, run_id);
+CREATE INDEX IF NOT EXISTS checks_by_failed ON checks (name, failed, run_id);
+CREATE INDEX IF NOT EXISTS runs_by_board ON runs (board_id);
+CREATE INDEX IF NOT EXISTS runs_by_started ON runs (started);
+"""
+
+# *_passed field of a telemetry record: the command it holds the verdict of
+TELEMETRY_CHECKS = {
+    "echo_passed":     "TestEcho",
+    "dio_passed":      "CheckDio",
+    "bram_passed":     "CheckBram",
+    "flash_id_passed": "FlashReadId",
+    "flash_passed":    "FlashRead",
+    "mouse_passed":    "CheckMouse",
+}
+# what telemetry meta holds besides the settings
+TELEMETRY_META = ("com_port", "qspi_seed", "serial_number")
+
+class results_index:
+    def __init__(self, path=RESULTS_DB):
+        self.path = path
+        # the boards of a farm end their runs together, each from its own process: writers wait for each other, and
+        # readers don't wait for writers
+        self.db = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def new_log_name(self, prefix="run", directory="."):
+        # the first <prefix>_<i> without a log in directory; the index keeps the next i, so only logs written without it
+        # are ever scanned past
+        with self.transaction():
+            row = self.db.execute("SELECT next FROM names WHERE prefix = ?", (prefix,)).fetchone()
+            i = row[0] if row else 0
+            while os.path.exists(os.path.join(directory, f"{prefix}_{i}.log")): i += 1
+            self.db.execute("INSERT OR REPLACE INTO names VALUES (?, ?)", (prefix, i + 1))
+        return f"{prefix}_{i}"
+
+    def add_run(self, settings, tally, parts=(), **fields):
+        # fields are columns of runs, tally {check name: [passed, failed]} as in test_obj.tally, and parts the (path,
+        # records) of the telemetry the run wrote, which ingest then leaves alone; returns the run's id
+        columns = ["settings"] + list(fields)
+        paths = [os.path.abspath(path) for path, _ in parts]
+        with self.transaction():
+            # an ingest while the run was going added it from its telemetry already
+            for (stale,) in self.db.execute(f"SELECT DISTINCT run_id FROM parts WHERE run_id IS NOT NULL AND path IN ({', '.join('?' * len(paths))})", paths).fetchall():
+                for table, column in (("runs", "id"), ("settings", "run_id"), ("checks", "run_id"), ("parts", "run_id")):
+                    self.db.execute(f"DELETE FROM {table} WHERE {column} = ?", (stale,))
+            run_id = self.db.execute(f"INSERT INTO runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                                     [json.dumps(settings)] + list(fields.values())).lastrowid
+            self._add_counts(run_id, settings, tally)
+            for path, (_, records) in zip(paths, parts):
+                self.db.execute("INSERT OR REPLACE INTO parts VALUES (?, ?, ?, ?)", (path, run_id, records, os.stat(path).st_mtime_ns))
+        return run_id
+
+    def _add_counts(self, run_id, settings, tally):
+        self.db.executemany("INSERT OR REPLACE INTO settings VALUES (?, ?, ?)",
+                            [(run_id, name, int(value)) for name, value in settings.items() if isinstance(value, (bool, int))])
+        self.db.executemany("INSERT INTO checks VALUES (?, ?, ?, ?) ON CONFLICT (run_id, name) DO UPDATE SET "
+                            "passed = passed + excluded.passed, failed = failed + excluded.failed",
+                            [(run_id, name, passed, failed) for name, (passed, failed) in tally.items()])
+
+    def ingest(self, directory=telemetry.TELEMETRY_DIR):
+        # adds what was recorded to the telemetry parts in directory since the last ingest, reading each part from the
+        # record it was read up to; a part whose modification time didn't change costs a stat. Returns the records read.
+        known = {path: mtime for path, mtime in self.db.execute("SELECT path, mtime FROM parts")}
+        read = 0
+        previous = (None, None) # telemetry name and path of the part before
+        for path in sorted(glob.glob(os.path.join(os.path.abspath(directory), "*_[0-9][0-9][0-9].tlm"))):
+            name, part = re.fullmatch(r"(.*)_(\d{3})\.tlm", os.path.basename(path)).groups()
+            if os.stat(path).st_mtime_ns != known.get(path):
+                try:
+                    read += self._ingest_part(path, name, int(part), previous)
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Skipping {path}: {e}")
+            previous = (name, path)
+        return read
+
+    def _ingest_part(self, path, name, part, previous):
+        with self.transaction():
+            # known only hints at what changed: a run that ended since (see add_run) may have taken over the part
+            row = self.db.execute("SELECT run_id, records, mtime FROM parts WHERE path = ?", (path,)).fetchone()
+            run_id, done, mtime = row if row is not None else (None, 0, None)
+            if os.stat(path).st_mtime_ns == mtime: return 0
+            header, description = telemetry.read_header(path)
+            records = telemetry.load_part(path)[done:]
+            if run_id is None and len(records):
+                row = self.db.execute("SELECT run_id FROM parts WHERE path = ?", (previous[1],)).fetchone() if previous[0] == name else None
+                if row is not None and row[0] is not None and part > 0 and records["cycle"][0] != 1:
+                    run_id = row[0] # the recorder rolled over to a new part in the middle of the run
+                else:
+                    meta = description.get("meta", {})
+                    settings = {k: v for k, v in meta.items() if k not in TELEMETRY_META}
+                    run_id = self.db.execute("INSERT INTO runs (log, started, port, board_id, serial_number, qspi_seed, cycles, "
+                                             "reconnects, connected, settings) VALUES (?, ?, ?, ?, ?, ?, 0, 0, 1, ?)",
+                                             (name, datetime.fromisoformat(description["created"]).timestamp(), meta.get("com_port"),
+                                              meta.get("serial_number") or meta.get("com_port"), meta.get("serial_number"), meta.get("qspi_seed"),
+                                              json.dumps(settings))).lastrowid
+                    self._add_counts(run_id, settings, {})
+            if len(records):
+                tally = {}
+                for field, check in TELEMETRY_CHECKS.items():
+                    if field not in records.dtype.names: continue
+                    passed, failed = np.count_nonzero(records[field] == 1), np.count_nonzero(records[field] == 0)
+                    if passed or failed: tally[check] = (int(passed), int(failed))
+                self._add_counts(run_id, {}, tally)
+                self.db.execute("UPDATE runs SET cycles = cycles + ?, ended = max(coalesce(ended, 0), ?) WHERE id = ?",
+                                (len(records), float(records["time"][-1]), run_id))
+            # the stat after reading, so records written meanwhile are read the next time
+            self.db.execute("INSERT OR REPLACE INTO parts VALUES (?, ?, ?, ?)", (path, run_id, done + len(records), os.stat(path).st_mtime_ns))
+        return len(records)
+
+    def _filter(self, settings={}, failed=(), board=None, since=None):
+        # WHERE clause and its arguments selecting runs: settings {name: value}, failed the checks that must have failed
+        # ("" for any check), board a board_id or serial number, since seconds since the epoch
+        where, args = [], []
+        for name, value in settings.items():
+            where.append("id IN (SELECT run_id FROM settings WHERE name = ? AND value = ?)")
+            args += [name, int(value)]
+        for name in failed:
+            if name:
+                where.append("id IN (SELECT run_id FROM checks WHERE name = ? AND failed > 0)")
+                args.append(name)
+            else:
+                where.append("id IN (SELECT run_id FROM checks WHERE failed > 0)")
+        if board is not None:
+            where.append("(board_id = ? OR serial_number = ?)")
+            args += [board, board]
+        if since is not None:
+            where.append("started >= ?")
+            args.append(since)
+        return (" WHERE " + " AND ".join(where)) if where else "", args
+
+    def runs(self, **filters):
+        # (id, log, started, board_id, cycles, failed checks "name failed, ...") of every run matching filters
+        where, args = self._filter(**filters)
+        return self.db.execute("SELECT id, log, started, board_id, cycles, (SELECT group_concat(name || ' ' || failed, ', ') "
+                               "FROM checks WHERE run_id = runs.id AND failed > 0) FROM runs" + where + " ORDER BY started", args).fetchall()
+
+    def boards(self, **filters):
+        # (board_id, serial number, runs, cycles, runs with a failed check, last run started) of the boards of matching runs
+        where, args = self._filter(**filters)
+        return self.db.execute("SELECT board_id, max(serial_number), count(*), sum(cycles), "
+                               "sum(EXISTS (SELECT 1 FROM checks WHERE run_id = runs.id AND failed > 0)), max(started) "
+                               "FROM runs" + where + " GROUP BY board_id ORDER BY board_id", args).fetchall()
+
+def record_run(obj, settings, log=None, path=RESULTS_DB, **fields):
+    # adds the run a test_obj finished, after its telemetry was closed; settings are plain values, fields more columns of
+    # runs (rng_seed, serial_number, error...). Not being able to index a run is logged, it doesn't fail the run.
+    values = dict(log=log, started=obj.started, ended=time.time(), port=obj.com_port, board_id=obj.board_id,
+                  qspi_seed=int(obj.qspi_seed), cycles=obj.iteration, reconnects=obj.reconnects, connected=obj.init_sequence >= 3)
+    values.update(fields)
+    parts = obj.telemetry.parts if obj.telemetry is not None else []
+    try:
+        index = results_index(path)
+        try:
+            return index.add_run(settings, obj.tally, parts, **values)
+        finally:
+            index.close()
+    except (sqlite3.Error, OSError) as e:
+        logging.error(f"Couldn't add the run to the results index {path}: {e}")
+
+if __name__ == '__main__':
+    import argparse
+    import test
+
+    parser = argparse.ArgumentParser(description="Query the results of every indexed test run")
+    parser.add_argument("--db", default=RESULTS_DB)
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest = commands.add_parser("ingest", help="add the telemetry recorded since the last ingest")
+    ingest.add_argument("--dir", default=telemetry.TELEMETRY_DIR)
+    for name, help in (("runs", "list the matching runs"), ("boards", "list the boards of the matching runs")):
+        query = commands.add_parser(name, help=help)
+        query.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="only runs with this setting, e.g. dio_mode=3")
+        query.add_argument("--failed", action="append", nargs="?", const="", default=[], metavar="CHECK",
+                           help="only runs in which this check failed, e.g. FlashRead; any check without a name")
+        query.add_argument("--board", help="only runs of this board ID or serial number")
+        query.add_argument("--since", help="only runs started since this date, e.g. 2026-10-01")
+    sql = commands.add_parser("sql", help="run an SQL query on the index")
+    sql.add_argument("query")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+
+    filters = {}
+    if args.command in ("runs", "boards"):
+        try:
+            filters = dict(settings=dict(test.parse_setting(text) for text in args.set), failed=args.failed, board=args.board,
+                           since=datetime.fromisoformat(args.since).timestamp() if args.since else None)
+        except ValueError as e:
+            parser.error(str(e))
+
+    index = results_index(args.db)
+    start = time.perf_counter()
+    when = lambda t: datetime.fromtimestamp(t).isoformat(sep=" ", timespec="seconds") if t is not None else "-"
+    if args.command == "ingest":
+        count = index.ingest(args.dir)
+        print(f"Read {count} telemetry records in {time.perf_counter() - start:.2f} s")
+    elif args.command == "runs":
+        rows = index.runs(**filters)
+        elapsed = time.perf_counter() - start
+        for run_id, log, started, board_id, cycles, failed in rows:
+            print(f"{run_id:>6} {str(log):<16} {when(started)}  {str(board_id):<14} {cycles or 0:>7} cycles  {failed or ''}")
+        print(f"{len(rows)} runs in {elapsed * 1000:.1f} ms")
+    elif args.command == "boards":
+        rows = index.boards(**filters)
+        elapsed = time.perf_counter() - start
+        print(f"{'board':<14} {'serial':<14} {'runs':>6} {'cycles':>8} {'failing':>7}  last run")
+        for board_id, serial_number, runs, cycles, failing, last in rows:
+            print(f"{str(board_id):<14} {str(serial_number or ''):<14} {runs:>6} {cycles or 0:>8} {failing:>7}  {when(last)}")
+        print(f"{len(rows)} boards in {elapsed * 1000:.1f} ms")
+    else:
+        try:
+            cursor = index.db.execute(args.query)
+        except sqlite3.Error as e:
+            parser.error(str(e))
+        if cursor.description: print("\t".join(column[0] for column in cursor.description))
+        for row in cursor: print("\t".join(str(value) for value in row))
+    index.close()
@@ -0,0 +1,259 @@
+import json
+import logging
+import time
+import test
+from test import (DIO_STATUS_ADDR, BRAM_STATUS_ADDR, BRAM_ADDR_BITS, DIO_MODE_IMMUNITY_TOP_TO_BOTTOM, DIO_MODE_IMMUNITY_PORT_PAIRS,
+                  DioStartCommands, DioDefaultPhase, StartBram, BramControlCommand, ReadCommand, transact)
+
+# Characterizes a board's DIO loopback and BRAM test instead of trying settings by hand in the GUI. For every DIO mode and
+# divider it finds the output phases at which every looped back line reads right, and for every number of BRAM passes the
+# largest address range that passes. A sweep measures a coarse grid of points first, which brackets each pass/fail edge
+# between two neighbours, then finds every edge by binary search, so a divider costs a couple of dozen measurements
+# however wide it is. The result is a margin map: the passing window of each divider, the phase in its middle and how far
+# that is from the nearest edge.
+#   python sweep.py COM4                                     DIO at the dividers of the DIO_COUNTERS_* table in main.c
+#   python sweep.py COM4 --dividers 1-255 --bram --save margins.json
+#   python sweep.py --sim --fault dio_delay=2 --fault bram_weak_address=0x1800 --bram
+
+SYS_CLK_HZ = 100_000_000
+DIVIDERS = [1, 3, 7, 9, 19, 49] # the DIO_COUNTERS_* table in main.c
+MODES = [DIO_MODE_IMMUNITY_TOP_TO_BOTTOM, DIO_MODE_IMMUNITY_PORT_PAIRS] # the modes that loop the outputs back to inputs
+COARSE_POINTS = 16 # phases measured per divider before the edges between them are searched
+DIO_DWELL = 0.05 # seconds the DIO runs at each setting, 50000 samples at 1 MHz
+DIO_STATUS_ERRORS = 0x3ffff # bad lines, not running, bad phase/divider combination
+STATUS_ADDR = 0
+STATUS_BRAM_SEED_TREADY = 0x20 # STATUS_ADDR_BRAM_SEED_TREADY_MASK in main.c, set while the BRAM test waits for a seed
+BRAM_MAX_ADDRESS = (1 << BRAM_ADDR_BITS) - 1
+BRAM_MAX_PASSES = 1 << (31 - BRAM_ADDR_BITS)
+BRAM_PASSES = [1, 8000]
+BRAM_POLL_INTERVAL = 0.05
+
+def dio_frequency(divider):
+    return SYS_CLK_HZ / (2 * (divider + 1))
+
+def RegisterCommand(name, addr):
+    # the raw register, where the Check* commands only log what it means
+    return ReadCommand(name, addr, lambda value: value)
+
+def read_registers(port, commands):
+    values = transact(port, commands)
+    for c, value in zip(commands, values):
+        if c.response_size and value is False:
+            raise test.ser.SerialException(f"No response to {c.name}")
+    return values
+
+def find_edges(passes, first, last, step):
+    # passes(value) -> bool over first..last. Measures every step-th value, then binary searches every pair of neighbours
+    # that differ for the two adjacent values where the result changes, and returns those pairs. Two edges closer than
+    # step can both fall between the same neighbours and go unnoticed.
+    coarse = list(range(first, last + 1, step))
+    if coarse[-1] != last: coarse.append(last)
+    for value in coarse: passes(value)
+    edges = []
+    for lo, hi in zip(coarse, coarse[1:]):
+        if passes(lo) == passes(hi): continue
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if passes(mid) == passes(lo): lo = mid
+            else: hi = mid
+        edges.append((lo, hi))
+    return edges
+
+def runs(passing):
+    # (first, last, passed) of every run of equal results
+    result = []
+    for i, p in enumerate(passing):
+        if result and result[-1][2] == p: result[-1][1] = i
+        else: result.append([i, i, p])
+    return [tuple(r) for r in result]
+
+def expand(spans):
+    # the inverse of runs
+    return [p for first, last, p in spans for _ in range(first, last + 1)]
+
+def centre_of(passing):
+    # first and last index of the longest passing run and the index in its middle, or None when nothing passes
+    windows = [(first, last) for first, last, p in runs(passing) if p]
+    if not windows: return None
+    first, last = max(windows, key=lambda w: w[1] - w[0])
+    return first, last, (first + last) // 2
+
+def measure_dio(port, mode, phase, divider, dwell=DIO_DWELL):
+    # DIO status after dwell seconds at the setting. The status is clear-on-read, so the read right after the start
+    # throws away what was counted while the settings changed.
+    read_registers(port, DioStartCommands(mode, phase, divider)[:-1] + [RegisterCommand("DioStatus", DIO_STATUS_ADDR)])
+    time.sleep(dwell)
+    status, = read_registers(port, [RegisterCommand("DioStatus", DIO_STATUS_ADDR)])
+    logging.debug(f"DIO mode {mode}, phase {phase}/{divider}: status {status:05x}")
+    return status
+
+class phase_scan:
+    # The DIO status of every phase measured for one mode and divider. The phases in between take the result of the
+    # measured phase below them: once the edges are searched, a run of unmeasured phases lies between two equal results.
+    def __init__(self, mode, divider):
+        if divider < 1:
+            raise ValueError("The DIO divider must be at least 1, the phase has to be below it")
+        self.mode = mode
+        self.divider = divider
+        self.status = {}
+
+    def passes(self, phase):
+        return self.status[phase] & DIO_STATUS_ERRORS == 0
+
+    def run(self, port, dwell=DIO_DWELL, step=None):
+        def passes(phase):
+            if phase not in self.status: self.status[phase] = measure_dio(port, self.mode, phase, self.divider, dwell)
+            return self.passes(phase)
+        find_edges(passes, 0, self.divider - 1, step or max(1, self.divider // COARSE_POINTS))
+        return self
+
+    def passing(self):
+        result = []
+        for phase in range(self.divider):
+            if phase in self.status: last = self.passes(phase)
+            result.append(last)
+        return result
+
+    def summary(self):
+        passing = self.passing()
+        window = centre_of(passing)
+        default = DioDefaultPhase(self.divider)
+        summary = {
+            "mode":           self.mode,
+            "divider":        self.divider,
+            "frequency":      dio_frequency(self.divider),
+            "status":         {str(phase): status for phase, status in sorted(self.status.items())},
+            "runs":           runs(passing),
+            "window":         None,
+            "phase":          None,
+            "margin":         None,
+            "default_phase":  default,
+            "default_passes": default < self.divider and passing[default],
+        }
+        if window is not None:
+            first, last, phase = window
+            summary.update(window=(first, last), phase=phase, margin=min(phase - first, last - phase))
+        return summary
+
+def bram_seconds(passes, max_address):
+    # a write and a read pass over the range for every pass
+    return passes * 2 * (max_address + 3) / SYS_CLK_HZ
+
+def wait_bram_idle(port, timeout):
+    # lets a BRAM test that is still running, from the test or an earlier sweep, finish; reading its status once it is
+    # done returns it to waiting for a seed. A continuous test is told to stop first.
+    transact(port, [BramControlCommand(False)])
+    deadline = time.monotonic() + timeout
+    while True:
+        status, = read_registers(port, [RegisterCommand("Status", STATUS_ADDR)])
+        if status & STATUS_BRAM_SEED_TREADY: return
+        if time.monotonic() >= deadline:
+            raise TimeoutError("The BRAM test didn't finish")
+        read_registers(port, [RegisterCommand("BramStatus", BRAM_STATUS_ADDR)])
+        time.sleep(BRAM_POLL_INTERVAL)
+
+def measure_bram(port, both_banks, max_address, passes):
+    wait_bram_idle(port, 2 * bram_seconds(BRAM_MAX_PASSES, BRAM_MAX_ADDRESS))
+    StartBram(port, both_banks, max_address, passes - 1)
+    deadline = time.monotonic() + 2 * bram_seconds(passes, max_address) + test.SERIAL_TIMEOUT
+    while True:
+        status, = read_registers(port, [RegisterCommand("BramStatus", BRAM_STATUS_ADDR)])
+        if status & 0x2:
+            logging.debug(f"BRAM {'both banks' if both_banks else 'one bank'}, {passes} passes up to {max_address:#06x}: {'passed' if status & 0x1 else 'failed'}")
+            return bool(status & 0x1)
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"The BRAM test of {passes} passes up to {max_address:#06x} didn't finish")
+        time.sleep(BRAM_POLL_INTERVAL)
+
+def sweep_bram(port, both_banks, passes):
+    # the largest address range that passes, assuming a range passes if any larger one does
+    results = {}
+    def passed(max_address):
+        if max_address not in results: results[max_address] = measure_bram(port, both_banks, max_address, passes)
+        return results[max_address]
+    edges = find_edges(passed, 0, BRAM_MAX_ADDRESS, BRAM_MAX_ADDRESS)
+    largest = BRAM_MAX_ADDRESS if passed(BRAM_MAX_ADDRESS) else edges[0][0] if passed(0) else None
+    return {"both_banks": both_banks, "passes": passes, "max_address": largest,
+            "results": {str(a): p for a, p in sorted(results.items())}}
+
+def print_margin_map(dio, bram):
+    for mode in sorted({s["mode"] for s in dio}):
+        print(f"DIO mode {mode}: passing phases, the one in the middle of the widest window and its margin to the nearest edge")
+        print(f"{'divider':>7} {'MHz':>7} {'measured':>8} {'phase':>5} {'margin':>12} {'default':>8}  runs (phases, # pass . fail)")
+        for s in [s for s in dio if s["mode"] == mode]:
+            margin = f"{s['margin']} ({s['margin'] * 1e9 / SYS_CLK_HZ:.0f} ns)" if s["margin"] is not None else "none"
+            default = f"{s['default_phase']} {'ok' if s['default_passes'] else 'FAIL'}"
+            spans = " ".join(f"{first}-{last}{'#' if p else '.'}" if first != last else f"{first}{'#' if p else '.'}" for first, last, p in s["runs"])
+            print(f"{s['divider']:>7} {s['frequency'] / 1e6:>7.3g} {len(s['status']):>8} {s['phase'] if s['phase'] is not None else '-':>5} {margin:>12} {default:>8}  {spans}")
+    dividers = sorted({s["divider"] for s in dio})
+    if dividers:
+        print("Phases that pass in every mode swept, for the DIO_COUNTERS_* table:")
+    for divider in dividers:
+        scans = [s for s in dio if s["divider"] == divider]
+        passing = [all(phases) for phases in zip(*[expand(s["runs"]) for s in scans])]
+        window = centre_of(passing)
+        name = f"DIO_COUNTERS_{dio_frequency(divider) / 1e6:g}_MHZ".replace(".", "_")
+        print(f"  #define {name:<24} {window[2]}, {divider}" if window is not None else f"  // {name}: no phase passes")
+    for b in bram:
+        largest = f"{b['max_address']:#06x}" if b["max_address"] is not None else "none"
+        print(f"BRAM {'both banks' if b['both_banks'] else 'one bank'}, {b['passes']} passes: largest passing range up to {largest}, {len(b['results'])} runs")
+
+def parse_range(text):
+    # "9" or "1-255"
+    first, _, last = text.partition("-")
+    return list(range(int(first, 0), int(last or first, 0) + 1))
+
+if __name__ == '__main__':
+    import argparse
+    from benchmark import parse_fault
+
+    parser = argparse.ArgumentParser(description="Find the working DIO phases and BRAM ranges of a board and write a margin map")
+    parser.add_argument("port", nargs="?", help="serial port of a board running the test design")
+    parser.add_argument("--modes", type=int, nargs="+", default=MODES, help="DIO modes to sweep")
+    parser.add_argument("--dividers", type=parse_range, nargs="+", help="dividers or ranges of them, e.g. 9 19 40-60")
+    parser.add_argument("--step", type=int, help=f"phases between the coarse measurements, by default 1/{COARSE_POINTS} of the divider")
+    parser.add_argument("--dwell", type=float, default=DIO_DWELL, help="seconds the DIO runs at each phase")
+    parser.add_argument("--bram", action="store_true", help="also find the largest passing BRAM range")
+    parser.add_argument("--bram-passes", type=int, nargs="+", default=BRAM_PASSES)
+    parser.add_argument("--bram-banks", choices=["one", "both", "each"], default="both")
+    parser.add_argument("--save", help="write the margin map and every measurement to this JSON file")
+    parser.add_argument("--sim", action="store_true", help="run against board_sim instead of a board")
+    parser.add_argument("--fault", action="append", default=[], help="inject a board_sim fault, e.g. dio_delay=2")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every measurement")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    dividers = sorted({d for r in args.dividers for d in r}) if args.dividers else DIVIDERS
+    if any(not 1 <= d <= 255 for d in dividers): parser.error("dividers go from 1 to 255")
+    if any(not 1 <= p <= BRAM_MAX_PASSES for p in args.bram_passes): parser.error(f"BRAM passes go from 1 to {BRAM_MAX_PASSES}")
+    if args.sim:
+        from board_sim import board_sim
+        port = board_sim(usb_latency=0.016, timeout=test.SERIAL_TIMEOUT)
+        port.inject(**dict(parse_fault(f) for f in args.fault))
+    elif args.port:
+        port = test.ser.Serial(port=args.port, baudrate=115200, timeout=test.SERIAL_TIMEOUT)
+    else:
+        parser.error("give the serial port of the board, or --sim")
+
+    dio, bram = [], []
+    began = time.perf_counter()
+    try:
+        for mode in args.modes:
+            for divider in dividers:
+                summary = phase_scan(mode, divider).run(port, args.dwell, args.step).summary()
+                logging.info(f"DIO mode {mode}, divider {divider}: {len(summary['status'])} phases measured, window {summary['window']}")
+                dio.append(summary)
+        if args.bram:
+            banks = {"one": [False], "both": [True], "each": [False, True]}[args.bram_banks]
+            for both_banks in banks:
+                for passes in args.bram_passes:
+                    bram.append(sweep_bram(port, both_banks, passes))
+                    logging.info(f"BRAM {'both banks' if both_banks else 'one bank'}, {passes} passes: {len(bram[-1]['results'])} runs, largest passing range {bram[-1]['max_address']}")
+    finally:
+        port.close()
+    seconds = time.perf_counter() - began
+    logging.info(f"Sweep took {seconds:.1f} s, {sum(len(s['status']) for s in dio)} DIO and {sum(len(b['results']) for b in bram)} BRAM measurements")
+    print_margin_map(dio, bram)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"port": args.port or "sim", "seconds": seconds, "dio": dio, "bram": bram}, f, indent=1)
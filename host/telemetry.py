@@ -0,0 +1,274 @@
+import glob
+import json
+import os
+import time
+from datetime import datetime
+import numpy as np
+
+# Binary telemetry of a test run: one fixed-width record per cycle holding every measurement that otherwise only goes into
+# the log text, so long soak runs can be analyzed with NumPy instead of by parsing run_{i}.log.
+#
+# Each file starts with a HEADER_SIZE byte header: the fixed fields of HEADER, then a JSON description of the record dtype
+# and of the run. The records follow as a packed structured array. A file holds at most max_bytes; the recorder then rolls
+# over to the next part, <name>_<part>.tlm. count in the header is only raised after the records it covers are written, so
+# a file cut short by a crash still loads.
+#   python telemetry.py run_0        summary of the run recorded alongside run_0.log
+
+# 2 added bram_passes and bram_fails; load_records fills them in for parts of version 1
+TELEMETRY_VERSION = 2
+TELEMETRY_DIR = os.path.join(os.path.dirname(__file__), "telemetry")
+MAGIC = b"BASYS3TL"
+HEADER_SIZE = 4096
+HEADER = np.dtype([
+    ("magic",       "S8"),
+    ("version",     "<u4"),
+    ("header_size", "<u4"),
+    ("record_size", "<u4"),
+    ("json_size",   "<u4"),
+    ("count",       "<u8"),
+])
+
+# -1 in a *_passed field means the check didn't run or had no verdict that cycle, NaN the same for measurements
+RECORD = np.dtype([
+    ("time",              "<f8"), # seconds since the epoch at the end of the cycle
+    ("cycle",             "<u4"),
+    ("cycle_seconds",     "<f4"),
+    ("timeouts",          "<u2"), # commands that got no response
+    ("echo_passed",       "i1"),
+    ("dio_passed",        "i1"),
+    ("dio_status",        "<u4"),
+    ("bram_passed",       "i1"),
+    ("bram_status",       "<u4"), # the error count, with bram_continuous
+    ("bram_passes",       "<u4"), # counters of a continuous BRAM test
+    ("bram_fails",        "<u4"),
+    ("flash_id_passed",   "i1"),
+    ("flash_id",          "<u4"),
+    ("flash_passed",      "i1"),
+    ("flash_errors",      "<u4"),
+    ("flash_first",       "<u4"),
+    ("flash_last",        "<u4"),
+    ("flash_seconds",     "<f4"),
+    ("mouse_passed",      "i1"),
+    ("mouse_status",      "<u4"),
+    ("temp",              "<f4"),
+    ("vccint",            "<f4"),
+    ("vccaux",            "<f4"),
+    ("vbram",             "<f4"),
+])
+
+def empty_record(dtype=None, shape=()):
+    if dtype is None: dtype = RECORD
+    record = np.zeros(shape, dtype=dtype)
+    for name in dtype.names:
+        if name.endswith("_passed"): record[name] = -1
+        elif dtype[name].kind == 'f': record[name] = np.nan
+    return record
+
+class telemetry_recorder:
+    # Collects the results of the checks of a cycle through add(), and turns them into one record with end_cycle().
+    # Records are buffered and written to the memory-mapped file every buffer_records records or flush_interval seconds.
+    def __init__(self, name, directory=TELEMETRY_DIR, meta={}, max_bytes=64 * 1024 * 1024, buffer_records=64, flush_interval=10.0):
+        self.name = name
+        self.directory = directory
+        self.meta = meta # anything JSON serializable to keep with the run, e.g. the settings and seeds
+        self.capacity = (max_bytes - HEADER_SIZE) // RECORD.itemsize
+        self.buffer = np.zeros(buffer_records, dtype=RECORD)
+        self.buffered = 0
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.cycle = 0
+        self.current = empty_record()
+        self.header = None
+        self.records = None
+        self.count = 0
+        self.parts = [] # (path, records) of every part closed, e.g. for results_index.record_run
+        self.listeners = [] # called with every finished record, on the thread that ends the cycle, e.g. trends.trend_plot.add_record
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_part(self):
+        part = 0
+        while os.path.exists(part_path(self.directory, self.name, part)): part += 1
+        path = part_path(self.directory, self.name, part)
+        description = json.dumps({
+            "version": TELEMETRY_VERSION,
+            "fields":  RECORD.descr,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "part":    part,
+            "meta":    self.meta,
+        }).encode()
+        if HEADER.itemsize + len(description) > HEADER_SIZE:
+            raise ValueError(f"Telemetry metadata too long for the {HEADER_SIZE} byte header")
+        header = np.zeros((), dtype=HEADER)
+        header["magic"] = MAGIC
+        header["version"] = TELEMETRY_VERSION
+        header["header_size"] = HEADER_SIZE
+        header["record_size"] = RECORD.itemsize
+        header["json_size"] = len(description)
+        with open(path, "wb") as f:
+            f.write(header.tobytes() + description)
+            f.truncate(HEADER_SIZE + self.capacity * RECORD.itemsize) # sparse where the file system allows
+        self.header = np.memmap(path, dtype=HEADER, mode="r+", shape=())
+        self.records = np.memmap(path, dtype=RECORD, mode="r+", offset=HEADER_SIZE, shape=(self.capacity,))
+        self.count = 0
+        self.path = path
+
+    def _close_part(self):
+        if self.records is None: return
+        path, count = self.path, self.count
+        self.records.flush()
+        self.header.flush()
+        self.records = self.header = None
+        self.parts.append((path, count))
+        # give back the space that was reserved but never used
+        with open(path, "r+b") as f:
+            f.truncate(HEADER_SIZE + count * RECORD.itemsize)
+
+    def flush(self):
+        start = 0
+        while start < self.buffered:
+            if self.records is None or self.count == self.capacity:
+                self._close_part()
+                self._open_part()
+            n = min(self.buffered - start, self.capacity - self.count)
+            self.records[self.count:self.count + n] = self.buffer[start:start + n]
+            self.records.flush()
+            self.count += n
+            self.header["count"] = self.count
+            self.header.flush()
+            start += n
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+
+    def append(self, record):
+        self.buffer[self.buffered] = record
+        self.buffered += 1
+        if self.buffered == len(self.buffer) or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def add(self, commands, results):
+        # fills in the current record from a batch of commands and the results transact returned for them
+        r = self.current
+        for c, result in zip(commands, results):
+            if c.response_size == 0: continue
+            complete = c.response is not None and len(c.response) == c.response_size
+            if not complete:
+                r["timeouts"] += 1
+            passed = -1 if result is None else int(result is not False)
+            if c.name == "TestEcho":
+                r["echo_passed"] = passed
+            elif c.name == "CheckDio":
+                r["dio_passed"] = passed
+                if complete: r["dio_status"] = int(c.response, 16)
+            elif c.name == "CheckBram":
+                r["bram_passed"] = passed
+                if complete: r["bram_status"] = int(c.response, 16)
+                monitor = getattr(c, "bram_monitor", None)
+                if monitor is not None:
+                    r["bram_passes"] = monitor.passes
+                    r["bram_fails"] = monitor.fails
+            elif c.name == "FlashReadId":
+                r["flash_id_passed"] = passed
+                if complete: r["flash_id"] = int(c.response, 16)
+            elif c.name == "CheckMouse":
+                r["mouse_passed"] = passed
+                if complete: r["mouse_status"] = int(c.response, 16)
+            elif c.name == "FlashRead" and passed >= 0:
+                r["flash_passed"] = passed
+                if complete:
+                    r["flash_errors"] = int(c.response[1:9], 16)
+                    r["flash_first"] = int(c.response[9:17], 16)
+                    r["flash_last"] = int(c.response[17:25], 16)
+                handle = getattr(c, "flash_read", None)
+                if handle is not None and handle.seconds is not None: r["flash_seconds"] = handle.seconds
+            elif c.name == "ReadXadc" and isinstance(result, dict):
+                for name, value in result.items(): r[name] = value
+
+    def end_cycle(self, seconds=np.nan):
+        self.cycle += 1
+        self.current["time"] = time.time()
+        self.current["cycle"] = self.cycle
+        self.current["cycle_seconds"] = seconds
+        self.append(self.current)
+        for listener in self.listeners: listener(self.current)
+        self.current = empty_record()
+
+    def close(self):
+        self.flush()
+        self._close_part()
+
+def part_path(directory, name, part):
+    return os.path.join(directory, f"{name}_{part:03d}.tlm")
+
+def read_header(path):
+    # returns the fixed header fields and the JSON description
+    with open(path, "rb") as f:
+        raw = f.read(HEADER_SIZE)
+    header = np.frombuffer(raw, dtype=HEADER, count=1)[0]
+    if header["magic"] != MAGIC:
+        raise ValueError(f"{path} is not a telemetry file")
+    if header["version"] > TELEMETRY_VERSION:
+        raise ValueError(f"{path} has telemetry version {header['version']}, this loader reads up to {TELEMETRY_VERSION}")
+    description = json.loads(raw[HEADER.itemsize:HEADER.itemsize + int(header["json_size"])])
+    return header, description
+
+def load_part(path):
+    # the records of one file as a read-only memory map, nothing is copied or parsed
+    header, description = read_header(path)
+    dtype = np.dtype([tuple(field) for field in description["fields"]])
+    count = int(header["count"])
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=int(header["header_size"]), shape=(count,))
+
+def load_run(name, directory=TELEMETRY_DIR):
+    # every part of a run, in order, each one a memory map
+    paths = sorted(glob.glob(os.path.join(directory, glob.escape(name) + "_[0-9][0-9][0-9].tlm")))
+    return [load_part(path) for path in paths]
+
+def load_records(name, directory=TELEMETRY_DIR):
+    # a run as one array; the parts are concatenated, which copies them. Parts of a run recorded by different versions
+    # are aligned on the fields of the newest part plus any it dropped, those a part lacks left as in empty_record: -1, NaN or 0.
+    parts = [p for p in load_run(name, directory) if len(p)]
+    if not parts: return np.empty(0, dtype=RECORD)
+    if len(parts) == 1: return parts[0]
+    if all(p.dtype == parts[0].dtype for p in parts): return np.concatenate(parts)
+    fields = {}
+    for p in reversed(parts):
+        for field in p.dtype.names:
+            if fields.setdefault(field, p.dtype[field]) != p.dtype[field]:
+                raise ValueError(f"Telemetry parts of {name} disagree on the type of {field}: {fields[field]} and {p.dtype[field]}")
+    records = empty_record(np.dtype(list(fields.items())), sum(len(p) for p in parts))
+    start = 0
+    for p in parts:
+        for field in p.dtype.names: records[field][start:start + len(p)] = p[field]
+        start += len(p)
+    return records
+
+def summarize(records):
+    cycles = len(records)
+    print(f"{cycles} cycles", end="")
+    if cycles == 0:
+        print()
+        return
+    print(f" from {datetime.fromtimestamp(records['time'][0])} to {datetime.fromtimestamp(records['time'][-1])}")
+    print(f"{'check':<16} {'passed':>8} {'failed':>8}")
+    for name in records.dtype.names:
+        if not name.endswith("_passed"): continue
+        passed = records[name]
+        print(f"{name[:-len('_passed')]:<16} {np.count_nonzero(passed == 1):>8} {np.count_nonzero(passed == 0):>8}")
+    print(f"timeouts: {int(records['timeouts'].sum())}, DIO error bits seen: {hex(np.bitwise_or.reduce(records['dio_status'] & 0xffff))}")
+    if "bram_passes" in records.dtype.names and records["bram_passes"].any():
+        last = records[-1]
+        print(f"BRAM continuous: {last['bram_passes']} passes clean, {last['bram_fails']} failed, {last['bram_status']} words wrong")
+    for name in ("temp", "vccint", "vccaux", "vbram", "flash_seconds", "cycle_seconds"):
+        values = records[name]
+        if np.all(np.isnan(values)): continue
+        print(f"{name:<16} min {np.nanmin(values):8.3f}  mean {np.nanmean(values):8.3f}  max {np.nanmax(values):8.3f}")
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Summarize a recorded test run")
+    parser.add_argument("name", help="run name, e.g. run_0")
+    parser.add_argument("--dir", default=TELEMETRY_DIR)
+    args = parser.parse_args()
+    summarize(load_records(args.name, args.dir))
@@ -1,118 +1,504 @@
 # make sure to log which setups are getting used.
 
 import serial as ser
-import serial.tools.list_ports
 import sys
 import os
 import subprocess
-import numpy as np
+import shutil
+import contextlib
+import json
+import random
+import signal
+import threading
+from collections import deque
 import logging
 from datetime import datetime, timedelta
 import time
+from instrument import latency_stats
+# numpy, serial.tools and lfsr are imported where they are used, so a run from the command line starts quickly. serial
+# (about 9 ms, and every run opens a port) and instrument (bisect and logging only, every test_obj keeps a latency_stats)
+# stay up here. frames and board_sim import this module at their top, so it imports them only inside the functions using them.
 
-def lfsr_next(lfsr):
-    pickbit = lambda x, i: (x >> i) & 0x1
-    return ((lfsr << 1) | (pickbit(lfsr, 31) ^ pickbit(lfsr, 21) ^ pickbit(lfsr, 1) ^ pickbit(lfsr, 0))) & 0xffffffff
+rng = random.Random() # seeds and echo data
+
+QSPI_PATTERN_WORDS = 1024 * 128 # reading a single page burst per loop keeps the read time below a second; 1024*1024 = 32 Mebi-bit flash part
 
 def generate_qspi_simfile(seed):
-    size = 1024 * 128 # reading a single page burst per loop keeps the read time below a second; 1024*1024 = 32 Mebi-bit flash part
-    lfsr = seed
+    size = QSPI_PATTERN_WORDS
+    from lfsr import lfsr_next, cached_pattern
     binfile_name = os.path.join(os.path.dirname(__file__), "random_data.bin")
     logging.info(f"Writing {binfile_name} with random data (seed={hex(seed)}, expecting first word {hex(lfsr_next(seed))})")
-    with open(binfile_name, "wb") as binfile:
-        for _ in range(size):
-            lfsr = lfsr_next(lfsr)
-            binfile.write(np.uint32.tobytes(lfsr))
+    shutil.copyfile(cached_pattern(seed, size), binfile_name)
+
+STOP_POLL_INTERVAL = 0.02 # how often a blocking step that can't wait on the stop event itself checks it
+
+def vivado_command(script, target=None):
+    # target picks the JTAG cable when several boards are attached, see the -tclargs handling in the scripts
+    command = ["vivado", "-mode", "batch", "-source", script]
+    if target is not None: command += ["-tclargs", target]
+    return command
+
+def kill_process_tree(proc):
+    # vivado is a launcher script, so the process that does the work is a child of the one started
+    if sys.platform == "win32":
+        subprocess.call(["taskkill", "/F", "/T", "/PID", str(proc.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(proc.pid, signal.SIGKILL)
+    proc.wait()
 
-def write_qspi_binfile(seed):
+def run_batch(command, stop=None):
+    # Runs a command to completion and returns its exit code. With stop, a threading.Event, the command and everything it
+    # started are killed as soon as stop is set, and None is returned.
+    # the executable is resolved up front, so vivado.bat is found on Windows without going through a shell
+    command = [shutil.which(command[0]) or command[0]] + command[1:]
+    proc = subprocess.Popen(command, start_new_session=sys.platform != "win32")
+    while True:
+        try:
+            return proc.wait(timeout=STOP_POLL_INTERVAL)
+        except subprocess.TimeoutExpired:
+            if stop is not None and stop.is_set():
+                kill_process_tree(proc)
+                logging.info(f"Stopped {os.path.basename(command[0])}, as the test is stopping")
+                return None
+
+def write_qspi_binfile(seed, target=None, vivado=None, stop=None):
+    # vivado is an optional vivado_session.vivado_session to run the programming in, instead of a new batch process.
+    # Setting stop, a threading.Event, aborts the programming.
     generate_qspi_simfile(seed)
     script = os.path.join(os.path.dirname(__file__), "program_qspi.tcl")
-    if 0 == subprocess.call(["vivado", "-mode", "batch", "-source", script], shell=True):
+    if vivado is not None:
+        return bool(vivado.program_cfgmem(os.path.join(os.path.dirname(__file__), "random_data.bin"), target, stop=stop))
+    if 0 == run_batch(vivado_command(script, target), stop):
         return True
     return False
 
-def program_device():
+def program_device(target=None, vivado=None, stop=None):
     script = os.path.join(os.path.dirname(__file__), "program_device.tcl")
     if not os.path.exists(script):
         logging.error(f"Can't find {script}")
         return False
+    if vivado is not None:
+        return bool(vivado.program_bitstream(target, stop=stop))
     logging.info(f"Calling {script}")
-    result = subprocess.call(["vivado", "-mode", "batch", "-source", script], shell=True)
+    result = run_batch(vivado_command(script, target), stop)
+    if result is None:
+        return False
     if result != 0:
         logging.error(f"Couldn't program bitstream into the board")
         return False
     return True
 
+# Seed last written to the QSPI flash of each board, so that a board whose flash still holds it can skip the erase and
+# program cycle (see test_obj.reuse_qspi). Keyed by board_id.
+QSPI_STATE_FILE = os.path.join(os.path.dirname(__file__), "qspi_state.json")
+
+def load_qspi_state(path=None):
+    # the file is looked up on each call, so a simulated run can point QSPI_STATE_FILE elsewhere
+    if path is None: path = QSPI_STATE_FILE
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_qspi_seed(board_id, seed, path=None):
+    # seed=None forgets the board, for while its flash is being rewritten; callers hold the JTAG lock, so boards tested in
+    # parallel never write the file at the same time
+    if path is None: path = QSPI_STATE_FILE
+    state = load_qspi_state(path)
+    if seed is None:
+        state.pop(board_id, None)
+    else:
+        state[board_id] = {"seed": int(seed), "programmed": datetime.now().isoformat(timespec="seconds")}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+SERIAL_TIMEOUT = 0.1 # allowance for the firmware to start answering, the transfer time of each transaction comes on top
+FLASH_READ_TIMEOUT = 5.0 # a blocking 'q' takes about a quarter of a second for 128 KiB
+
+def hexint(n, w):
+    return hex(n)[2:].zfill(w).encode('utf-8')
+
 def sendint(port, n, w):
-    port.write(hex(n)[2:].zfill(w).encode('utf-8'))
+    port.write(hexint(n, w))
 
 def sendchr(port, c):
     port.write(c.encode('utf-8'))
 
+def wire_time(port, size):
+    return size * 10 / getattr(port, "baudrate", 115200)
+
+def read_exactly(port, size, timeout, stop=None):
+    # keeps reading until size bytes are in or timeout has passed, independent of the port's own read timeout. With stop,
+    # a threading.Event, it also gives up once stop is set, within one read timeout of the port.
+    deadline = time.monotonic() + timeout
+    data = bytearray()
+    while len(data) < size:
+        data += port.read(size - len(data))
+        if time.monotonic() >= deadline: break
+        if stop is not None and stop.is_set(): break
+    return bytes(data)
+
+# A command is one request in the firmware's protocol: the bytes to send, the number of bytes the firmware answers with and
+# how to interpret them. Commands from several checks can be sent back to back and answered in one read, see transact.
+class command:
+    def __init__(self, name, request, response_size=0, parse=None, busy=0.0):
+        self.name = name
+        self.request = request
+        self.response_size = response_size
+        self.parse = parse
+        self.busy = busy # seconds the firmware works on the command before it answers, on top of the read timeout
+        self.response = None # raw response, once received
+
+def parse_responses(commands, raw):
+    # splits the responses to a batch of commands and parses each one; returns the results in command order, a check that
+    # got no answer counts as failed
+    results = []
+    offset = 0
+    for c in commands:
+        response = raw[offset:offset + c.response_size]
+        offset += c.response_size
+        c.response = response # kept for the telemetry recorder
+        if len(response) < c.response_size:
+            logging.error(f"No response to {c.name}")
+            results.append(False if c.parse is not None else None)
+        elif c.parse is None:
+            results.append(None)
+        else:
+            try:
+                results.append(c.parse(response))
+            except ValueError:
+                # bytes lost or corrupted on the way, or a reply out of step: the hex doesn't parse
+                logging.error(f"Garbled response to {c.name}: {bytes(response)!r}")
+                results.append(False)
+    return results
+
+def read_responses(port, sent, timeout, latency=None):
+    # reads the responses to a batch in one go, or with latency, an instrument.latency_stats, one command at a time to
+    # record how long each one took
+    expected = sum(c.response_size for c in sent)
+    if latency is None:
+        return read_exactly(port, expected, timeout)
+    deadline = time.monotonic() + timeout
+    raw = bytearray()
+    last = time.perf_counter()
+    for c in sent:
+        if c.response_size == 0: continue
+        response = read_exactly(port, c.response_size, max(0.0, deadline - time.monotonic()))
+        raw += response
+        if len(response) < c.response_size:
+            latency.timeout(c.name) # the rest of the batch is left unanswered
+            break
+        now = time.perf_counter()
+        latency.record(c.name, now - last, now - last - wire_time(port, c.response_size))
+        last = now
+    return bytes(raw)
+
+def transact(port, commands, binary=False, latency=None):
+    # one write for every request and one read for every response. With binary, the commands go out as frames of the
+    # binary protocol (see frames.py), and the results still come back one per command. With latency, an
+    # instrument.latency_stats, the time taken by every command is recorded in it.
+    sent = commands
+    if binary:
+        import frames # imports this module
+        sent = frames.to_binary(commands)
+    request = b''.join(c.request for c in sent)
+    port.write(request)
+    expected = sum(c.response_size for c in sent)
+    raw = read_responses(port, sent, SERIAL_TIMEOUT + sum(c.busy for c in sent) + wire_time(port, len(request) + expected), latency)
+    if len(raw) < expected:
+        logging.error(f"Serial read timed out: received {len(raw)} of {expected} bytes")
+    if binary:
+        return frames.parse_frame_responses(sent, raw)
+    return parse_responses(commands, raw)
+
+def WriteCommand(addr, data, name=None):
+    return command(name or f"write {addr}", b'w' + hexint(addr, 2) + hexint(data, 8))
+
+def ReadCommand(name, addr, parse):
+    return command(name, b'r' + hexint(addr, 2), 8, lambda raw: parse(int(raw, 16)))
+
+def ParseXadc(raw):
+    readings = {}
+
+    temp = round(((int(raw[0:4], 16) // 16) * 503.975) / 4096 - 273.15, 2)
+    logging.info(f"XSM_CH_TEMP:    {temp} degrees C ({raw[0:4]})")
+    readings["temp"] = temp
+
+    temp = round((int(raw[4:8], 16) // 16) / 4096 * 3.0, 2)
+    logging.info(f"XSM_CH_VCCINT:  {temp} V ({raw[4:8]})")
+    readings["vccint"] = temp
+
+    temp = round((int(raw[8:12], 16) // 16) / 4096 * 3.0, 2)
+    logging.info(f"XSM_CH_VCCAUX:  {temp} V ({raw[8:12]})")
+    readings["vccaux"] = temp
+
+    temp = round((int(raw[12:16], 16) // 16) / 4096 * 3.0, 2)
+    logging.info(f"XSM_CH_VBRAM:   {temp} V ({raw[12:16]})")
+    readings["vbram"] = temp
+    return readings
+
+def XadcCommand():
+    return command("ReadXadc", b'x', 16, ParseXadc)
+
 def ReadXadc(port):
-    port.write('x'.encode('utf-8'))
-    
-    raw = port.read(4)
-    temp = round(((int(raw, 16) // 16) * 503.975) / 4096 - 273.15, 2)
-    logging.info(f"XSM_CH_TEMP:    {temp} degrees C ({raw})")
+    return transact(port, [XadcCommand()])[0]
 
-    raw = port.read(4)
-    temp = round((int(raw, 16) // 16) / 4096 * 3.0, 2)
-    logging.info(f"XSM_CH_VCCINT:  {temp} V ({raw})")
-    
-    raw = port.read(4)
-    temp = round((int(raw, 16) // 16) / 4096 * 3.0, 2)
-    logging.info(f"XSM_CH_VCCAUX:  {temp} V ({raw})")
-    
-    raw = port.read(4)
-    temp = round((int(raw, 16) // 16) / 4096 * 3.0, 2)
-    logging.info(f"XSM_CH_VBRAM:   {temp} V ({raw})")
+XADC_BURST_MAX = 1024 # XADC_BURST_MAX in xadc.h
+XADC_SEQUENCE_PERIOD = 4 * 16 * 26 * 32 / 100e6 # channels x averaged conversions x ADCCLK cycles each x DCLK divider, 532 us
+XADC_CHANNELS = ["temp", "vccint", "vccaux", "vbram"]
+XADC_SCALE = [503.975 / 4096, 3.0 / 4096, 3.0 / 4096, 3.0 / 4096] # degrees C or volts per 12-bit code
+XADC_OFFSET = [-273.15, 0.0, 0.0, 0.0]
+
+def DecodeXadcBurst(raw, count):
+    # the readings of a 'b' response as a (count, channels) array of degrees C and volts, None if it fails its CRC
+    import numpy as np
+    import frames # imports this module
+    if frames.crc16(raw[:-2]) != int.from_bytes(raw[-2:], 'little'):
+        return None
+    codes = np.frombuffer(raw, dtype='<u2', count=count * len(XADC_CHANNELS)).reshape(count, len(XADC_CHANNELS)) >> 4
+    return codes * np.array(XADC_SCALE) + np.array(XADC_OFFSET)
+
+def ParseXadcBurst(raw, count, decimation):
+    readings = DecodeXadcBurst(raw, count)
+    if readings is None:
+        logging.error(f"XADC burst of {count} samples failed its CRC")
+        return False
+    lo, hi, mean = readings.min(axis=0), readings.max(axis=0), readings.mean(axis=0)
+    stats = {}
+    for i, name in enumerate(XADC_CHANNELS):
+        stats[name] = {"min": float(lo[i]), "max": float(hi[i]), "mean": float(mean[i]), "ripple": float(hi[i] - lo[i])}
+        logging.info(f"XADC burst {name:<7} mean {mean[i]:.4f}, min {lo[i]:.4f}, max {hi[i]:.4f}, ripple {hi[i] - lo[i]:.4f}")
+    logging.info(f"XADC burst of {count} samples every {XADC_SEQUENCE_PERIOD * decimation * 1e6:.0f} us")
+    return stats
+
+def XadcBurstCommand(count, decimation=1):
+    # count readings of every channel, one every decimation XADC sequences, in one binary response. It is a hex protocol
+    # command in either protocol, as its response is too long for a frame, so it goes in a batch of its own.
+    if not 1 <= count <= XADC_BURST_MAX:
+        raise ValueError(f"An XADC burst takes 1 to {XADC_BURST_MAX} samples")
+    return command("XadcBurst", b'b' + hexint(count, 4) + hexint(decimation, 2), count * 2 * len(XADC_CHANNELS) + 2,
+                   lambda raw: ParseXadcBurst(raw, count, decimation), busy=count * max(decimation, 1) * XADC_SEQUENCE_PERIOD)
+
+ECHO_MAX_SIZE = 255 # the byte count of 'e' is two hex digits
+
+class echo_stats:
+    # Running totals of echo bursts, so a link can be characterized over many of them: payload bytes carried, bytes and
+    # bits that came back wrong, bursts that didn't come back at all or slipped, and at which positions in a burst
+    # mismatches fall.
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.bursts = 0
+        self.lost = 0 # bursts without a complete echo
+        self.slips = 0 # bursts that came back shifted by a lost or extra byte, not counted as bit errors
+        self.bytes = 0 # payload bytes echoed and compared
+        self.mismatches = 0 # bytes that came back different
+        self.bit_errors = 0
+        self.positions = [0] * ECHO_MAX_SIZE # mismatching bytes by position in their burst
+
+    def add(self, sent, echo):
+        # compares one burst, returns the mismatching positions
+        import numpy as np
+        sent = np.frombuffer(sent, dtype=np.uint8)
+        received = np.frombuffer(echo, dtype=np.uint8)
+        diff = np.bitwise_xor(sent, received)
+        wrong = np.flatnonzero(diff)
+        self.bursts += 1
+        if len(wrong) >= 3:
+            # if the data shifted by a byte explains the echo from the first mismatch on, a byte was lost or added
+            first = wrong[0]
+            dropped = np.count_nonzero(received[first:-1] != sent[first + 1:])
+            added = np.count_nonzero(received[first + 1:] != sent[first:-1])
+            if min(dropped, added) <= len(wrong) // 4:
+                self.slips += 1
+                return wrong
+        self.bytes += len(sent)
+        self.mismatches += len(wrong)
+        self.bit_errors += int(np.unpackbits(diff).sum())
+        for i in wrong: self.positions[i] += 1
+        return wrong
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.start
+
+    @property
+    def bytes_per_second(self):
+        # payload bytes per second in each direction
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def bit_error_rate(self):
+        return self.bit_errors / (8 * self.bytes) if self.bytes else float('nan')
+
+    def summary(self):
+        worst = sorted(range(ECHO_MAX_SIZE), key=self.positions.__getitem__, reverse=True)[:8]
+        return {
+            "seconds":          self.seconds,
+            "bursts":           self.bursts,
+            "lost_bursts":      self.lost,
+            "slipped_bursts":   self.slips,
+            "bytes":            self.bytes,
+            "bytes_per_second": self.bytes_per_second,
+            "mismatched_bytes": self.mismatches,
+            "bit_errors":       self.bit_errors,
+            "bit_error_rate":   self.bit_error_rate,
+            "worst_positions":  {int(i): int(self.positions[i]) for i in worst if self.positions[i]},
+        }
+
+    def log(self, title="UART echo"):
+        logging.info(f"{title}: {self.bytes} bytes in {self.bursts} bursts over {self.seconds:.1f} s ({self.bytes_per_second:.0f} B/s), "
+                     f"{self.mismatches} bytes and {self.bit_errors} bits wrong (BER {self.bit_error_rate:.2e}), {self.lost} bursts lost, {self.slips} slipped")
+        if self.mismatches:
+            logging.info(f"{title}: mismatches by position in the burst (position: count) {self.summary()['worst_positions']}")
+
+def EchoCommand(size=100, stats=None, quiet=False):
+    # size random bytes through the 'e' command; with stats, the burst is added to them
+    if not 0 < size <= ECHO_MAX_SIZE:
+        raise ValueError(f"Echo size must be 1 to {ECHO_MAX_SIZE} bytes, not {size}")
+    data = rng.randbytes(size)
+    def parse(echo):
+        wrong = (stats or echo_stats()).add(data, echo)
+        if len(wrong):
+            if not quiet:
+                logging.error(f"Echo test failed: {len(wrong)} of {size} bytes mismatched, first at position {wrong[0]}, "
+                              f"{echo[wrong[0]]} != {data[wrong[0]]}")
+            return False
+        if not quiet: logging.info("Echo test passed")
+        return True
+    return command("TestEcho", b'e' + hexint(size, 2) + data, size, parse)
 
 def TestEcho(port, size=100):
-    sendchr(port, 'e')
-    sendint(port, 100, 2)
-    random_data = np.random.randint(0, 128, size=100).astype(np.uint8)
-    data = (''.join([chr(x) for x in random_data])).encode('utf-8')
-    port.write(data)
-    echo = port.read(100)
-    for i in range(0, 100):
-        if echo[i] != data[i]:
-            logging.error(f"Echo test failed: Mismatch in echoed data at position {i}, {echo[i]} != {data[i]}")
-            break
-    else:
-        logging.info("Echo test passed")
+    return transact(port, [EchoCommand(size)])[0]
 
-def FlashReadId(port):
-    sendchr(port, 'f')
-    id = int(port.read(6), 16)
+def ResyncEcho(port):
+    # A byte lost on the way to the board leaves the firmware waiting inside an echo, so it would take the start of the
+    # next burst as data. Zero bytes complete any echo and are otherwise ignored, then everything that comes back is
+    # thrown away.
+    port.write(bytes(ECHO_MAX_SIZE + 3))
+    time.sleep(SERIAL_TIMEOUT + wire_time(port, 2 * (ECHO_MAX_SIZE + 3)))
+    port.reset_input_buffer()
+
+def EchoStress(port, seconds=10.0, size=ECHO_MAX_SIZE, bursts=4, report_interval=5.0):
+    # Echoes random bursts back to back for seconds, keeping bursts of them in flight: the next one is sent before the
+    # oldest is read back, so the line never waits for the USB round trip. The firmware echoes a burst as it arrives,
+    # so this runs at the full rate of the link without filling the receive FIFO. Always the hex 'e' command: an echo
+    # frame that took a bit error would fail its CRC and be thrown away instead of counted.
+    stats = echo_stats()
+    pending = deque()
+    end = stats.start + seconds
+    next_report = stats.start + report_interval
+    while True:
+        now = time.perf_counter()
+        while now < end and len(pending) < bursts:
+            c = EchoCommand(size, stats, quiet=True)
+            port.write(c.request)
+            pending.append(c)
+        if not pending: break
+        c = pending.popleft()
+        raw = read_exactly(port, c.response_size, SERIAL_TIMEOUT + wire_time(port, (len(pending) + 1) * (c.response_size + len(c.request))))
+        slips = stats.slips
+        parse_responses([c], raw)
+        if len(raw) < c.response_size or stats.slips > slips:
+            # bytes were lost, so what is still on its way can't be matched up with its bursts any more
+            stats.lost += len(pending) + (len(raw) < c.response_size)
+            pending.clear()
+            ResyncEcho(port)
+        if now >= next_report:
+            stats.log("UART stress")
+            next_report = now + report_interval
+    stats.log("UART stress")
+    return stats
+
+def ParseFlashId(raw):
+    id = int(raw, 16)
     if id != 0x1620c2:
         logging.error(f"Flash read ID failed: Unexpected flash ID of {hex(id)}")
-    else:
-        logging.info(f"Flash read ID succeeded: Macronix flash ID ({hex(id)}) detected")
+        return False
+    logging.info(f"Flash read ID succeeded: Macronix flash ID ({hex(id)}) detected")
+    return True
 
-def FlashRead(port, seed):
-    sendchr(port, 'q')
-    sendint(port, seed, 8)
+def FlashIdCommand():
+    return command("FlashReadId", b'f', 6, ParseFlashId)
 
-    time.sleep(0.2)
-    
+def FlashReadId(port):
+    return transact(port, [FlashIdCommand()])[0]
+
+FLASH_VERIFY_PASSED = 0
+FLASH_VERIFY_FAILED = 1
+FLASH_VERIFY_BUSY = 2
+FLASH_VERIFY_IDLE = 3
+
+def ParseFlashResult(raw):
+    read_passes = int(raw[0:1], 16) # '0' is a pass
+    error_count = int(raw[1:9], 16)
+    first = int(raw[9:17], 16)
+    last  = int(raw[17:25], 16)
+    if read_passes != 0:
+        logging.error(f"Flash read failed: Contents did not match expectation, error_count={error_count}, first={hex(first).zfill(8)}, last={hex(last).zfill(8)}")
+        return False
+    logging.info(f"Flash read passed, first value seen: {hex(first).zfill(8)}, last: {hex(last).zfill(8)}")
+    return True
+
+def FlashRead(port, seed, stop=None):
+    # blocking verification through 'q', done as soon as the result comes in, or None once stop is set
     starttime = datetime.now()
-    done = False
-    while not done:
-        read_passes = port.read(1)
-        if read_passes != b'':
-            done = True
-    read_passes = int(read_passes, 16) # '0' is a pass
+    port.write(b'q' + hexint(seed, 8))
+    raw = read_exactly(port, 25, FLASH_READ_TIMEOUT, stop)
+    if stop is not None and stop.is_set():
+        return None
+    if len(raw) < 25:
+        logging.error(f"Flash read failed: No result after {FLASH_READ_TIMEOUT} seconds")
+        return False
     timepassed = (datetime.now() - starttime).total_seconds()
     logging.info(f"Flash read completed after {timepassed} seconds")
-    
-    error_count = int(port.read(8), 16)
-    first = int(port.read(8), 16)
-    last  = int(port.read(8), 16)
-    if read_passes != 0:
-        logging.error(f"Flash read failed: Contents did not match expectation, error_count={error_count}, first={hex(first).zfill(8)}, last={hex(last).zfill(8)}")
-    else:
-        logging.info(f"Flash read passed, first value seen: {hex(first).zfill(8)}, last: {hex(last).zfill(8)}")
+    return ParseFlashResult(raw)
+
+def FlashVerifyCommand(seed):
+    # the blocking 'q' as a command, for batches sent with a timeout of FLASH_READ_TIMEOUT
+    return command("FlashRead", b'q' + hexint(seed, 8), 25, ParseFlashResult)
+
+# Handle on a flash verification running in the background on the board ('v'). The firmware keeps answering other commands
+# in the meantime; the result is collected by sending poll_command in the same or any later batch, until done is set.
+class flash_read:
+    def __init__(self, seed):
+        self.seed = seed
+        self.starttime = datetime.now()
+        self.done = False
+        self.passed = None
+        self.seconds = None
+    def start_command(self):
+        # ignored by the firmware while a previous verification is still running
+        return command("FlashRead", b'v' + hexint(self.seed, 8))
+    def poll_command(self):
+        poll = command("FlashRead", b'p', 25, self.parse)
+        poll.flash_read = self # lets the telemetry recorder pick up the completion time
+        return poll
+    def parse(self, raw):
+        state = int(raw[0:1], 16)
+        if state == FLASH_VERIFY_BUSY:
+            return None
+        self.done = True
+        if state == FLASH_VERIFY_IDLE:
+            logging.error(f"Flash read failed: No flash read was running on the board")
+            self.passed = False
+            return False
+        timepassed = (datetime.now() - self.starttime).total_seconds()
+        logging.info(f"Flash read completed after {timepassed} seconds")
+        self.seconds = timepassed
+        self.passed = ParseFlashResult(raw)
+        return self.passed
+    def poll(self, port):
+        transact(port, [self.poll_command()])
+        return self.done
+
+def FlashReadStart(port, seed):
+    handle = flash_read(seed)
+    transact(port, [handle.start_command()])
+    return handle
     
 DIO_SETTINGS_ADDR = 12
 DIO_STATUS_ADDR = 16
@@ -122,8 +508,17 @@ BRAM_ADDR_MAX_ADDR = 28
 BRAM_STATUS_ADDR = 32
 DIO_COUNTER_MAX_ADDR = 36
 DIO_OUTPUT_PHASE_ADDR = 40
+BRAM_CONTROL_ADDR = 44
+BRAM_PASS_COUNT_ADDR = 48
+BRAM_FAIL_COUNT_ADDR = 52
+BRAM_ERROR_COUNT_ADDR = 56
+BRAM_FIRST_FAIL_ADDR = 60
 BRAM_ADDR_BITS = 13
 
+BRAM_CONTINUOUS = 0x1
+BRAM_CLEAR_COUNTERS = 0x2
+BRAM_FIRST_FAIL_VALID = 0x80000000
+
 DIO_MODE_OFF = 0
 DIO_MODE_IMMUNITY_TOP_TO_BOTTOM = 1
 DIO_MODE_IMMUNITY_PORT_PAIRS = 2
@@ -134,46 +529,49 @@ DIO_MODE_EMISSIONS = 3
 def testbit(n, b):
     return ((n >> b) & 0x1) == 1
 
-def CheckDio(port):
-    sendchr(port, 'r')
-    sendint(port, DIO_STATUS_ADDR, 2)
-    status = int(port.read(8), 16)
-
+def ParseDioStatus(status):
+    passed = True
     if (status & 0x10000) != 0:
         logging.error(f"DIO not running")
+        passed = False
     else:
         logging.info(f"DIO counters are running")
     
     if (status & 0x20000) != 0:
         logging.error(f"Invalid DIO phase/divider configuration - check setup")
+        passed = False
     
     if (status & 0xffff) != 0:
         logging.error(f"Invalid DIO bits detected ({hex(status & 0xffff)[2:].zfill(4)}) since the last read")
+        passed = False
     else:
         logging.info(f"All DIO samples match")
+    return passed
 
-def StartDio(port, mode, phase, divider):
-    logging.info(f"Starting DIO with settings: mode:{mode}, phase:{phase}, divider:{divider}")
-
-    sendchr(port, 'w')
-    sendint(port, DIO_COUNTER_MAX_ADDR, 2)
-    sendint(port, divider, 8)
+def DioCheckCommand():
+    return ReadCommand("CheckDio", DIO_STATUS_ADDR, ParseDioStatus)
 
-    sendchr(port, 'w')
-    sendint(port, DIO_OUTPUT_PHASE_ADDR, 2)
-    sendint(port, phase, 8)
+def CheckDio(port):
+    return transact(port, [DioCheckCommand()])[0]
 
-    sendchr(port, 'w')
-    sendint(port, DIO_SETTINGS_ADDR, 2)
-    sendint(port, mode & 0x3, 8)
+def DioStartCommands(mode, phase, divider):
+    return [
+        WriteCommand(DIO_COUNTER_MAX_ADDR, divider, "StartDio"),
+        WriteCommand(DIO_OUTPUT_PHASE_ADDR, phase, "StartDio"),
+        WriteCommand(DIO_SETTINGS_ADDR, mode & 0x3, "StartDio"),
+        DioCheckCommand()
+    ]
 
-    CheckDio(port)
+def DioDefaultPhase(divider):
+    # output phase halfway through the divider's period, clear of the loopback's delay on any cable that works at all;
+    # sweep.py finds the phases that actually pass on a board
+    return ((divider + 1) // 2) - 1
 
-def CheckMouse(port):
-    sendchr(port, 'r')
-    sendint(port, PS2_POS_ADDR, 2)
-    status = int(port.read(8), 16)
+def StartDio(port, mode, phase, divider):
+    logging.info(f"Starting DIO with settings: mode:{mode}, phase:{phase}, divider:{divider}")
+    return transact(port, DioStartCommands(mode, phase, divider))[-1]
 
+def ParseMouseStatus(status):
     if not testbit(status, 26):
         logging.error("Mouse data is stale")
         return False
@@ -189,25 +587,30 @@ def CheckMouse(port):
     logging.info(f"Mouse position: Y={(status>>12) & 0xfff}; X={(status & 0xfff)}")
     return True
 
-def StartBram(port, bram_both_banks, bram_max_address, bram_repeats=9):
-    seed = np.random.randint(0, 2**32, dtype=np.uint32)
-    
-    sendchr(port, 'w')
-    sendint(port, BRAM_ADDR_MAX_ADDR, 2)
+def MouseCheckCommand():
+    return ReadCommand("CheckMouse", PS2_POS_ADDR, ParseMouseStatus)
+
+def CheckMouse(port):
+    return transact(port, [MouseCheckCommand()])[0]
+
+def BramStartCommands(bram_both_banks, bram_max_address, bram_repeats=9):
+    seed = rng.getrandbits(32)
     bram_repeats &= (1 << (31 - BRAM_ADDR_BITS)) - 1
     bram_both_banks &= 1
     bram_max_address &= (1 << BRAM_ADDR_BITS) - 1
-    sendint(port, (bram_both_banks << 31) | (bram_repeats << BRAM_ADDR_BITS) | bram_max_address, 8)
+    return [
+        WriteCommand(BRAM_ADDR_MAX_ADDR, (bram_both_banks << 31) | (bram_repeats << BRAM_ADDR_BITS) | bram_max_address, "StartBram"),
+        WriteCommand(BRAM_SEED_ADDR, seed, "StartBram")
+    ]
 
-    sendchr(port, 'w')
-    sendint(port, BRAM_SEED_ADDR, 2)
-    sendint(port, seed, 8)
+def BramControlCommand(continuous, clear_counters=False):
+    return WriteCommand(BRAM_CONTROL_ADDR, (BRAM_CONTINUOUS if continuous else 0) | (BRAM_CLEAR_COUNTERS if clear_counters else 0), "StartBram")
 
-def CheckBram(port):
-    sendchr(port, 'r')
-    sendint(port, BRAM_STATUS_ADDR, 2)
-    status = int(port.read(8), 16)
+def StartBram(port, bram_both_banks, bram_max_address, bram_repeats=9, continuous=False):
+    # also stops a continuous test left running, which then ends with the pass under way, and clears the counters
+    transact(port, [BramControlCommand(continuous, True)] + BramStartCommands(bram_both_banks, bram_max_address, bram_repeats))
 
+def ParseBramStatus(status):
     if testbit(status, 1):
         if testbit(status, 0):
             logging.info("BRAM test passed")
@@ -218,42 +621,182 @@ def CheckBram(port):
     logging.error("BRAM test not complete")
     return False
 
+def BramCheckCommand():
+    return ReadCommand("CheckBram", BRAM_STATUS_ADDR, ParseBramStatus)
+
+def CheckBram(port):
+    return transact(port, [BramCheckCommand()])[0]
+
+class bram_monitor:
+    # Follows a continuous BRAM test through its counters, which run from when StartBram cleared them. Every check reads
+    # them all and reports what changed since the one before; it fails if any word read back wrong in between.
+    def __init__(self):
+        self.passes = 0
+        self.fails = 0
+        self.errors = 0
+        self.first_fail = 0
+        self.latest = {}
+    def commands(self):
+        # the error count goes last, so the verdict is made once the other counters read with it are in
+        self.latest = {}
+        check = ReadCommand("CheckBram", BRAM_ERROR_COUNT_ADDR, self.parse)
+        check.bram_monitor = self # lets the telemetry recorder pick up the counters
+        return [
+            ReadCommand("BramPasses", BRAM_PASS_COUNT_ADDR, self.store("passes")),
+            ReadCommand("BramFails", BRAM_FAIL_COUNT_ADDR, self.store("fails")),
+            ReadCommand("BramFirstFail", BRAM_FIRST_FAIL_ADDR, self.store("first_fail")),
+            check,
+        ]
+    def store(self, name):
+        def parse(value):
+            self.latest[name] = value
+        return parse
+    def parse(self, errors):
+        new_errors = (errors - self.errors) & 0xffffffff
+        self.errors = errors
+        if "passes" in self.latest and "fails" in self.latest:
+            passes, fails = self.latest["passes"], self.latest["fails"]
+            logging.info(f"BRAM continuous: {(passes - self.passes) & 0xffffffff} passes clean and {(fails - self.fails) & 0xffffffff} failed since the last check, {passes} and {fails} in all")
+            self.passes, self.fails = passes, fails
+        first_fail = self.latest.get("first_fail", 0)
+        if first_fail & BRAM_FIRST_FAIL_VALID and not self.first_fail & BRAM_FIRST_FAIL_VALID:
+            self.first_fail = first_fail
+            banks = " and ".join(f"bank {b}" for b in (0, 1) if testbit(first_fail, 29 + b))
+            logging.error(f"BRAM first failure: address {first_fail & ((1 << BRAM_ADDR_BITS) - 1):#06x} in {banks}, pass {(first_fail >> BRAM_ADDR_BITS) & 0xffff}")
+        if new_errors:
+            logging.error(f"BRAM continuous: {new_errors} words read back wrong since the last check, {errors} in all")
+            return False
+        logging.info("BRAM test passed")
+        return True
+
+# USB IDs of the FT2232 on the Basys 3, which provides both the JTAG cable and the UART
+BOARD_USB_VID = 0x0403
+BOARD_USB_PID = 0x6010
+
+class board_port:
+    def __init__(self, device, serial_number):
+        self.device = device
+        self.serial_number = serial_number
+    @property
+    def jtag_target(self):
+        # Vivado names the cable after the FTDI serial with the channel letter appended (Digilent/210183A8A7B5A), and
+        # Windows reports the UART's serial with its own channel letter, so only the 12 character serial is matched
+        if not self.serial_number: return None
+        return self.serial_number[:12]
+    def __repr__(self):
+        return f"{self.device} ({self.serial_number})"
+
 def get_portlist():
-    print ([port.device for port in serial.tools.list_ports.comports()])
+    import serial.tools.list_ports
+    boards = [board_port(port.device, port.serial_number) for port in serial.tools.list_ports.comports()
+              if port.vid == BOARD_USB_VID and port.pid == BOARD_USB_PID]
+    logging.debug("boards found: %s", boards)
+    return boards
+
+# settings of a run, as the GUI starts out with them; every entry can be overridden, and setup_test fills in those left out
+DEFAULT_SETTINGS = {
+    "enable_xadc":          True,
+    "enable_xadc_burst":    False,
+    "enable_flash_id":      True,
+    "enable_flash_verify":  True,
+    "enable_uart_echo":     True,
+    "enable_dio_test":      True,
+    "enable_mouse":         True,
+    "enable_bram_test":     True,
+    "dio_divider":          49,
+    "dio_mode":             DIO_MODE_IMMUNITY_TOP_TO_BOTTOM,
+    "bram_both_banks":      True,
+    "bram_max_address":     0x1fff,
+    "bram_passes":          2000, # 0.33 s over the whole address range, done well within a cycle
+    "bram_continuous":      False,
+    "uart_echo_size":       100,
+    "xadc_burst_samples":   256,
+    "xadc_burst_decimation": 1,
+    "reuse_qspi":           False,
+    "binary_protocol":      True,
+}
+
+def setting_value(settings, name):
+    # the value of a plain setting or of a Tk variable, the default if it isn't given
+    value = settings[name] if name in settings else DEFAULT_SETTINGS[name]
+    return value.get() if hasattr(value, "get") else value
+
+LINK_LOSS_CYCLES = 2 # cycles without a single response before the link counts as lost
+RECONNECT_BACKOFF = [0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0] # wait after each failed reconnect attempt, the last one repeating
+PROBE_ATTEMPTS = 3 # reconnects to a port that opens but gets no answer, before the bitstream is programmed again
+RECONNECT_GIVE_UP = 300.0 # seconds without a link after which run_cycles gives up on the board
+
+# shared by the boards tested in one process, e.g. from one event loop; farm.py gives its processes one of its own
+JTAG_LOCK = threading.Lock()
 
 class test_obj:
     def __init__(self):
         self.port = None
+        self.port_factory = ser.Serial # anything accepting serial.Serial's arguments, e.g. board_sim.board_sim.connect
+        self.cycle_period = 1.0
+        self.jtag_target = None # cable to program through, None for the only one attached
+        self.jtag_lock = JTAG_LOCK # held around every Vivado call, only one JTAG session can run at a time
+        self.vivado = None # a vivado_session to program through, None for a batch process per step
+        self.telemetry = None # a telemetry.telemetry_recorder to record every cycle's measurements into
+        self.protocol = "hex" # "binary" once the board has answered a hello frame, see frames.py
+        self.stop_event = None # a threading.Event that stops run_test at its next cancellation point, e.g. daemon_handler.stop_event
+
+    @property
+    def stopped(self):
+        return self.stop_event is not None and self.stop_event.is_set()
+
+    def wait(self, seconds):
+        # time.sleep that ends early when the test is stopped; returns True then
+        if self.stop_event is None:
+            time.sleep(seconds)
+            return False
+        return self.stop_event.wait(seconds)
+
     def setup_test(self, settings):
-        self.dio_mode = settings["dio_mode"].get()
+        # settings holds Tk variables in the GUI and plain values everywhere else; anything missing takes its default
+        value = lambda name: setting_value(settings, name)
         self.com_port = settings["com_port"]
-        self.dio_divider = settings["dio_divider"].get()
-        self.dio_mode = settings["dio_mode"].get()
-        self.enable_xadc = settings["enable_xadc"].get()
-        self.enable_flash_id = settings["enable_flash_id"].get()
-        self.enable_flash_verify = settings["enable_flash_verify"].get()
-        self.enable_uart_echo = settings["enable_uart_echo"].get()
-        self.enable_dio_test = settings["enable_dio_test"].get()
-        self.enable_mouse = settings["enable_mouse"].get()
-        self.enable_bram_test = settings["enable_bram_test"].get()
-        self.bram_repeats = settings["bram_passes"].get() - 1
-        self.bram_both_banks = settings["bram_both_banks"].get()
-        self.bram_max_address = settings["bram_max_address"].get()
+        self.dio_divider = value("dio_divider")
+        self.dio_mode = value("dio_mode")
+        self.enable_xadc = value("enable_xadc")
+        self.enable_xadc_burst = value("enable_xadc_burst")
+        self.xadc_burst_samples = value("xadc_burst_samples")
+        self.xadc_burst_decimation = value("xadc_burst_decimation")
+        self.enable_flash_id = value("enable_flash_id")
+        self.enable_flash_verify = value("enable_flash_verify")
+        self.enable_uart_echo = value("enable_uart_echo")
+        self.enable_dio_test = value("enable_dio_test")
+        self.enable_mouse = value("enable_mouse")
+        self.enable_bram_test = value("enable_bram_test")
+        self.bram_repeats = value("bram_passes") - 1
+        self.bram_both_banks = value("bram_both_banks")
+        self.bram_max_address = value("bram_max_address")
+        self.bram_continuous = value("bram_continuous")
+        self.reuse_qspi = value("reuse_qspi")
+        self.binary_protocol = value("binary_protocol")
+        self.uart_echo_size = value("uart_echo_size")
         
         logging.info("Starting Test")
-        logging.info(f'Setting enable_xadc:         {settings["enable_xadc"].get()}')
-        logging.info(f'Setting enable_flash_id:     {settings["enable_flash_id"].get()}')
-        logging.info(f'Setting enable_flash_verify: {settings["enable_flash_verify"].get()}')
-        logging.info(f'Setting enable_uart_echo:    {settings["enable_uart_echo"].get()}')
-        logging.info(f'Setting enable_dio_test:     {settings["enable_dio_test"].get()}')
-        logging.info(f'Setting enable_mouse:        {settings["enable_mouse"].get()}')
-        logging.info(f'Setting enable_bram_test:    {settings["enable_bram_test"].get()}')
-        logging.info(f'Setting bram_both_banks:     {settings["bram_both_banks"].get()}')
-        logging.info(f'Setting bram_max_address:    {settings["bram_max_address"].get()}')
-        logging.info(f'Setting bram_passes:        {settings["bram_passes"].get()}')
-        logging.info(f'Setting dio_mode:            {settings["dio_mode"].get()}')
-        logging.info(f'Setting dio_divider:         {settings["dio_divider"].get()}')
-        logging.info(f'Setting com_port:            {settings["com_port"]}')
+        logging.info(f'Setting enable_xadc:         {self.enable_xadc}')
+        logging.info(f'Setting enable_xadc_burst:   {self.enable_xadc_burst}')
+        logging.info(f'Setting enable_flash_id:     {self.enable_flash_id}')
+        logging.info(f'Setting enable_flash_verify: {self.enable_flash_verify}')
+        logging.info(f'Setting enable_uart_echo:    {self.enable_uart_echo}')
+        logging.info(f'Setting enable_dio_test:     {self.enable_dio_test}')
+        logging.info(f'Setting enable_mouse:        {self.enable_mouse}')
+        logging.info(f'Setting enable_bram_test:    {self.enable_bram_test}')
+        logging.info(f'Setting bram_both_banks:     {self.bram_both_banks}')
+        logging.info(f'Setting bram_max_address:    {self.bram_max_address}')
+        logging.info(f'Setting bram_passes:        {self.bram_repeats + 1}')
+        logging.info(f'Setting bram_continuous:     {self.bram_continuous}')
+        logging.info(f'Setting dio_mode:            {self.dio_mode}')
+        logging.info(f'Setting dio_divider:         {self.dio_divider}')
+        logging.info(f'Setting reuse_qspi:          {self.reuse_qspi}')
+        logging.info(f'Setting binary_protocol:     {self.binary_protocol}')
+        logging.info(f'Setting uart_echo_size:      {self.uart_echo_size}')
+        logging.info(f'Setting xadc_burst_samples:  {self.xadc_burst_samples}')
+        logging.info(f'Setting xadc_burst_decimation: {self.xadc_burst_decimation}')
+        logging.info(f'Setting com_port:            {self.com_port}')
     
         if self.dio_mode == DIO_MODE_IMMUNITY_TOP_TO_BOTTOM or self.dio_mode == DIO_MODE_IMMUNITY_PORT_PAIRS:
             logging.info("Starting IMMUNITY test sequence")
@@ -262,24 +805,111 @@ class test_obj:
         else:
             logging.info("Starting test sequence with DIO off")
 
-        self.qspi_seed = np.random.randint(0, 2**32, dtype=np.uint32)
+        self.started = time.time() # for the results index
+        self.qspi_seed = rng.getrandbits(32)
+        self.flash_read = None
+        self.bram_monitor = None # of the continuous BRAM test, from when configure starts it
+        self.bram_started = False # whether a one-shot BRAM test was started since configure, to be checked
+        self.check_qspi = False # set when the flash content is to be checked instead of written
+        self.init_sequence = 0
+        self.protocol = "hex"
+        self.echo_stats = echo_stats() # every echo of the run, for the link's bit error rate
+        self.latency = latency_stats() # of every command, and of the transfers and host time of every cycle
+        self.iteration = 0 # test cycles completed, carried on across reconnects
+        self.link_down_since = None # perf_counter time the link was lost at, while reconnecting
+        self.silent_cycles = 0
+        self.reconnects = 0
+        self.tally = {} # check name: [passed, failed]
+
+    def record(self, commands, results):
+        for c, result in zip(commands, results):
+            if result is None: continue # writes, and checks without a verdict yet
+            counts = self.tally.setdefault(c.name, [0, 0])
+            counts[0 if result is not False else 1] += 1
+
+    @property
+    def board_id(self):
+        return self.jtag_target or self.com_port
+
+    def defer_qspi_write(self):
+        # With reuse_qspi, a board with a recorded seed gets its flash checked against it instead of written. The flash
+        # can only be read once the bitstream is loaded, so the check is left to the connect step.
+        stored = load_qspi_state().get(self.board_id)
+        if not self.reuse_qspi or stored is None:
+            return False
+        self.qspi_seed = int(stored["seed"])
+        self.check_qspi = True
+        logging.info(f"QSPI of {self.board_id} was last written with seed {hex(self.qspi_seed)} on {stored['programmed']}, checking it before writing")
+        return True
+
+    def qspi_checked(self, passed):
+        # outcome of the deferred check; on a mismatch the test goes back to writing the flash with a fresh seed
+        self.check_qspi = False
+        if passed:
+            logging.info(f"QSPI still holds seed {hex(self.qspi_seed)}, skipping the QSPI write")
+            return
+        logging.info(f"QSPI doesn't hold seed {hex(self.qspi_seed)}, writing it with a new one")
+        self.reuse_qspi = False
+        self.qspi_seed = rng.getrandbits(32)
         self.init_sequence = 0
 
     def write_qspi(self):
         if self.enable_flash_verify:
-            logging.info(f"Writing QSPI...")
-            if not write_qspi_binfile(self.qspi_seed):
+            if self.defer_qspi_write():
                 return
+            logging.info(f"Writing QSPI...")
+            with self.jtag_lock:
+                save_qspi_seed(self.board_id, None)
+                if not write_qspi_binfile(self.qspi_seed, self.jtag_target, self.vivado, self.stop_event):
+                    return
+                save_qspi_seed(self.board_id, self.qspi_seed)
         else:
             logging.info(f"Skipping QSPI write, Flash read test is not enabled")
 
     def program_device(self):
         logging.info(f"Writing FPGA image...")
-        if not program_device():
-            return
+        with self.jtag_lock:
+            if not program_device(self.jtag_target, self.vivado, self.stop_event):
+                return
         
+    def cycle_commands(self):
+        # Every check of a steady-state cycle, sent as one pipelined batch. The UART Lite only buffers 16 bytes in each
+        # direction, so bytes the firmware has not read yet pile up whenever it is busy or waiting to send: commands that
+        # answer with more than they are sent (register reads, flash ID) are followed by register writes to let it catch up,
+        # and the XADC read, which waits for the end of an XADC sequence, goes last so nothing arrives while it waits.
+        # The BRAM test started by the previous cycle is checked before the next one is started, and the flash verification
+        # runs on the board between batches, each batch collecting the result of the one started before. A continuous BRAM
+        # test runs on its own and only has its counters read: in the hex protocol where the one-shot test is checked, in
+        # the binary protocol as a burst just before the XADC read, whose wait lets the longer reply go out.
+        # In the binary protocol every frame is acknowledged and replies are compact, so the mouse read joins the other
+        # register reads in a single burst.
+        binary = self.protocol == "binary"
+        commands = []
+        if self.enable_uart_echo:    commands.append(EchoCommand(self.uart_echo_size, self.echo_stats))
+        if self.enable_dio_test:     commands.append(DioCheckCommand())
+        one_shot_bram = self.enable_bram_test and not self.bram_continuous
+        continuous_bram = self.enable_bram_test and self.bram_continuous
+        if one_shot_bram and self.bram_started: commands.append(BramCheckCommand())
+        if continuous_bram and not binary: commands += self.bram_monitor.commands()
+        if self.enable_mouse and binary: commands.append(MouseCheckCommand())
+        if one_shot_bram:
+            commands += BramStartCommands(self.bram_both_banks, self.bram_max_address, self.bram_repeats)
+            self.bram_started = True
+        if self.enable_flash_verify and self.flash_read is not None:
+            commands.append(self.flash_read.poll_command())
+        if self.enable_flash_id:     commands.append(FlashIdCommand())
+        if self.enable_mouse and not binary: commands.append(MouseCheckCommand())
+        if continuous_bram and binary: commands += self.bram_monitor.commands()
+        if self.enable_xadc:         commands.append(XadcCommand())
+        if self.enable_flash_verify:
+            # (re)start the background flash verification; it only takes if the previous one has finished by now
+            self.next_flash_read = flash_read(self.qspi_seed)
+            commands.append(self.next_flash_read.start_command())
+        return commands
+
     def run_test(self):
-        # implemented as a state machine so that the loop controller can check for a stop button press between long blocking calls
+        # implemented as a state machine so that the loop controller can check for a stop button press between long blocking calls.
+        # The blocking calls themselves end early once stop_event is set, so a stop takes effect within a serial read timeout.
         if self.init_sequence == 0:
             self.write_qspi()
             self.init_sequence += 1
@@ -290,68 +920,278 @@ class test_obj:
             return
         if self.init_sequence == 2:
             logging.info(f"Connecting to board on port {self.com_port}")
-            # note: a much shorter timeout can't be used as long as the flash read cycle stays fully blocking
-            try: 
-                self.port = ser.Serial(port=self.com_port, baudrate=115200, timeout=0.4)
-            except ser.SerialException():
-                logging.error(f"Failed to connect to {self.com_port}")
+            if not self.open_port():
                 return
-            self.phase = ((self.dio_divider + 1) // 2) - 1
-            StartDio(self.port, self.dio_mode, self.phase, self.dio_divider)
-            logging.info(f"DIO counter output frequency is set to {100_000_000 / (2 * (self.dio_divider + 1))} MHz")
-            logging.info(f"DIO readback phase count is set to {self.phase} / {self.dio_divider}")
-            # ConfigureBram(self.port, self.bram_bank_1_en, self.bram_max_addr)
-            # logging.info(f"DIO counter output frequency is set to {100_000_000 / (2 * (self.dio_divider + 1))} MHz")
-            # logging.info(f"DIO readback phase count is set to {self.phase} / {self.dio_divider}")
+            if self.check_qspi:
+                passed = FlashRead(self.port, self.qspi_seed, self.stop_event)
+                if self.stopped: return
+                self.qspi_checked(passed)
+                if self.init_sequence == 0:
+                    self.stop_test()
+                    return
+            self.configure()
             self.init_sequence += 1
-            self.iteration = 0
             return
         if self.init_sequence >= 3:
-            targettime = datetime.now() + timedelta(seconds=1)
+            if self.link_down_since is not None:
+                self.reconnect()
+                return
+            targettime = datetime.now() + timedelta(seconds=self.cycle_period)
+            start = time.perf_counter()
             
-            if self.enable_xadc:         ReadXadc(self.port)
-            if self.enable_bram_test:    StartBram(self.port, self.bram_both_banks, self.bram_both_banks, self.bram_repeats)
-            if self.enable_flash_id:     FlashReadId(self.port)
-            if self.enable_flash_verify: FlashRead(self.port, self.qspi_seed)
-            if self.enable_uart_echo:    TestEcho(self.port)
-            if self.enable_dio_test:     CheckDio(self.port)
-            if self.enable_mouse:        CheckMouse(self.port)
-            if self.enable_bram_test:    CheckBram(self.port)
+            commands = self.cycle_commands()
+            transfer = time.perf_counter()
+            try:
+                results = transact(self.port, commands, self.protocol == "binary", self.latency)
+                if self.enable_xadc_burst:
+                    burst = [XadcBurstCommand(self.xadc_burst_samples, self.xadc_burst_decimation)]
+                    commands += burst
+                    results += transact(self.port, burst, latency=self.latency)
+            except (ser.SerialException, OSError) as e:
+                self.link_lost(e)
+                return
+            transfer = time.perf_counter() - transfer
+            self.iteration += 1
+            self.record(commands, results)
+            if self.telemetry is not None:
+                self.telemetry.add(commands, results)
+                self.telemetry.end_cycle(time.perf_counter() - start)
+            cycle = time.perf_counter() - start
+            self.latency.record("cycle", cycle)
+            self.latency.record("cycle transfer", transfer)
+            self.latency.record("cycle host", cycle - transfer)
+            if self.enable_flash_verify and (self.flash_read is None or self.flash_read.done):
+                self.flash_read = self.next_flash_read
+            # a board that doesn't answer at all for a few cycles is as good as gone
+            expected = [c for c in commands if c.response_size]
+            self.silent_cycles = self.silent_cycles + 1 if expected and all(c.response is None or len(c.response) == 0 for c in expected) else 0
+            if self.silent_cycles >= LINK_LOSS_CYCLES:
+                self.link_lost(f"no response for {self.silent_cycles} cycles")
+                return
             
             timeleft = (targettime - datetime.now()).total_seconds()
-            if timeleft > 0: time.sleep(timeleft)
+            if timeleft > 0: self.wait(timeleft)
 
-    def stop_test(self):
-        if not self.port is None:
+    def run_cycles(self, cycles=0, give_up=RECONNECT_GIVE_UP):
+        # Runs test cycles until iteration reaches cycles, or until stopped with cycles=0, reconnecting whenever the link
+        # is lost. Returns False if the board is lost for good: not back after give_up seconds, or not connecting again
+        # after its bitstream was programmed.
+        while not self.stopped and (cycles == 0 or self.iteration < cycles):
+            if self.init_sequence >= 3 and self.link_down_since is None:
+                logging.info(f"Cycle {self.iteration + 1} starting")
+            step = self.init_sequence
+            self.run_test()
+            if step < 3 and self.init_sequence == step:
+                return False
+            if self.link_down_since is not None and time.perf_counter() - self.link_down_since > give_up:
+                logging.error(f"Gave up on {self.com_port} after {give_up} seconds without a link")
+                return False
+        return True
+
+    def open_port(self):
+        try:
+            self.port = self.port_factory(port=self.com_port, baudrate=115200, timeout=SERIAL_TIMEOUT)
+        except ser.SerialException as e:
+            logging.error(f"Failed to connect to {self.com_port}: {e}")
+            return False
+        return True
+
+    def close_port(self):
+        # the port may be gone already, closing it only has to release it
+        if self.port is None: return
+        with contextlib.suppress(ser.SerialException, OSError):
             self.port.close()
+        self.port = None
+
+    def configure(self):
+        # everything the board has to be told after connecting: protocol, DIO and BRAM settings
+        if self.binary_protocol:
+            import frames # imports this module
+            version, = transact(self.port, [frames.hello_command()])
+            self.protocol = "binary" if frames.negotiated(self.port, version) else "hex"
+        self.phase = DioDefaultPhase(self.dio_divider)
+        StartDio(self.port, self.dio_mode, self.phase, self.dio_divider)
+        logging.info(f"DIO counter output frequency is set to {100_000_000 / (2 * (self.dio_divider + 1))} MHz")
+        logging.info(f"DIO readback phase count is set to {self.phase} / {self.dio_divider}")
+        if self.enable_bram_test:
+            # a one-shot test is left to the first cycle to start, so that it has a whole cycle to run before it is checked
+            self.bram_monitor = bram_monitor() if self.bram_continuous else None
+            self.bram_started = False
+            if self.bram_continuous:
+                StartBram(self.port, self.bram_both_banks, self.bram_max_address, self.bram_repeats, True)
+            else:
+                transact(self.port, [BramControlCommand(False, True)]) # stops a continuous test left running
+
+    def probe(self):
+        # Whether the board still runs the test design: the firmware answers a flash ID read and a register read of the
+        # DIO peripheral. A command cut off by the link loss may have left the firmware waiting for the rest of it, so
+        # that is completed and thrown away first.
+        ResyncEcho(self.port)
+        flash_id, registers = transact(self.port, [FlashIdCommand(), ReadCommand("Probe", DIO_SETTINGS_ADDR, lambda raw: True)])
+        return flash_id is True and registers is True
+
+    def link_lost(self, reason):
+        logging.error(f"Lost the link to {self.com_port} ({reason}), reconnecting")
+        self.close_port()
+        self.link_down_since = time.perf_counter()
+        self.reconnect_attempts = 0
+        self.probe_failures = 0
+        self.silent_cycles = 0
+        self.flash_read = None # a verification running on the board may be gone with it, start over
+
+    def reconnect(self):
+        # One attempt to get the link back, without the programming steps when the board still runs the test design.
+        # Failed attempts back off; a board that can be opened but doesn't answer for PROBE_ATTEMPTS attempts has lost its
+        # configuration and gets the bitstream programmed again. The QSPI flash keeps its content, so it isn't rewritten.
+        self.reconnect_attempts += 1
+        if self.open_port():
+            try:
+                if self.probe():
+                    self.configure()
+                    seconds = time.perf_counter() - self.link_down_since
+                    logging.info(f"Link to {self.com_port} restored after {seconds:.2f} seconds and {self.reconnect_attempts} attempts")
+                    self.latency.record("reconnect", seconds)
+                    self.reconnects += 1
+                    self.link_down_since = None
+                    return
+                self.probe_failures += 1
+            except (ser.SerialException, OSError) as e:
+                logging.error(f"Lost {self.com_port} again while probing the board: {e}")
+            self.close_port()
+        if self.probe_failures >= PROBE_ATTEMPTS:
+            logging.error(f"Board on {self.com_port} doesn't answer, programming its bitstream again")
+            self.link_down_since = None
+            self.init_sequence = 1
+            return
+        self.wait(RECONNECT_BACKOFF[min(self.reconnect_attempts, len(RECONNECT_BACKOFF)) - 1])
+
+    def stop_test(self):
+        self.close_port()
+        if self.echo_stats.bursts:
+            self.echo_stats.log()
+        if self.latency.latency:
+            self.latency.log()
+
+def parse_setting(text):
+    # "name=value" from the command line, converted to the type of the setting's default
+    name, _, value = text.partition("=")
+    if name not in DEFAULT_SETTINGS:
+        raise ValueError(f"Unknown setting {name}, one of {', '.join(DEFAULT_SETTINGS)}")
+    if isinstance(DEFAULT_SETTINGS[name], bool):
+        if value.lower() not in ("1", "0", "true", "false", "yes", "no", "on", "off"):
+            raise ValueError(f"Setting {name} takes true or false, not {value}")
+        return name, value.lower() in ("1", "true", "yes", "on")
+    return name, int(value, 0)
+
+def load_settings(path):
+    # a JSON object of settings, by the names of DEFAULT_SETTINGS, com_port optional
+    with open(path) as f:
+        settings = json.load(f)
+    unknown = set(settings) - set(DEFAULT_SETTINGS) - {"com_port"}
+    if unknown:
+        raise ValueError(f"Unknown settings in {path}: {', '.join(sorted(unknown))}")
+    return settings
 
 if __name__ == "__main__":
-    def init_logging():
-        logging.basicConfig(level=logging.INFO)
-        log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
-        logger = logging.getLogger()
-
-        file_handler = logging.FileHandler("test.log")
-        file_handler.setFormatter(log_formatter)
-        logger.addHandler(file_handler)
-
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(log_formatter)
-        logger.addHandler(console_handler)
-    init_logging()
-    settings = {
-        "enable_xadc":         True,
-        "enable_flash_id":     True,
-        "enable_flash_verify": True,
-        "enable_uart_echo":    True,
-        "enable_dio_test":     True,
-        "enable_mouse":        True,
-        "enable_bram_test":    True,
-        "dio_divider":         3,
-        "dio_mode":            2,
-        "com_port":            sys.argv[1]
-    }
-    raise NotImplementedError("Run test via gui.py script instead.")
-
-# BRAM: Add continuous immunity mode?
-#       Implement controls for bank 1 and addressing in GUI.
\ No newline at end of file
+    # Runs the test without the GUI, e.g. as a systemd service on a rack machine or from a script. Stops after --cycles
+    # cycles, or on SIGTERM or Ctrl+C, and exits with 0 only if the board connected and no check failed.
+    #   python test.py /dev/ttyUSB1 --cycles 600 --set dio_mode=2 --set enable_mouse=false
+    #   python test.py --config rack.json --telemetry rack_0
+    #   python test.py --sim --cycles 10
+    #   python test.py /dev/ttyUSB1 --capture bench.cap    records the session for replay with capture.py
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the Basys 3 test from the command line")
+    parser.add_argument("port", nargs="?", help="serial port of the board, or com_port from --config")
+    parser.add_argument("--config", help="JSON file of settings, see DEFAULT_SETTINGS in test.py")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", help="override a setting, e.g. dio_mode=2")
+    parser.add_argument("--cycles", type=int, default=0, help="cycles to run, 0 until stopped")
+    parser.add_argument("--cycle-period", type=float, default=1.0)
+    parser.add_argument("--jtag-target", help="serial number of the JTAG cable to program through")
+    parser.add_argument("--skip-programming", action="store_true", help="test the board as it is, without the Vivado steps")
+    parser.add_argument("--log", default="test.log", help="log file, next to the console output; '' for none")
+    parser.add_argument("--telemetry", metavar="NAME", help="record every cycle to telemetry/NAME_<part>.tlm")
+    parser.add_argument("--report", help="also write the results to this JSON file")
+    parser.add_argument("--capture", help="record everything said over the serial port to this file, see capture.py")
+    parser.add_argument("--no-index", action="store_true", help="don't add the run to the results index, see results_index.py")
+    parser.add_argument("--sim", action="store_true", help="run against board_sim instead of a board")
+    parser.add_argument("--list-ports", action="store_true", help="list the attached boards and exit")
+    args = parser.parse_args()
+
+    log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s")
+    handlers = [logging.StreamHandler()]
+    if args.log: handlers.append(logging.FileHandler(args.log))
+    for handler in handlers: handler.setFormatter(log_formatter)
+    logging.basicConfig(level=logging.INFO, handlers=handlers)
+
+    if args.list_ports:
+        boards = get_portlist()
+        for board in boards: print(board)
+        if not boards: print("No boards found")
+        raise SystemExit(0)
+    try:
+        settings = load_settings(args.config) if args.config else {}
+        settings.update(parse_setting(text) for text in args.set)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.port: settings["com_port"] = args.port
+    if args.sim: settings.setdefault("com_port", "sim")
+    if "com_port" not in settings:
+        parser.error("give the serial port of the board, in the config file or on the command line, or --sim")
+
+    obj = test_obj()
+    obj.setup_test(settings)
+    obj.cycle_period = args.cycle_period
+    obj.jtag_target = args.jtag_target
+    obj.stop_event = threading.Event()
+    def stop(signum, frame):
+        logging.info(f"Stopping on {signal.Signals(signum).name}")
+        obj.stop_event.set()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    if args.skip_programming or args.sim:
+        obj.init_sequence = 2
+    if args.sim:
+        from board_sim import board_sim
+        sim = board_sim(port=obj.com_port, usb_latency=0.016)
+        sim.flash_seed = obj.qspi_seed # as if write_qspi had programmed the board
+        obj.port_factory = sim.connect
+    values = {name: setting_value(settings, name) for name in DEFAULT_SETTINGS}
+    rng_seed = random.getrandbits(32)
+    rng.seed(rng_seed) # so a replay draws the same echo data and BRAM seeds, and the results index knows them
+    capture = None
+    if args.capture:
+        from capture import capture_writer
+        meta = {"port": obj.com_port, "settings": values, "qspi_seed": obj.qspi_seed, "rng_seed": rng_seed}
+        capture = capture_writer(args.capture, meta)
+        obj.port_factory = capture.port_factory(obj.port_factory)
+    if args.telemetry:
+        from telemetry import telemetry_recorder
+        obj.telemetry = telemetry_recorder(args.telemetry, meta=dict(settings, qspi_seed=obj.qspi_seed))
+
+    start = time.perf_counter()
+    try:
+        while obj.init_sequence < 3 and not obj.stopped:
+            step = obj.init_sequence
+            obj.run_test()
+            if obj.init_sequence == step: break # couldn't connect
+        connected = obj.init_sequence >= 3 and obj.run_cycles(args.cycles)
+    finally:
+        obj.stop_test()
+        if obj.telemetry is not None: obj.telemetry.close()
+        if capture is not None: capture.close()
+    seconds = time.perf_counter() - start
+    cycles = obj.iteration
+
+    if not args.no_index:
+        from results_index import record_run
+        record_run(obj, values, os.path.splitext(os.path.basename(args.log))[0] if args.log else None, rng_seed=rng_seed, connected=connected)
+
+    failed = [name for name, (_, f) in obj.tally.items() if f]
+    logging.info(f"Ran {cycles} cycles in {seconds:.1f} seconds, " + ", ".join(f"{name} {p}/{f}" for name, (p, f) in sorted(obj.tally.items())) + " (passed/failed)")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"port": obj.com_port, "connected": connected, "cycles": cycles, "seconds": seconds, "reconnects": obj.reconnects, "tally": obj.tally}, f, indent=2)
+    raise SystemExit(0 if connected and not failed else 1)
+
+# BRAM: Implement controls for bank 1 and addressing in GUI.
\ No newline at end of file
@@ -0,0 +1,32 @@
+import os
+import sys
+import pytest
+
+# Tests of the host scripts, run against board_sim: python -m pytest host/tests
+# the host scripts import each other as top-level modules, as they do when run from host/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import test
+from board_sim import board_sim
+from benchmark import make_settings
+
+@pytest.fixture
+def sim_test():
+    # runs a test_obj against a fresh board_sim: sim_test(enabled settings, binary, cycles, faults, settings overrides)
+    # returns the test_obj after its cycles, with the sim as obj.sim
+    objs = []
+    def run(enabled, binary=True, cycles=4, cycle_period=0.1, faults={}, **settings):
+        sim = board_sim(seed=1)
+        sim.inject(**faults)
+        obj = test.test_obj()
+        obj.setup_test(dict(make_settings(set(enabled), binary), **settings))
+        obj.port_factory = sim.connect
+        obj.cycle_period = cycle_period
+        sim.flash_seed = obj.qspi_seed # as if write_qspi had programmed the board
+        obj.init_sequence = 2
+        obj.sim = sim
+        objs.append(obj)
+        obj.run_cycles(cycles)
+        return obj
+    yield run
+    for obj in objs: obj.close_port()
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import time
+import lfsr
+import test
+import async_engine
+
+def test_boards_on_one_loop_program_their_own_pattern(monkeypatch):
+    # the pattern file is shared: each board has to be programmed with the file generated from its own seed
+    programmed = []
+    def write_qspi_binfile(seed, target=None, vivado=None, stop=None):
+        test.generate_qspi_simfile(seed)
+        time.sleep(0.05) # while Vivado would be programming the file
+        with open(os.path.join(os.path.dirname(test.__file__), "random_data.bin"), "rb") as f:
+            programmed.append((target, int.from_bytes(f.read(4), "little") == lfsr.lfsr_next(seed)))
+        return True
+    monkeypatch.setattr(test, "write_qspi_binfile", write_qspi_binfile)
+    monkeypatch.setattr(test, "program_device", lambda *args: True)
+    monkeypatch.setattr(test, "save_qspi_seed", lambda *args: None)
+    engines = []
+    for i in range(3):
+        obj = test.test_obj()
+        obj.setup_test({"com_port": f"sim{i}", "enable_flash_verify": True})
+        obj.jtag_target = f"cable{i}"
+        engines.append(async_engine.async_test_engine(obj))
+    async def program():
+        await asyncio.gather(*(e.program() for e in engines))
+    asyncio.run(program())
+    assert sorted(programmed) == [("cable0", True), ("cable1", True), ("cable2", True)]
+    assert [e.obj.init_sequence for e in engines] == [2, 2, 2]
+
+def test_cancel_stops_programming(monkeypatch):
+    stopped = []
+    def program_device(target=None, vivado=None, stop=None):
+        stop.wait(5)
+        stopped.append(stop.is_set())
+        return False
+    monkeypatch.setattr(test, "program_device", program_device)
+    obj = test.test_obj()
+    obj.setup_test({"com_port": "sim", "enable_flash_verify": False})
+    async def cancel():
+        task = asyncio.ensure_future(async_engine.async_test_engine(obj).program())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    start = time.monotonic()
+    asyncio.run(cancel())
+    assert stopped == [True]
+    assert time.monotonic() - start < 1
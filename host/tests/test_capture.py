@@ -0,0 +1,84 @@
+import random
+import test
+from benchmark import make_settings
+from board_sim import board_sim
+from capture import capture_writer, replay_port, summary
+
+SETTINGS = make_settings({"enable_uart_echo", "enable_dio_test", "enable_mouse", "enable_flash_id", "enable_xadc"})
+
+def record(path, cycles=4, **faults):
+    sim = board_sim(seed=1)
+    sim.inject(**faults)
+    obj = test.test_obj()
+    obj.setup_test(SETTINGS)
+    obj.cycle_period = 0.05
+    obj.init_sequence = 2
+    rng_seed = random.getrandbits(32)
+    test.rng.seed(rng_seed)
+    writer = capture_writer(path, {"port": "sim", "settings": {name: test.setting_value(SETTINGS, name) for name in test.DEFAULT_SETTINGS},
+                                   "qspi_seed": obj.qspi_seed, "rng_seed": rng_seed})
+    obj.port_factory = writer.port_factory(sim.connect)
+    try:
+        obj.run_cycles(cycles)
+    finally:
+        obj.stop_test()
+        writer.close()
+    return obj
+
+def replay(path):
+    port = replay_port(path)
+    obj = test.test_obj()
+    obj.setup_test(dict(port.meta["settings"], com_port=port.port))
+    obj.qspi_seed = port.meta["qspi_seed"]
+    test.rng.seed(port.meta["rng_seed"])
+    obj.port_factory = port.connect
+    obj.cycle_period = 0
+    obj.init_sequence = 2
+    while not port.finished and not obj.stopped:
+        obj.run_test()
+    obj.stop_test()
+    return obj, port
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "run.cap"
+    recorded = record(path)
+    replayed, port = replay(path)
+    assert port.mismatches == 0
+    assert port.writes > 0
+    assert replayed.iteration == recorded.iteration
+    assert replayed.tally == recorded.tally
+
+def test_replay_reproduces_failures(tmp_path):
+    path = tmp_path / "run.cap"
+    recorded = record(path, dio_error_bits=0x1, mouse_stale=True)
+    replayed, port = replay(path)
+    assert port.mismatches == 0
+    assert replayed.tally["CheckDio"] == recorded.tally["CheckDio"] != [recorded.iteration, 0]
+    assert replayed.tally["CheckMouse"][1] > 0
+
+def test_changed_host_shows_as_mismatch(tmp_path):
+    path = tmp_path / "run.cap"
+    record(path)
+    port = replay_port(path)
+    obj = test.test_obj()
+    obj.setup_test(dict(port.meta["settings"], com_port=port.port, uart_echo_size=50))
+    test.rng.seed(port.meta["rng_seed"])
+    obj.port_factory = port.connect
+    obj.cycle_period = 0
+    obj.init_sequence = 2
+    for _ in range(3): obj.run_test()
+    obj.stop_test()
+    assert port.mismatches > 0
+
+def test_summary_and_truncated_file(tmp_path):
+    path = tmp_path / "run.cap"
+    record(path, cycles=2)
+    meta, counts, sizes, seconds, errors = summary(path)
+    assert meta["port"] == "sim"
+    assert counts["open"] == 1 and counts["write"] > 0 and counts["read"] > 0
+    assert errors == []
+    # a capture cut short by a crash is good up to its last whole record
+    data = path.read_bytes()
+    path.write_bytes(data[:-3])
+    _, cut, _, _, _ = summary(path)
+    assert cut["write"] + cut["read"] + cut["close"] == counts["write"] + counts["read"] + counts["close"] - 1
@@ -0,0 +1,55 @@
+import pytest
+import test
+
+ALL_CHECKS = ["enable_xadc", "enable_flash_id", "enable_flash_verify", "enable_uart_echo", "enable_dio_test", "enable_mouse",
+              "enable_bram_test"]
+
+def failed(obj):
+    return {name for name, (_, f) in obj.tally.items() if f}
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_all_checks_pass(sim_test, binary):
+    obj = sim_test(ALL_CHECKS, binary, cycles=5, cycle_period=0.3, bram_passes=10)
+    assert obj.protocol == ("binary" if binary else "hex")
+    assert obj.iteration == 5
+    assert failed(obj) == set()
+    for name in ("TestEcho", "CheckDio", "CheckMouse", "FlashReadId", "ReadXadc", "CheckBram", "FlashRead"):
+        assert obj.tally[name][0] > 0, name
+    assert obj.sim.overruns == 0
+
+@pytest.mark.parametrize("binary", [False, True])
+@pytest.mark.parametrize("enabled, faults, check", [
+    ("enable_dio_test",     {"dio_error_bits": 0x4},       "CheckDio"),
+    ("enable_dio_test",     {"dio_stopped": True},         "CheckDio"),
+    ("enable_mouse",        {"mouse_stale": True},         "CheckMouse"),
+    ("enable_flash_id",     {"flash_id": 0x123456},        "FlashReadId"),
+    ("enable_flash_verify", {"flash_errors": 3},           "FlashRead"),
+])
+def test_fault_fails_its_check(sim_test, binary, enabled, faults, check):
+    obj = sim_test(["enable_uart_echo", enabled], binary, cycles=4, cycle_period=0.3, faults=faults)
+    assert failed(obj) == {check}
+    assert obj.tally["TestEcho"] == [4, 0]
+
+def test_continuous_bram_upsets_fail(sim_test):
+    obj = sim_test(["enable_bram_test"], cycles=4, cycle_period=0.2, faults={"bram_upset_rate": 1.0}, bram_continuous=True,
+                   bram_passes=10)
+    assert obj.tally["CheckBram"][1] > 0
+    assert obj.bram_monitor.fails > 0
+
+def test_corrupt_replies_fail_instead_of_passing(sim_test):
+    obj = sim_test(["enable_uart_echo", "enable_dio_test", "enable_mouse"], cycles=6, cycle_period=0.1,
+                   faults={"corrupt_rate": 0.02})
+    # every check still gets a verdict each cycle, and none of the corruption goes unnoticed as a pass of the echo
+    assert sum(obj.tally["TestEcho"]) == 6
+    assert obj.tally["TestEcho"][1] > 0
+
+def test_parse_responses_short_read():
+    commands = [test.FlashIdCommand(), test.DioCheckCommand(), test.WriteCommand(0x10, 1)]
+    results = test.parse_responses(commands, b"1620c2" + b"0000")
+    assert results == [True, False, None]
+    assert commands[0].response == b"1620c2"
+    assert commands[1].response == b"0000"
+
+def test_parse_responses_splits_batch():
+    commands = [test.FlashIdCommand(), test.FlashIdCommand()]
+    assert test.parse_responses(commands, b"1620c2" + b"000001") == [True, False]
@@ -0,0 +1,89 @@
+import pytest
+import frames
+import test
+from frames import encode_frame, decode_frames, FRAME_REPLY, FRAME_NAK, FRAME_READ, FRAME_WRITE, FRAME_ECHO, SYNC
+
+def reply(cmd, payload=b""):
+    return encode_frame(cmd | FRAME_REPLY, payload)
+
+def test_encode_decode_round_trip():
+    data = encode_frame(FRAME_ECHO, b"abc") + encode_frame(FRAME_READ, bytes([0, 4]))
+    decoded, used, errors = decode_frames(data)
+    assert [(f.cmd, f.payload) for f in decoded] == [(FRAME_ECHO, b"abc"), (FRAME_READ, bytes([0, 4]))]
+    assert used == len(data)
+    assert errors == 0
+
+def test_crc_is_ccitt_false():
+    assert frames.crc16(b"123456789") == 0x29b1
+
+def test_payload_too_long():
+    with pytest.raises(ValueError):
+        encode_frame(FRAME_ECHO, bytes(frames.MAX_PAYLOAD + 1))
+
+def test_partial_frame_is_left_for_later():
+    data = encode_frame(FRAME_ECHO, b"abcd")
+    decoded, used, errors = decode_frames(data[:-1])
+    assert decoded == [] and used == 0 and errors == 0
+
+def test_resync_after_corruption():
+    good = encode_frame(FRAME_ECHO, b"xy")
+    bad = bytearray(encode_frame(FRAME_ECHO, b"ab"))
+    bad[3] ^= 0x01
+    decoded, used, errors = decode_frames(b"\x00\x01" + bytes(bad) + good)
+    assert [f.payload for f in decoded] == [b"xy"]
+    assert used == 2 + len(bad) + len(good)
+    assert errors > 0
+
+def test_sync_byte_inside_payload():
+    data = encode_frame(FRAME_ECHO, bytes([SYNC, SYNC, 1]))
+    decoded, _, errors = decode_frames(b"\xff" + data)
+    assert [f.payload for f in decoded] == [bytes([SYNC, SYNC, 1])]
+    assert errors == 1
+
+def test_to_binary_bursts_runs_of_reads_and_writes():
+    commands = [test.WriteCommand(0x10, 1), test.WriteCommand(0x14, 2), test.DioCheckCommand(), test.MouseCheckCommand(),
+                test.EchoCommand(4), test.FlashIdCommand()]
+    binary = frames.to_binary(commands)
+    assert [c.request[2] for c in binary] == [FRAME_WRITE, FRAME_READ, FRAME_ECHO, frames.FRAME_FLASH_ID]
+    assert [len(c.parts) for c in binary] == [2, 2, 1, 1]
+    assert binary[1].name == "CheckDio+CheckMouse"
+
+def test_burst_length_is_limited():
+    commands = [test.DioCheckCommand() for _ in range(frames.MAX_BURST_READS + 1)]
+    assert [len(c.parts) for c in frames.to_binary(commands)] == [frames.MAX_BURST_READS, 1]
+
+def test_replies_render_back_to_hex():
+    commands = [test.WriteCommand(0x10, 1), test.FlashIdCommand(), test.DioCheckCommand()]
+    binary = frames.to_binary(commands)
+    raw = reply(FRAME_WRITE) + reply(frames.FRAME_FLASH_ID, (0x1620c2).to_bytes(4, "little")) + reply(FRAME_READ, bytes(4))
+    assert frames.parse_frame_responses(binary, raw) == [None, True, True]
+    assert commands[1].response == b"1620c2"
+    assert commands[2].response == b"00000000"
+
+def test_lost_reply_doesnt_shift_onto_the_next_command():
+    # the write's reply is lost: the two read replies that follow are the same size and would parse cleanly on the
+    # wrong reads, so they must count as missing instead
+    commands = [test.DioCheckCommand(), test.WriteCommand(0x10, 1), test.FlashIdCommand(), test.DioCheckCommand()]
+    binary = frames.to_binary(commands)
+    raw = reply(FRAME_READ, bytes(4)) + reply(frames.FRAME_FLASH_ID, (0x1620c2).to_bytes(4, "little")) + reply(FRAME_READ, bytes(4))
+    assert frames.parse_frame_responses(binary, raw) == [True, None, False, False]
+
+def test_nak_answers_its_command():
+    binary = frames.to_binary([test.FlashIdCommand(), test.DioCheckCommand()])
+    raw = encode_frame(FRAME_NAK, bytes([frames.NAK_CRC])) + reply(FRAME_READ, bytes(4))
+    assert frames.parse_frame_responses(binary, raw) == [False, True]
+
+def test_wrong_size_reply_fails():
+    binary = frames.to_binary([test.DioCheckCommand()])
+    assert frames.parse_frame_responses(binary, reply(FRAME_READ, bytes(3))) == [False]
+
+def test_binary_and_hex_agree_on_sim():
+    from board_sim import board_sim
+    port = sim = board_sim(seed=1, timeout=test.SERIAL_TIMEOUT)
+    assert frames.negotiated(port, test.transact(port, [frames.hello_command()])[0])
+    for binary in (False, True):
+        commands = [test.WriteCommand(test.DIO_SETTINGS_ADDR, 0), test.FlashIdCommand(), test.EchoCommand(16), test.XadcCommand()]
+        results = test.transact(port, commands, binary)
+        assert results[:3] == [None, True, True]
+        assert set(results[3]) == {"temp", "vccint", "vccaux", "vbram"}
+    assert sim.overruns == 0
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+import lfsr
+
+def scalar_sequence(seed, count):
+    words = []
+    state = seed
+    for _ in range(count):
+        state = lfsr.lfsr_next(state)
+        words.append(state)
+    return words
+
+@pytest.mark.parametrize("seed", [1, 0xdeadbeef, 0xffffffff])
+@pytest.mark.parametrize("count", [1, 255, 256, 257, 3000])
+def test_sequence_matches_scalar(seed, count):
+    assert lfsr.lfsr_sequence(seed, count).tolist() == scalar_sequence(seed, count)
+
+def test_sequence_block_size_doesnt_matter():
+    assert np.array_equal(lfsr.lfsr_sequence(0x1234, 1000, block=7), lfsr.lfsr_sequence(0x1234, 1000))
+
+def test_step_matches_scalar():
+    states = np.array([1, 0x80000000, 0x00200000, 0xdeadbeef], dtype=np.uint32)
+    assert lfsr.lfsr_step(states).tolist() == [lfsr.lfsr_next(int(s)) for s in states]
+
+@pytest.mark.parametrize("n", [0, 1, 31, 1000])
+def test_jump_matches_scalar(n):
+    expected = ([0xcafe] + scalar_sequence(0xcafe, n))[n]
+    assert lfsr.lfsr_jump(0xcafe, n) == expected
+
+def test_bytes_are_little_endian_words():
+    data = lfsr.lfsr_bytes(5, 3)
+    assert data == b"".join(w.to_bytes(4, "little") for w in scalar_sequence(5, 3))
+
+def test_cached_pattern(tmp_path):
+    pattern = lfsr.load_pattern(7, 100, cache_dir=tmp_path)
+    assert pattern.tolist() == scalar_sequence(7, 100)
+    path = lfsr.cached_pattern(7, 100, cache_dir=tmp_path)
+    assert path == lfsr.cache_path(7, 100, tmp_path)
+
+def test_cache_eviction_keeps_newest(tmp_path):
+    lfsr.cached_pattern(1, 100, cache_dir=tmp_path, max_bytes=500)
+    lfsr.cached_pattern(2, 100, cache_dir=tmp_path, max_bytes=500)
+    assert [str(p) for p in tmp_path.iterdir()] == [lfsr.cache_path(2, 100, tmp_path)]
@@ -0,0 +1,120 @@
+import pytest
+import test
+import telemetry
+from benchmark import make_settings
+from board_sim import board_sim
+from results_index import results_index, record_run
+
+@pytest.fixture
+def index(tmp_path):
+    index = results_index(str(tmp_path / "results.db"))
+    yield index
+    index.close()
+
+def sim_run(enabled, cycles, faults={}, **settings):
+    # a test_obj after cycles against board_sim
+    sim = board_sim(seed=1)
+    sim.inject(**faults)
+    obj = test.test_obj()
+    obj.setup_test(dict(make_settings(set(enabled)), **settings))
+    obj.port_factory = sim.connect
+    obj.cycle_period = 0.05
+    obj.init_sequence = 2
+    obj.run_cycles(cycles)
+    obj.stop_test()
+    return obj
+
+def recorder(directory, name="run_0", **kwargs):
+    return telemetry.telemetry_recorder(name, directory=str(directory), meta=dict(test.DEFAULT_SETTINGS, com_port="COM3"),
+                                        buffer_records=1, **kwargs)
+
+def cycles(rec, results):
+    for passed in results:
+        rec.current["echo_passed"] = passed
+        rec.current["dio_passed"] = 1
+        rec.end_cycle(0.1)
+
+def checks(index, run_id):
+    return {name: (p, f) for name, p, f in index.db.execute("SELECT name, passed, failed FROM checks WHERE run_id = ?", (run_id,))}
+
+def test_record_run_and_query(index):
+    obj = sim_run(["enable_uart_echo", "enable_dio_test"], cycles=3, faults={"dio_error_bits": 0x2}, dio_mode=3, dio_divider=3)
+    settings = {name: test.setting_value({}, name) for name in test.DEFAULT_SETTINGS}
+    settings.update(enable_uart_echo=True, enable_dio_test=True, dio_mode=3, dio_divider=3)
+    run_id = record_run(obj, settings, "run_7", path=index.path, rng_seed=42)
+    other = sim_run(["enable_uart_echo"], cycles=2)
+    record_run(other, dict(settings, dio_mode=1), "run_8", path=index.path)
+
+    assert checks(index, run_id) == {"TestEcho": (3, 0), "CheckDio": (0, 3)}
+    row = index.db.execute("SELECT log, board_id, rng_seed, cycles, connected FROM runs WHERE id = ?", (run_id,)).fetchone()
+    assert row == ("run_7", "sim", 42, 3, 1)
+    assert [r[1] for r in index.runs(settings={"dio_mode": 3, "dio_divider": 3}, failed=["CheckDio"])] == ["run_7"]
+    assert index.runs(settings={"dio_mode": 3}, failed=["TestEcho"]) == []
+    assert [r[1] for r in index.runs(failed=[""])] == ["run_7"]
+    assert len(index.runs(board="sim")) == 2
+    assert index.boards()[0][:5] == ("sim", None, 2, 5, 1)
+
+def test_ingest_is_incremental(index, tmp_path):
+    rec = recorder(tmp_path)
+    cycles(rec, [1, 0, 1])
+    assert index.ingest(str(tmp_path)) == 3
+    assert index.ingest(str(tmp_path)) == 0
+    cycles(rec, [0])
+    assert index.ingest(str(tmp_path)) == 1
+    rec.close()
+    (run_id, log, _, board_id, count, failed), = index.runs()
+    assert (log, board_id, count, failed) == ("run_0", "COM3", 4, "TestEcho 2")
+    assert checks(index, run_id) == {"TestEcho": (2, 2), "CheckDio": (4, 0)}
+    assert [r[1] for r in index.runs(settings={"dio_mode": test.DEFAULT_SETTINGS["dio_mode"]})] == ["run_0"]
+
+def test_ingest_follows_rollover_and_new_sessions(index, tmp_path):
+    small = dict(max_bytes=telemetry.HEADER_SIZE + 2 * telemetry.RECORD.itemsize)
+    rec = recorder(tmp_path, **small)
+    cycles(rec, [1] * 5) # three parts
+    rec.close()
+    rec = recorder(tmp_path, **small) # the next Start of the same app: a new run in the next parts
+    cycles(rec, [0] * 2)
+    rec.close()
+    assert index.ingest(str(tmp_path)) == 7
+    assert [(r[4], r[5]) for r in index.runs()] == [(5, None), (2, "TestEcho 2")]
+
+def test_run_recorded_at_its_end_replaces_ingest(index, tmp_path):
+    rec = recorder(tmp_path)
+    cycles(rec, [1, 1])
+    index.ingest(str(tmp_path)) # while the run is going
+    cycles(rec, [0])
+    rec.close()
+    run_id = index.add_run({"dio_mode": 1}, {"TestEcho": [2, 1]}, rec.parts, log="run_0", cycles=3)
+    assert [r[0] for r in index.runs()] == [run_id]
+    assert checks(index, run_id) == {"TestEcho": (2, 1)}
+    assert index.ingest(str(tmp_path)) == 0
+    assert checks(index, run_id) == {"TestEcho": (2, 1)}
+
+def test_run_ending_during_ingest_isnt_counted_twice(index, tmp_path):
+    rec = recorder(tmp_path)
+    cycles(rec, [1, 1])
+    index.ingest(str(tmp_path))
+    cycles(rec, [0])
+    rec.close()
+    ingest_part = index._ingest_part
+    def racing(*args):
+        # the run is added between ingest's look at the parts and its transaction
+        other = results_index(index.path)
+        other.add_run({}, {"TestEcho": [2, 1]}, rec.parts, log="run_0", cycles=3)
+        other.close()
+        return ingest_part(*args)
+    index._ingest_part = racing
+    assert index.ingest(str(tmp_path)) == 0
+    (run_id, *_), = index.runs()
+    assert checks(index, run_id) == {"TestEcho": (2, 1)}
+
+def test_new_log_name(index, tmp_path):
+    (tmp_path / "run_0.log").write_text("")
+    (tmp_path / "run_1.log").write_text("")
+    assert index.new_log_name("run", str(tmp_path)) == "run_2"
+    assert index.new_log_name("run", str(tmp_path)) == "run_3"
+    assert index.new_log_name("farm", str(tmp_path)) == "farm_0"
+
+def test_record_run_survives_a_bad_index(tmp_path):
+    obj = sim_run(["enable_uart_echo"], cycles=1)
+    assert record_run(obj, {}, path=str(tmp_path / "missing" / "results.db")) is None
@@ -0,0 +1,45 @@
+import pytest
+import sweep
+
+def counted(window):
+    # passes inside window (first, last), and the values measured, in order
+    measured = []
+    def passes(value):
+        measured.append(value)
+        return window[0] <= value <= window[1]
+    return passes, measured
+
+@pytest.mark.parametrize("window", [(10, 40), (0, 40), (10, 99), (37, 45), (1, 98)])
+def test_find_edges_of_a_window(window):
+    passes, measured = counted(window)
+    edges = sweep.find_edges(passes, 0, 99, 8)
+    expected = []
+    if window[0] > 0: expected.append((window[0] - 1, window[0]))
+    if window[1] < 99: expected.append((window[1], window[1] + 1))
+    assert edges == expected
+    assert len(set(measured)) < 40 # far fewer than the 100 values of a full scan
+
+def test_find_edges_all_passing():
+    passes, _ = counted((0, 99))
+    assert sweep.find_edges(passes, 0, 99, 10) == []
+
+def test_find_edges_measures_last_value():
+    passes, measured = counted((0, 98))
+    assert sweep.find_edges(passes, 0, 99, 10) == [(98, 99)]
+    assert 99 in measured
+
+def test_find_edges_misses_a_gap_narrower_than_the_step():
+    # the documented limit: two edges between the same pair of coarse neighbours go unnoticed
+    passes, _ = counted((0, 99))
+    hole = lambda value: passes(value) and value != 45
+    assert sweep.find_edges(hole, 0, 99, 10) == []
+    assert sweep.find_edges(hole, 0, 99, 1) == [(44, 45), (45, 46)]
+
+def test_runs_and_expand():
+    passing = [False, True, True, False, True]
+    assert sweep.runs(passing) == [(0, 0, False), (1, 2, True), (3, 3, False), (4, 4, True)]
+    assert sweep.expand(sweep.runs(passing)) == passing
+
+def test_centre_of():
+    assert sweep.centre_of([False, True, True, True, False, True]) == (1, 3, 2)
+    assert sweep.centre_of([False, False]) is None
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+import telemetry
+
+V1_RECORD = np.dtype([field for field in telemetry.RECORD.descr if field[0] not in ("bram_passes", "bram_fails")])
+
+def record_part(directory, name, cycles, passes=None):
+    rec = telemetry.telemetry_recorder(name, directory=str(directory), buffer_records=1)
+    for _ in range(cycles):
+        if passes is not None: rec.current["bram_passes"] = passes
+        rec.current["bram_passed"] = 1
+        rec.end_cycle(0.1)
+    rec.close()
+
+def test_load_records_aligns_parts_of_older_versions(tmp_path, monkeypatch):
+    # a run continued by a newer recorder: the first part has no BRAM counters
+    monkeypatch.setattr(telemetry, "RECORD", V1_RECORD)
+    monkeypatch.setattr(telemetry, "TELEMETRY_VERSION", 1)
+    record_part(tmp_path, "run_0", 2)
+    monkeypatch.undo()
+    record_part(tmp_path, "run_0", 3, passes=7)
+    records = telemetry.load_records("run_0", str(tmp_path))
+    assert records.dtype == telemetry.RECORD
+    assert list(records["bram_passes"]) == [0, 0, 7, 7, 7]
+    assert list(records["bram_passed"]) == [1] * 5
+    assert np.isnan(records["temp"]).all()
+
+def test_load_records_rejects_conflicting_fields(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "RECORD", np.dtype([(n, "<f8" if n == "cycle" else t) for n, t in telemetry.RECORD.descr]))
+    record_part(tmp_path, "run_0", 1)
+    monkeypatch.undo()
+    record_part(tmp_path, "run_0", 1)
+    with pytest.raises(ValueError, match="cycle"):
+        telemetry.load_records("run_0", str(tmp_path))
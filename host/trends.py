@@ -0,0 +1,215 @@
+import queue
+import time
+from tkinter import Canvas, StringVar
+from tkinter import ttk
+import numpy as np
+
+# Live trend plots of a test run, for spotting slow drift (temperature, supply sag) and bursts of errors over runs that
+# last days. Every cycle's telemetry record is reduced to a few channels and kept in a trend_buffer: a stack of ring
+# buffers of fixed size, each one holding min/max/mean buckets of factor buckets of the one below. Memory and the cost of
+# a redraw stay the same however long the run, and any time span from minutes to a week is drawn from the finest level
+# that still covers it.
+#   python trends.py run_0          shows the trends of a recorded run
+
+# (channel, label, unit), in the order they are plotted; the XADC ones are the telemetry fields of the same name
+CHANNELS = [
+    ("temp",     "Temperature", "C"),
+    ("vccint",   "VCCINT",      "V"),
+    ("vccaux",   "VCCAUX",      "V"),
+    ("vbram",    "VBRAM",       "V"),
+    ("failed",   "Failed checks", "/cycle"),
+    ("timeouts", "Timeouts",    "/cycle"),
+]
+
+# label, seconds
+SPANS = [
+    ("10 min", 600),
+    ("1 h",    3600),
+    ("6 h",    6 * 3600),
+    ("1 d",    24 * 3600),
+    ("7 d",    7 * 24 * 3600),
+]
+
+def record_values(record):
+    # the channels of one telemetry record, NaN for those it doesn't have
+    values = np.full(len(CHANNELS), np.nan)
+    passed = [name for name in record.dtype.names if name.endswith("_passed")]
+    for i, (name, _, _) in enumerate(CHANNELS):
+        if name == "failed":
+            values[i] = sum(int(record[p]) == 0 for p in passed)
+        elif name in record.dtype.names:
+            values[i] = record[name]
+    return values
+
+class trend_level:
+    # ring buffer of buckets, each with the time of its first sample and the min, max and mean of every channel
+    def __init__(self, capacity, channels):
+        self.time = np.full(capacity, np.nan)
+        self.min = np.full((capacity, channels), np.nan)
+        self.max = np.full((capacity, channels), np.nan)
+        self.mean = np.full((capacity, channels), np.nan)
+        self.next = 0
+        self.count = 0
+
+    def append(self, t, lo, hi, mean):
+        i = self.next
+        self.time[i] = t
+        self.min[i] = lo
+        self.max[i] = hi
+        self.mean[i] = mean
+        self.next = (i + 1) % len(self.time)
+        self.count = min(self.count + 1, len(self.time))
+
+    def ordered(self):
+        # time, min, max and mean of the buckets held, oldest first
+        if self.count < len(self.time):
+            s = slice(0, self.count)
+            return self.time[s], self.min[s], self.max[s], self.mean[s]
+        order = np.r_[self.next:len(self.time), 0:self.next]
+        return self.time[order], self.min[order], self.max[order], self.mean[order]
+
+class trend_buffer:
+    # Level 0 holds the last capacity samples, level k buckets of factor**k samples. NaN values (a check that didn't run)
+    # are left out of the min, max and mean of a bucket.
+    def __init__(self, channels, capacity=600, factor=6, levels=5):
+        self.channels = channels
+        self.factor = factor
+        self.levels = [trend_level(capacity, channels) for _ in range(levels)]
+        # bucket being filled for each level above the first: time, min, max, sum, valid samples, samples
+        self.partial = [None] * levels
+        self.samples = 0
+
+    def add(self, t, values):
+        values = np.asarray(values, dtype=float)
+        self.samples += 1
+        self.levels[0].append(t, values, values, values)
+        self._feed(1, t, values, values, values)
+
+    def _feed(self, k, t, lo, hi, mean):
+        if k >= len(self.levels): return
+        if self.partial[k] is None:
+            self.partial[k] = [t, lo.copy(), hi.copy(), np.zeros_like(mean), np.zeros(len(mean)), 0]
+        p = self.partial[k]
+        np.fmin(p[1], lo, out=p[1])
+        np.fmax(p[2], hi, out=p[2])
+        valid = ~np.isnan(mean)
+        p[3][valid] += mean[valid]
+        p[4] += valid
+        p[5] += 1
+        if p[5] < self.factor: return
+        self.partial[k] = None
+        with np.errstate(invalid="ignore", divide="ignore"):
+            bucket_mean = np.where(p[4] > 0, p[3] / p[4], np.nan)
+        self.levels[k].append(p[0], p[1], p[2], bucket_mean)
+        self._feed(k + 1, p[0], p[1], p[2], bucket_mean)
+
+    def view(self, span, now=None):
+        # time, min, max and mean over the last span seconds, from the finest level reaching back that far
+        if self.samples == 0:
+            return np.empty(0), np.empty((0, self.channels)), np.empty((0, self.channels)), np.empty((0, self.channels))
+        if now is None: now = self.levels[0].time[(self.levels[0].next - 1) % len(self.levels[0].time)]
+        start = now - span
+        chosen = self.levels[-1]
+        for level in self.levels:
+            if level.count == 0: break
+            chosen = level
+            # a level that falls a few samples short of the span still beats one with factor times fewer points
+            if level.count < len(level.time) or level.ordered()[0][0] <= start + 0.05 * span: break
+        t, lo, hi, mean = chosen.ordered()
+        keep = t >= start
+        return t[keep], lo[keep], hi[keep], mean[keep]
+
+def strip_coords(t, lo, hi, mean, t0, t1, x0, x1, y0, y1):
+    # Canvas coordinates of one channel in the box (x0, y0)-(x1, y1): the min/max envelope as a polygon and the mean as a
+    # line, as flat lists, and the value range they are scaled to. Buckets without a value are left out.
+    ok = ~np.isnan(mean)
+    if np.count_nonzero(ok) < 2:
+        return None, None, None
+    t, lo, hi, mean = t[ok], lo[ok], hi[ok], mean[ok]
+    vmin, vmax = float(np.min(lo)), float(np.max(hi))
+    pad = (vmax - vmin) * 0.1 or max(abs(vmax) * 0.01, 0.5)
+    vmin, vmax = vmin - pad, vmax + pad
+    x = x0 + (t - t0) / max(t1 - t0, 1e-9) * (x1 - x0)
+    scale = lambda v: y1 - (v - vmin) / (vmax - vmin) * (y1 - y0)
+    envelope = np.concatenate((np.column_stack((x, scale(hi))), np.column_stack((x[::-1], scale(lo[::-1]))))).ravel().tolist()
+    line = np.column_stack((x, scale(mean))).ravel().tolist()
+    return envelope, line, (vmin, vmax)
+
+class trend_plot(ttk.Frame):
+    # A span selector over a Canvas of one strip per channel. add_record can be called from any thread: records are queued
+    # and taken in by the Tk mainloop every interval_ms, and the canvas is redrawn at most every redraw_ms, only if
+    # something changed.
+    def __init__(self, master, capacity=600, factor=6, levels=5, width=480, strip_height=64, interval_ms=200, redraw_ms=1000, **kwargs):
+        super().__init__(master, **kwargs)
+        self.buffer = trend_buffer(len(CHANNELS), capacity, factor, levels)
+        self.records = queue.SimpleQueue()
+        self.width = width
+        self.strip_height = strip_height
+        self.interval_ms = interval_ms
+        self.redraw_ms = redraw_ms
+        self.span = StringVar(self, SPANS[0][0])
+        self.dirty = False
+        self.last_redraw = 0.0
+        ttk.Label(self, text="Trend over").grid(column=0, row=0, sticky='w')
+        ttk.Combobox(self, textvariable=self.span, values=[label for label, _ in SPANS], state='readonly', width=8).grid(column=1, row=0, sticky='w')
+        self.span.trace_add("write", lambda *args: self.redraw())
+        self.canvas = Canvas(self, width=width, height=strip_height * len(CHANNELS), background='white')
+        self.canvas.grid(column=0, row=1, columnspan=2)
+        self.after(self.interval_ms, self.pump)
+
+    def add_record(self, record):
+        # a telemetry_recorder listener
+        self.records.put((float(record["time"]), record_values(record)))
+
+    def pump(self):
+        while True:
+            try:
+                t, values = self.records.get_nowait()
+            except queue.Empty:
+                break
+            self.buffer.add(t, values)
+            self.dirty = True
+        if self.dirty and time.monotonic() - self.last_redraw >= self.redraw_ms / 1000:
+            self.redraw()
+        self.after(self.interval_ms, self.pump)
+
+    def redraw(self):
+        self.dirty = False
+        self.last_redraw = time.monotonic()
+        c = self.canvas
+        c.delete("all")
+        span = dict(SPANS)[self.span.get()]
+        t, lo, hi, mean = self.buffer.view(span)
+        t1 = t[-1] if len(t) else time.time()
+        t0 = t1 - span
+        left, right = 4, self.width - 4
+        for i, (name, label, unit) in enumerate(CHANNELS):
+            top = i * self.strip_height
+            bottom = top + self.strip_height - 1
+            c.create_line(0, bottom, self.width, bottom, fill='#dddddd')
+            envelope, line, limits = strip_coords(t, lo[:, i], hi[:, i], mean[:, i], t0, t1, left, right, top + 14, bottom - 2)
+            if envelope is None:
+                c.create_text(left, top + 2, anchor='nw', text=f"{label}: no data", fill='#888888')
+                continue
+            c.create_polygon(envelope, fill='#c8daf0', outline='')
+            c.create_line(line, fill='#1f5fa8')
+            last = mean[:, i][~np.isnan(mean[:, i])][-1]
+            c.create_text(left, top + 2, anchor='nw', text=f"{label}: {last:.3g} {unit}  (min {np.nanmin(lo[:, i]):.3g}, max {np.nanmax(hi[:, i]):.3g})")
+
+if __name__ == '__main__':
+    import argparse
+    from tkinter import Tk
+    from telemetry import load_records, TELEMETRY_DIR
+
+    parser = argparse.ArgumentParser(description="Show the trends of a recorded test run")
+    parser.add_argument("name", help="run name, e.g. run_0")
+    parser.add_argument("--dir", default=TELEMETRY_DIR)
+    args = parser.parse_args()
+
+    root = Tk()
+    root.title(f"Basys 3 Test trends: {args.name}")
+    plot = trend_plot(root)
+    plot.grid()
+    for record in load_records(args.name, args.dir):
+        plot.add_record(record)
+    root.mainloop()
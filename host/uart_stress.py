@@ -0,0 +1,63 @@
+import argparse
+import json
+import logging
+import test
+from benchmark import parse_fault
+
+# Characterizes the UART link at its full rate: random bursts of up to 255 bytes are echoed back to back for as long as
+# asked, with the DIO test running in the chosen mode, so the bit error rate can be measured under EMC immunity
+# conditions. The DIO status is checked before and after, to tell a disturbed link from a disturbed board.
+#   python uart_stress.py COM4 --seconds 60 --dio-mode 1
+#   python uart_stress.py --sim --fault corrupt_rate=0.001
+
+DIO_MODES = {
+    "off":         test.DIO_MODE_OFF,
+    "top_bottom":  test.DIO_MODE_IMMUNITY_TOP_TO_BOTTOM,
+    "port_pairs":  test.DIO_MODE_IMMUNITY_PORT_PAIRS,
+    "emissions":   test.DIO_MODE_EMISSIONS,
+}
+
+def run_stress(port, seconds, size, bursts, dio_mode, dio_divider):
+    phase = test.DioDefaultPhase(dio_divider)
+    test.StartDio(port, dio_mode, phase, dio_divider)
+    stats = test.EchoStress(port, seconds, size, bursts)
+    dio_passed = test.CheckDio(port)
+    summary = stats.summary()
+    summary.update(dio_mode=dio_mode, dio_divider=dio_divider, dio_passed=dio_passed)
+    return summary
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure the throughput and bit error rate of a board's UART")
+    parser.add_argument("port", nargs="?", help="serial port of the board")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--size", type=int, default=test.ECHO_MAX_SIZE, help=f"bytes per burst, 1 to {test.ECHO_MAX_SIZE}")
+    parser.add_argument("--bursts", type=int, default=4, help="bursts kept in flight")
+    parser.add_argument("--dio-mode", choices=DIO_MODES, default="top_bottom")
+    parser.add_argument("--dio-divider", type=int, default=49)
+    parser.add_argument("--report", help="also write the results to this JSON file")
+    parser.add_argument("--sim", action="store_true", help="run against board_sim instead of a board")
+    parser.add_argument("--fault", action="append", default=[], help="inject a board_sim fault, e.g. corrupt_rate=0.001")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    if not 0 < args.size <= test.ECHO_MAX_SIZE:
+        parser.error(f"--size must be 1 to {test.ECHO_MAX_SIZE}")
+    if args.sim:
+        from board_sim import board_sim
+        port = board_sim(usb_latency=0.016, timeout=test.SERIAL_TIMEOUT)
+        port.inject(**dict(parse_fault(f) for f in args.fault))
+    elif args.port:
+        port = test.ser.Serial(port=args.port, baudrate=115200, timeout=test.SERIAL_TIMEOUT)
+    else:
+        parser.error("give the serial port of the board, or --sim")
+
+    try:
+        summary = run_stress(port, args.seconds, args.size, args.bursts, DIO_MODES[args.dio_mode], args.dio_divider)
+    finally:
+        port.close()
+    for name, value in summary.items():
+        print(f"{name:<18} {value}")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(summary, f, indent=2)
+    raise SystemExit(0 if summary["mismatched_bytes"] == 0 and summary["lost_bursts"] == 0 and summary["slipped_bursts"] == 0 and summary["dio_passed"] else 1)
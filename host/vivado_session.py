@@ -0,0 +1,171 @@
+import logging
+import os
+import queue
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from test import kill_process_tree
+
+# One long-running `vivado -mode tcl` process that the programming steps are sent to, so Vivado's startup and the hardware
+# server connection are paid once rather than on every program_device / write_qspi_binfile call. The procs it runs are the
+# ones in hw_session.tcl, shared with the batch scripts. Each command is wrapped in a catch that prints a marker line with
+# its outcome, so the output of every command can be told apart and checked for errors.
+#   python vivado_session.py --stub       runs through the programming steps with vivado_stub.py standing in for Vivado
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STARTUP_TIMEOUT = 120.0 # Vivado takes tens of seconds to start
+COMMAND_TIMEOUT = 600.0 # a full QSPI erase and program takes minutes
+STOP_POLL_INTERVAL = 0.02 # how often a command waiting for its output checks for a stop request
+MARKER = "@@vivado_session"
+MARKER_PATTERN = re.compile(re.escape(MARKER) + r" (\d+) (OK|ERROR) ?(.*)")
+
+def tcl_quote(text):
+    # braces stop Tcl from substituting anything inside; Vivado takes forward slashes on Windows too
+    return "{" + str(text).replace("\\", "/") + "}"
+
+class vivado_result:
+    def __init__(self, command, ok, output, error, seconds):
+        self.command = command
+        self.ok = ok
+        self.output = output # every line printed by the command
+        self.error = error # message of the Tcl error, or of the first ERROR: line Vivado printed
+        self.seconds = seconds
+    def __bool__(self):
+        return self.ok
+
+class vivado_session:
+    def __init__(self, command=("vivado",), startup_timeout=STARTUP_TIMEOUT, timeout=COMMAND_TIMEOUT):
+        self.command = list(command) # e.g. [sys.executable, "vivado_stub.py"] to run without Vivado
+        self.startup_timeout = startup_timeout
+        self.timeout = timeout
+        self.proc = None
+        self.lines = None
+        self.token = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self, stop=None):
+        if self.running: return True
+        # resolve the executable up front, so vivado.bat is found on Windows without going through a shell
+        executable = shutil.which(self.command[0]) or self.command[0]
+        logging.info(f"Starting Vivado session: {' '.join(self.command)}")
+        self.proc = subprocess.Popen([executable] + self.command[1:] + ["-mode", "tcl", "-nolog", "-nojournal"],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                     text=True, bufsize=1, cwd=SCRIPT_DIR,
+                                     start_new_session=sys.platform != "win32") # its own process group, see kill
+        # pipes can't be waited on with a timeout on Windows, so a thread hands the output over line by line
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read_output, args=(self.proc.stdout, self.lines), daemon=True).start()
+        result = self._run(f"source {tcl_quote(os.path.join(SCRIPT_DIR, 'hw_session.tcl'))}", self.startup_timeout, stop)
+        if not result:
+            if stop is not None and stop.is_set(): return False
+            logging.error(f"Vivado session failed to start: {result.error}")
+            self.close()
+            return False
+        logging.info(f"Vivado session ready after {result.seconds:.1f} seconds")
+        return True
+
+    def _read_output(self, stdout, lines):
+        for line in stdout:
+            lines.put(line.rstrip("\r\n"))
+        lines.put(None) # end of output, the process has exited
+
+    def _run(self, tcl, timeout, stop=None):
+        self.token += 1
+        token = self.token
+        wrapped = (f"if {{[catch {{{tcl}}} session_result]}} {{puts \"{MARKER} {token} ERROR [string map [list \\n {{ }}] $session_result]\"}} "
+                   f"else {{puts \"{MARKER} {token} OK\"}}; flush stdout")
+        start = time.perf_counter()
+        output = []
+        try:
+            self.proc.stdin.write(wrapped + "\n")
+            self.proc.stdin.flush()
+        except OSError as e:
+            return vivado_result(tcl, False, output, f"Vivado session is gone: {e}", 0)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                line = self.lines.get(timeout=min(STOP_POLL_INTERVAL, max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                if stop is not None and stop.is_set():
+                    self.kill() # a command can't be interrupted, the next one starts a fresh session
+                    return vivado_result(tcl, False, output, "Stopped", time.perf_counter() - start)
+                if time.monotonic() < deadline: continue
+                self.close() # its state is unknown now, the next command starts a fresh session
+                return vivado_result(tcl, False, output, f"No answer after {timeout} seconds", time.perf_counter() - start)
+            if line is None:
+                self.proc = None
+                return vivado_result(tcl, False, output, "Vivado exited", time.perf_counter() - start)
+            match = MARKER_PATTERN.search(line) # may follow a "Vivado% " prompt on the same line
+            if match is None or int(match.group(1)) != token:
+                output.append(line)
+                logging.debug(f"vivado: {line}")
+                continue
+            errors = [l for l in output if l.startswith("ERROR:")]
+            ok = match.group(2) == "OK" and not errors
+            error = match.group(3) if match.group(2) == "ERROR" else (errors[0] if errors else None)
+            return vivado_result(tcl, ok, output, error, time.perf_counter() - start)
+
+    def run(self, tcl, timeout=None, stop=None):
+        # with stop, a threading.Event, the command is abandoned and the session killed as soon as stop is set
+        with self.lock:
+            if not self.start(stop):
+                return vivado_result(tcl, False, [], "Vivado session failed to start", 0)
+            result = self._run(tcl, self.timeout if timeout is None else timeout, stop)
+        if not result and not (stop is not None and stop.is_set()):
+            logging.error(f"Vivado command failed: {tcl}: {result.error}")
+        return result
+
+    def program_bitstream(self, target=None, stop=None):
+        result = self.run(f"open_target {tcl_quote(target or '')}; program_bitstream", stop=stop)
+        if result: logging.info(f"Programmed bitstream in {result.seconds:.1f} seconds")
+        return result
+
+    def program_cfgmem(self, binfile, target=None, stop=None):
+        result = self.run(f"open_target {tcl_quote(target or '')}; program_cfgmem {tcl_quote(binfile)}", stop=stop)
+        if result: logging.info(f"Programmed QSPI flash in {result.seconds:.1f} seconds")
+        return result
+
+    def close(self):
+        if self.proc is None: return
+        proc, self.proc = self.proc, None
+        try:
+            proc.stdin.write("exit\n")
+            proc.stdin.flush()
+            proc.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            kill_process_tree(proc)
+
+    def kill(self):
+        # the process started is the vivado launcher, killing only that would leave Vivado holding the hardware target
+        if self.proc is None: return
+        proc, self.proc = self.proc, None
+        kill_process_tree(proc)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Program a board through a persistent Vivado session")
+    parser.add_argument("--stub", action="store_true", help="use vivado_stub.py instead of Vivado")
+    parser.add_argument("--target", help="JTAG cable serial number")
+    parser.add_argument("--repeat", type=int, default=2, help="times to run the programming steps")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    command = [sys.executable, os.path.join(SCRIPT_DIR, "vivado_stub.py")] if args.stub else ["vivado"]
+    with vivado_session(command) as session:
+        for _ in range(args.repeat):
+            session.program_cfgmem(os.path.join(SCRIPT_DIR, "random_data.bin"), args.target)
+            session.program_bitstream(args.target)
@@ -0,0 +1,94 @@
+import os
+import re
+import sys
+import time
+
+# Stands in for the vivado executable, the way board_sim stands in for the board: it understands the procs in
+# hw_session.tcl and takes about as long as Vivado does for each of them, scaled by VIVADO_STUB_TIME_SCALE.
+# Runs in -mode tcl for vivado_session.py, reading commands from stdin, and in -mode batch -source <script> for the batch
+# scripts. VIVADO_STUB_FAIL names a proc that fails, e.g. VIVADO_STUB_FAIL=program_cfgmem.
+
+TIMES = {
+    "startup":           20.0,
+    "connect":           3.0,  # open_hw_manager and connect_hw_server
+    "open_target":       1.0,
+    "program_bitstream": 5.0,
+    "program_cfgmem":    40.0,
+}
+
+time_scale = float(os.environ.get("VIVADO_STUB_TIME_SCALE", "1.0"))
+fail = os.environ.get("VIVADO_STUB_FAIL", "")
+state = {"connected": False, "target": None}
+
+def spend(name):
+    time.sleep(TIMES[name] * time_scale)
+
+def run_proc(name, args):
+    # returns the error message of the proc, or None
+    if name == "source":
+        return None
+    if name == "open_target":
+        if not state["connected"]:
+            spend("connect")
+            state["connected"] = True
+        target = f"localhost:3121/xilinx_tcf/Digilent/{args.strip('{}') or '210183A00000'}A"
+        if state["target"] != target:
+            spend("open_target")
+            state["target"] = target
+        print(f"INFO: Opened hardware target {target}")
+    elif name in ("program_bitstream", "program_cfgmem"):
+        spend(name)
+        if fail == name:
+            print("ERROR: [Labtools 27-3165] End of startup status: LOW")
+            return "ERROR: [Common 17-39] 'program_hw_devices' failed due to earlier errors."
+        if name == "program_cfgmem": print("QSPI programming complete")
+    else:
+        return f'invalid command name "{name}"'
+    return None
+
+def run_commands(tcl):
+    for command in tcl.split(";"):
+        command = command.strip()
+        if not command: continue
+        name, _, args = command.partition(" ")
+        error = run_proc(name, args)
+        if error: return error
+    return None
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    mode = args[args.index("-mode") + 1] if "-mode" in args else "gui"
+    print("****** Vivado v2023.2 (64-bit) stub")
+    sys.stdout.flush()
+    spend("startup")
+
+    if mode == "batch":
+        script = args[args.index("-source") + 1]
+        tclargs = args[args.index("-tclargs") + 1:] if "-tclargs" in args else []
+        with open(script) as f:
+            for line in f:
+                line = line.strip().replace("[lindex $argv 0]", tclargs[0] if tclargs else "")
+                if not line or line.startswith("#") or line.startswith("source"): continue
+                error = run_commands(re.sub(r"\[.*\]", "random_data.bin", line))
+                if error:
+                    print(error)
+                    sys.exit(1)
+        sys.exit(0)
+
+    # -mode tcl: every command comes wrapped by vivado_session as
+    #   if {[catch {<tcl>} session_result]} {puts "<marker> <token> ERROR ..."} else {puts "<marker> <token> OK"}; flush stdout
+    wrapped = re.compile(r"catch \{(.*)\} session_result\]\} \{puts \"(\S+) (\d+) ERROR")
+    while True:
+        sys.stdout.write("Vivado% ")
+        sys.stdout.flush()
+        line = sys.stdin.readline()
+        if not line or line.strip() == "exit": break
+        match = wrapped.search(line)
+        if match is None:
+            error = run_commands(line)
+            if error: print(error)
+            continue
+        tcl, marker, token = match.groups()
+        error = run_commands(tcl)
+        print(f"{marker} {token} ERROR {error}" if error else f"{marker} {token} OK")
+        sys.stdout.flush()
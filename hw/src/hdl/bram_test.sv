@@ -33,6 +33,12 @@ module bram_test #(
     output logic [31:0] status_tdata, // "0" + {reset busy, done, test passed}
     output logic        status_tvalid,
     input  logic        status_tready,
+    input  logic        control_tvalid,
+    input  logic [31:0] control_tdata, // "0" + {clear counters, continuous}
+    output logic [31:0] pass_count, // passes read back clean since the counters were cleared
+    output logic [31:0] fail_count, // passes with at least one word read back wrong
+    output logic [31:0] error_count, // words read back wrong, counted once per bank
+    output logic [31:0] first_fail, // {valid, bank 1 wrong, bank 0 wrong, pass[15:0], address[12:0]} of the first wrong word
     output logic        error
 );
     localparam integer ADDR_WIDTH = 13;
@@ -55,6 +61,12 @@ module bram_test #(
     logic en_bank_1;
     always_comb {en_bank_1, loops, addr_max} = addr_max_reg;
     
+    // In continuous mode the test never stops after its last loop: every pass writes the next stretch of the LFSR
+    // sequence, so the pattern reseeds itself, and the counters below keep track of the passes and errors. Clearing
+    // continuous lets the pass under way finish and the test end as a one-shot test does.
+    logic continuous;
+    logic clear_counters;
+    
     enum integer {
         RESET_BUSY,
         WAIT_FOR_SEED,
@@ -86,7 +98,7 @@ module bram_test #(
         SWITCHOVER:         if (addr + 1 == ADDR_READ_VALID)    state <= READ;
         READ:               if (addr == addr_max)               state <= FLUSH;
         FLUSH:              if (addr + 1 == ADDR_READ_VALID) begin
-                                if (loops_reg == 0)
+                                if (loops_reg == 0 && !continuous)
                                     state <= WAIT_FOR_STATUS;
                                 else
                                     state <= WRITE;
@@ -95,6 +107,15 @@ module bram_test #(
         endcase
     end
     
+    always_ff @(posedge clk) begin
+        if (reset) begin
+            continuous <= 0;
+        end else if (control_tvalid) begin
+            continuous <= control_tdata[0];
+        end
+    end
+    always_comb clear_counters = control_tvalid && control_tdata[1];
+    
     always_ff @(posedge clk) begin
         if (reset) begin
             loops_reg <= 0;
@@ -168,6 +189,51 @@ module bram_test #(
     always_comb status_tdata[31:2] = rdata_compare[31:2];
     always_comb status_tvalid = 1;
     
+    logic mismatch_0;
+    logic mismatch_1;
+    logic pass_end;
+    logic pass_failed;
+    always_comb mismatch_0 = (state == READ && addr >= ADDR_READ_VALID && rdata_compare != rdata_0);
+    always_comb mismatch_1 = (state == READ && addr >= ADDR_READ_VALID && rdata_compare != rdata_1 && en_bank_1);
+    always_comb pass_end = (state == FLUSH && addr + 1 == ADDR_READ_VALID);
+    
+    always_ff @(posedge clk) begin
+        if (reset) begin
+            pass_failed <= 0;
+        end else if (state == WAIT_FOR_SEED || pass_end) begin
+            pass_failed <= 0;
+        end else if (mismatch_0 || mismatch_1) begin
+            pass_failed <= 1;
+        end
+    end
+    
+    always_ff @(posedge clk) begin
+        if (reset || clear_counters) begin
+            pass_count <= 0;
+            fail_count <= 0;
+        end else if (pass_end && pass_failed) begin
+            fail_count <= fail_count + 1;
+        end else if (pass_end) begin
+            pass_count <= pass_count + 1;
+        end
+    end
+    
+    always_ff @(posedge clk) begin
+        if (reset || clear_counters) begin
+            error_count <= 0;
+        end else if (mismatch_0 || mismatch_1) begin
+            error_count <= error_count + mismatch_0 + mismatch_1;
+        end
+    end
+    
+    // the data compared in READ was read ADDR_READ_VALID addresses earlier
+    always_ff @(posedge clk) begin
+        if (reset || clear_counters) begin
+            first_fail <= 0;
+        end else if (!first_fail[31] && (mismatch_0 || mismatch_1)) begin
+            first_fail <= {1'b1, mismatch_1, mismatch_0, pass_count[15:0] + fail_count[15:0], addr - ADDR_READ_VALID};
+        end
+    end
     always_comb wen = (state == WRITE);
     always_comb en = (state == WRITE || state == SWITCHOVER || state == READ);    
     
@@ -176,6 +176,11 @@ module top (
     localparam [7:0] BRAM_STATUS_ADDR = 32;       // READ-ONLY
     localparam [7:0] DIO_COUNTER_MAX_ADDR = 36;   // WRITE-ONLY
     localparam [7:0] DIO_OUTPUT_PHASE_ADDR = 40;  // WRITE-ONLY
+    localparam [7:0] BRAM_CONTROL_ADDR = 44;      // WRITE-ONLY
+    localparam [7:0] BRAM_PASS_COUNT_ADDR = 48;   // READ-ONLY
+    localparam [7:0] BRAM_FAIL_COUNT_ADDR = 52;   // READ-ONLY
+    localparam [7:0] BRAM_ERROR_COUNT_ADDR = 56;  // READ-ONLY
+    localparam [7:0] BRAM_FIRST_FAIL_ADDR = 60;   // READ-ONLY
     
     logic [7:0] xadc_set_addr_tdata;
     logic       xadc_set_addr_tvalid;
@@ -201,6 +206,12 @@ module top (
     logic [31:0] bram_status_tdata;
     logic        bram_status_tvalid;
     logic        bram_status_tready;
+    logic [31:0] bram_control_tdata; /* {clear counters, continuous} */
+    logic        bram_control_tvalid;
+    logic [31:0] bram_pass_count;
+    logic [31:0] bram_fail_count;
+    logic [31:0] bram_error_count;
+    logic [31:0] bram_first_fail;
     logic [31:0] dio_counter_max_tdata;
     logic        dio_counter_max_tvalid;
     logic        dio_counter_max_tready;
@@ -226,6 +237,10 @@ module top (
         DIO_STATUS_ADDR:    control_rdata = dio_status_tdata; // CLEAR-ON-READ
         PS2_POS_ADDR:       control_rdata = ps2_pos_tdata; // READ-ONLY
         BRAM_STATUS_ADDR:   control_rdata = bram_status_tdata; // READ-ONLY
+        BRAM_PASS_COUNT_ADDR:   control_rdata = bram_pass_count; // READ-ONLY
+        BRAM_FAIL_COUNT_ADDR:   control_rdata = bram_fail_count; // READ-ONLY
+        BRAM_ERROR_COUNT_ADDR:  control_rdata = bram_error_count; // READ-ONLY
+        BRAM_FIRST_FAIL_ADDR:   control_rdata = bram_first_fail; // READ-ONLY
         default:            control_rdata = 'b0;
         endcase
     end
@@ -234,6 +249,7 @@ module top (
     always_comb dio_settings_tdata     = wdata_reg;
     always_comb bram_seed_tdata        = wdata_reg;
     always_comb bram_addr_max_tdata    = wdata_reg;
+    always_comb bram_control_tdata     = wdata_reg;
     always_comb dio_output_phase_tdata = wdata_reg;
     always_comb dio_counter_max_tdata  = wdata_reg;
     
@@ -241,6 +257,7 @@ module top (
     always_comb dio_settings_tvalid     = write_strobe && (awaddr_reg == DIO_SETTINGS_ADDR);
     always_comb bram_seed_tvalid        = write_strobe && (awaddr_reg == BRAM_SEED_ADDR);
     always_comb bram_addr_max_tvalid    = write_strobe && (awaddr_reg == BRAM_ADDR_MAX_ADDR);
+    always_comb bram_control_tvalid     = write_strobe && (awaddr_reg == BRAM_CONTROL_ADDR);
     always_comb dio_output_phase_tvalid = write_strobe && (awaddr_reg == DIO_OUTPUT_PHASE_ADDR);
     always_comb dio_counter_max_tvalid  = write_strobe && (awaddr_reg == DIO_COUNTER_MAX_ADDR);
     
@@ -363,6 +380,12 @@ module top (
         .status_tdata       (bram_status_tdata),
         .status_tvalid      (bram_status_tvalid),
         .status_tready      (bram_status_tready),
+        .control_tdata      (bram_control_tdata),
+        .control_tvalid     (bram_control_tvalid),
+        .pass_count         (bram_pass_count),
+        .fail_count         (bram_fail_count),
+        .error_count        (bram_error_count),
+        .first_fail         (bram_first_fail),
         .error              (bram_error)
     );
 endmodule
@@ -218,6 +218,35 @@ int SpiFlashQuadEnable(XSpi *SpiPtr)
 	return XST_SUCCESS;
 }
 
+void SpiFlashEnsureQuad(XSpi *SpiPtr)
+{
+	uint8_t StatusReg;
+
+	// the QE bit is non-volatile, only rewrite the status register when it is actually clear
+	if (SpiFlashGetStatus(SpiPtr, &StatusReg) != XST_SUCCESS || !(StatusReg & FLASH_SR_QE_MASK)) {
+		SpiFlashQuadEnable(SpiPtr);
+	}
+}
+
+int SpiFlashReadChunk(XSpi *SpiPtr, uint32_t Addr, uint8_t *Data, uint32_t ByteCount)
+{
+	uint8_t ReadBuffer[DUMP_CHUNK_SIZE + READ_WRITE_EXTRA_BYTES];
+	uint8_t WriteBuffer[DUMP_CHUNK_SIZE + READ_WRITE_EXTRA_BYTES];
+
+	if (ByteCount > DUMP_CHUNK_SIZE) {
+		return XST_FAILURE;
+	}
+
+	if (SpiFlashRead(SpiPtr, WriteBuffer, ReadBuffer, Addr, ByteCount) != XST_SUCCESS) {
+		return XST_FAILURE;
+	}
+
+	for (uint32_t i = 0; i < ByteCount; i++) {
+		Data[i] = ReadBuffer[READ_WRITE_EXTRA_BYTES + i];
+	}
+	return XST_SUCCESS;
+}
+
 uint32_t pickbit(uint32_t v, uint8_t bit) {
 	return (v >> bit) & 0x1;
 }
@@ -236,45 +265,69 @@ uint32_t LfsrNext(uint32_t lfsr)
 	return ((lfsr << 1) | (pickbit(lfsr, 31) ^ pickbit(lfsr, 21) ^ pickbit(lfsr, 1) ^ pickbit(lfsr, 0)));
 }
 
-int ValidateAgainstLfsr(XSpi *SpiPtr, const uint32_t seed, uint32_t *error_count, uint32_t *first_value_read, uint32_t *last_value_read)
+void ValidateStart(XSpi *SpiPtr, LfsrValidation *Validation, const uint32_t seed)
 {
-	const uint32_t flash_size = 128*1024; // A full flash read, 1024*1024 bytes, takes ~5 seconds;
-	const uint32_t row_size = 128;
-	uint32_t lfsr = seed;
-	*error_count = 0;
-	uint8_t ReadBuffer[row_size + READ_WRITE_EXTRA_BYTES];
-	uint8_t WriteBuffer[row_size + READ_WRITE_EXTRA_BYTES];
-
-	SpiFlashQuadEnable(SpiPtr);
-
-	for (uint32_t addr = 0; addr < flash_size; addr += row_size)
-	{
-		uint32_t *dataptr = (uint32_t*)(ReadBuffer + READ_WRITE_EXTRA_BYTES);
-		if (SpiFlashRead(SpiPtr, WriteBuffer, ReadBuffer, addr, row_size) != XST_SUCCESS) {
-			return XST_FAILURE;
-		}
-		
-		for (uint32_t i=0; i < row_size / sizeof(uint32_t); i++) {
-			// reverse((uint8_t*)dataptr);
-
-			if (lfsr == seed) *first_value_read = *dataptr;
-			
-			lfsr = LfsrNext(lfsr);
-			
-            uint32_t position = addr + i * sizeof(uint32_t);
-            
-			*last_value_read = *dataptr;
-
-			if (*dataptr != lfsr) {
-				(*error_count)++;
-			}
-			dataptr++;
+	SpiFlashEnsureQuad(SpiPtr);
+
+	Validation->seed = seed;
+	Validation->lfsr = seed;
+	Validation->addr = 0;
+	Validation->error_count = 0;
+	Validation->first_value_read = 0;
+	Validation->last_value_read = 0;
+	Validation->busy = 1;
+	Validation->result = XST_FAILURE;
+}
+
+int ValidateStep(XSpi *SpiPtr, LfsrValidation *Validation)
+{
+	uint8_t ReadBuffer[VALIDATE_ROW_SIZE + READ_WRITE_EXTRA_BYTES];
+	uint8_t WriteBuffer[VALIDATE_ROW_SIZE + READ_WRITE_EXTRA_BYTES];
+	uint32_t *dataptr = (uint32_t*)(ReadBuffer + READ_WRITE_EXTRA_BYTES);
+
+	if (!Validation->busy) {
+		return 1;
+	}
+
+	if (SpiFlashRead(SpiPtr, WriteBuffer, ReadBuffer, Validation->addr, VALIDATE_ROW_SIZE) != XST_SUCCESS) {
+		Validation->busy = 0;
+		Validation->result = XST_FAILURE;
+		return 1;
+	}
+
+	for (uint32_t i=0; i < VALIDATE_ROW_SIZE / sizeof(uint32_t); i++) {
+		// reverse((uint8_t*)dataptr);
+
+		if (Validation->lfsr == Validation->seed) Validation->first_value_read = *dataptr;
+
+		Validation->lfsr = LfsrNext(Validation->lfsr);
+
+		Validation->last_value_read = *dataptr;
+
+		if (*dataptr != Validation->lfsr) {
+			Validation->error_count++;
 		}
+		dataptr++;
 	}
 
-	if (*error_count == 0) {
-		return XST_SUCCESS;
-	} else {
-		return XST_FAILURE;
+	Validation->addr += VALIDATE_ROW_SIZE;
+	if (Validation->addr >= VALIDATE_FLASH_SIZE) {
+		Validation->busy = 0;
+		Validation->result = (Validation->error_count == 0) ? XST_SUCCESS : XST_FAILURE;
+		return 1;
 	}
-}
\ No newline at end of file
+	return 0;
+}
+
+int ValidateAgainstLfsr(XSpi *SpiPtr, const uint32_t seed, uint32_t *error_count, uint32_t *first_value_read, uint32_t *last_value_read)
+{
+	LfsrValidation Validation;
+
+	ValidateStart(SpiPtr, &Validation, seed);
+	while (!ValidateStep(SpiPtr, &Validation));
+
+	*error_count = Validation.error_count;
+	*first_value_read = Validation.first_value_read;
+	*last_value_read = Validation.last_value_read;
+	return Validation.result;
+}
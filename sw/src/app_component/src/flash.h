@@ -5,6 +5,26 @@
 #include "xspi.h"
 #include <xstatus.h>
 
+#define VALIDATE_FLASH_SIZE		(128*1024) /* A full flash read, 1024*1024 bytes, takes ~5 seconds */
+#define VALIDATE_ROW_SIZE		128
+#define DUMP_CHUNK_SIZE			VALIDATE_ROW_SIZE /* Bytes per CRC-checked chunk of a flash dump */
+
+/* Validation results besides XST_SUCCESS and XST_FAILURE, as reported by the 'p' command */
+#define VALIDATION_BUSY			2
+#define VALIDATION_IDLE			3
+
+/* State of an LFSR validation that is run one row at a time between UART commands */
+typedef struct {
+	uint32_t seed;
+	uint32_t lfsr;
+	uint32_t addr;
+	uint32_t error_count;
+	uint32_t first_value_read;
+	uint32_t last_value_read;
+	uint8_t busy;
+	uint8_t result;
+} LfsrValidation;
+
 /* Forward Declarations */
 
 int SpiInitialize(XSpi *SpiPtr, uint32_t BaseAddr);
@@ -15,10 +35,14 @@ int SpiFlashWriteEnable(XSpi *SpiPtr);
 int SpiFlashWriteDisable(XSpi *SpiPtr);
 int SpiFlashRead(XSpi *SpiPtr, uint8_t *WriteBuffer, uint8_t *ReadBuffer, uint32_t Addr, uint32_t ByteCount);
 int SpiFlashQuadEnable(XSpi *SpiPtr);
+void SpiFlashEnsureQuad(XSpi *SpiPtr);
+int SpiFlashReadChunk(XSpi *SpiPtr, uint32_t Addr, uint8_t *Data, uint32_t ByteCount);
 uint32_t pickbit(uint32_t v, uint8_t bit);
 void reverse(uint8_t buf[4]);
 uint32_t LfsrNext(uint32_t lfsr);
 
+void ValidateStart(XSpi *SpiPtr, LfsrValidation *Validation, const uint32_t seed);
+int ValidateStep(XSpi *SpiPtr, LfsrValidation *Validation);
 int ValidateAgainstLfsr(XSpi *SpiPtr, const uint32_t seed, uint32_t *error_count, uint32_t *first_value_read, uint32_t *last_value_read);
 
 void SpiHandler(void *CallBackRef, u32 StatusEvent, unsigned int ByteCount);
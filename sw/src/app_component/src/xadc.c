@@ -69,6 +69,25 @@ int Xadc_ReadData (uint16_t Data[Xadc_NumChannels])
 	return XST_SUCCESS;
 }
 
+int Xadc_EndOfSequence ()
+{
+	// whether the sequencer finished a sequence since the last call, without waiting for one; reading the status clears it
+	XSysMon *InstancePtr = (&Xadc);
+
+	return (XSysMon_GetStatus(InstancePtr) & XSM_SR_EOS_MASK) == XSM_SR_EOS_MASK;
+}
+
+int Xadc_ReadSample (uint16_t Data[Xadc_NumChannels])
+{
+	// the last conversion of every channel, as of the end of sequence seen by Xadc_EndOfSequence
+	XSysMon *InstancePtr = (&Xadc);
+
+	for (uint8_t Channel = 0; Channel < Xadc_NumChannels; Channel++) {
+		Data[Channel] = XSysMon_GetAdcData(InstancePtr, Xadc_Channels[Channel]);
+	}
+	return XST_SUCCESS;
+}
+
 int XadcPrint() {
 	uint16_t rawdata[32];
 	uint32_t data;
@@ -15,10 +15,15 @@ static const uint32_t Xadc_Channels[4] = {
 	XSM_CH_VBRAM
 };
 
+#define XADC_BURST_MAX 1024 /* readings of every channel in one burst */
+#define XADC_BURST_RING 256 /* of them held at a time while the burst goes out, 2 KiB */
+
 /* Forward Declarations */
 
 int XadcInitialize(uint32_t BaseAddress);
 int Xadc_ReadData (uint16_t Data[Xadc_NumChannels]);
+int Xadc_EndOfSequence ();
+int Xadc_ReadSample (uint16_t Data[Xadc_NumChannels]);
 int XadcPrint();
 
 #endif
\ No newline at end of file